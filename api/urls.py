@@ -10,6 +10,8 @@ urlpatterns = [
     url(r'^getOrganizations/$', views.get_organizations, name='get_organizations'),
     url(r'^getPlacesForOrganization/$', views.get_places_for_organization, name='get_places_for_organization'),
     url(r'^getPlaces/$', views.get_all_places, name='get_all_places'),
+    url(r'^places_in_bbox/$', views.list_places_in_bbox, name='list_places_in_bbox'),
+    url(r'^places_around/$', views.list_places_around, name='list_places_around'),
     url(r'^getDates/$', views.get_dates, name='get_dates'),
     url(r'^getUsers/(?P<organization_pk>[0-9]+)/(?P<event_pk>[0-9]+)/$', views.list_users, name='list_users'),
     url(r'^addUsers/$', views.add_users, name='add_users'),
@@ -17,5 +19,10 @@ urlpatterns = [
     url(r'^list_events_user/(?P<context_pk>[0-9]+)/$', views.list_events_in_context, {'context_user':'yes'}, name='list_events_user'),
     url(r'^list_events_place/(?P<context_pk>[0-9]+)/$', views.list_events_in_context, {'context_place':'yes'}, name='list_events_place'),
     url(r'^list_events_organization/(?P<context_pk>[0-9]+)/$', views.list_events_in_context, {'context_org':'yes'}, name='list_events_organization'),
+    url(r'^list_events_page/$', views.list_events_page, name='list_events_page'),
+    url(r'^list_event_facets/$', views.list_event_facets, name='list_event_facets'),
+    url(r'^list_events_page_user/(?P<context_pk>[0-9]+)/$', views.list_events_page, {'context_user':'yes'}, name='list_events_page_user'),
+    url(r'^list_events_page_place/(?P<context_pk>[0-9]+)/$', views.list_events_page, {'context_place':'yes'}, name='list_events_page_place'),
+    url(r'^list_events_page_organization/(?P<context_pk>[0-9]+)/$', views.list_events_page, {'context_org':'yes'}, name='list_events_page_organization'),
     url(r'^book/$', views.book_event, name='book'),
 ]
@@ -1,15 +1,24 @@
-from itsdangerous import URLSafeSerializer, BadData
-from django.http import JsonResponse, HttpResponse
+from itsdangerous import BadData
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import render
 from django.urls import reverse
 from users.models import CustomUser
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Exists, OuterRef, Avg, Count
+from django.db.models.functions import Substr
+from django.utils.text import Truncator
 from functools import reduce
 from operator import __or__ as OR
 
 from time import strftime
-import locale
-from plateformeweb.models import Event, Organization, OrganizationPerson, Place
+from plateformeweb.models import (Activity, Event, Organization,
+                                  OrganizationPerson, Place)
+from plateformeweb import booking, dates, geo, tokens
+from plateformeweb.cache import bump_version, versioned_condition
 from urllib.parse import parse_qs
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import binascii
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils import timezone
 import datetime
 from django.db.models.signals import post_save
@@ -17,9 +26,9 @@ from actstream import action
 from actstream.actions import follow, unfollow
 
 from django.template.loader import render_to_string
-from actstream.models import actor_stream
+from actstream.models import Action, actor_stream
 
-from plateformeweb.views import send_notification
+from plateformeweb.views import send_notification, send_booking_mail
 
 from post_office import mail
 from django.core.mail import send_mail
@@ -28,58 +37,18 @@ from django.utils.timezone import now
 
 ### mailers ###
 def cancel_reservation(request, token):
-    s = URLSafeSerializer('some_secret_key', salt='cancel_reservation')
-    ret = s.loads(token)
-    event_id = ret['event_id']
-    user_id = ret['user_id']
+    try:
+        event_id, user_id = tokens.load_cancel_token(token)
+    except BadData:
+        return HttpResponseBadRequest("Lien d'annulation invalide ou expiré")
     event = Event.objects.get(pk=event_id)
     user = CustomUser.objects.get(pk=user_id)
     context = {'event': event, 'user': user}
-    attendees = event.attendees.all()
-    if user in attendees:
-        event.attendees.remove(user)
-        event.available_seats += 1
-        event.save()
+    if booking.cancel_seat(event, user):
         return render(request, 'mail/cancel_ok.html', context)
     else:
         return render(request, 'mail/cancel_failed.html', context)
 
-def send_booking_mail(request, user, event):
-    user_id = user.id
-    event_id = event.id
-
-    serial = URLSafeSerializer('some_secret_key',
-                                salt='cancel_reservation')
-    data = {'event_id': event_id, 'user_id': user_id}
-
-    cancel_token = serial.dumps(data)
-    cancel_url = reverse('cancel_reservation', args=[cancel_token])
-    cancel_url = request.build_absolute_uri(cancel_url)
-
-    event_url = reverse('event_detail', args=[event_id, event.slug])
-    event_url = request.build_absolute_uri(event_url)
-
-    params = {'cancel_url': cancel_url,
-                'event_url': event_url,
-                'event': event}
-
-    msg_plain = render_to_string('mail/relance.html',
-                                params)
-    msg_html = render_to_string('mail/relance.html',
-                                params)
-
-    date = event.starts_at.date().strftime("%d %B")
-    location = event.location.name
-    subject = "Votre réservation pour le " + date + " à " + location
-
-    mail.send(
-        [user.email],
-        'no-reply@atelier-soude.fr',
-        subject=subject,
-        message=msg_plain,
-        html_message=msg_html
-    )
-
 
 ### event ###
 def delete_event(request):
@@ -107,17 +76,18 @@ def set_present(request):
         # TODO change this
         return HttpResponse("Circulez, il n'y a rien à voir")
     else:
-        serial = URLSafeSerializer('some_secret_key',
-                                    salt='presence')
-
-        data = serial.loads(request.POST['idents'])
-        event_id = data['event_id']
-        user_id = data['user_id']
+        try:
+            event_id, user_id = tokens.load_presence_token(
+                request.POST['idents'])
+        except BadData:
+            return HttpResponseBadRequest("Jeton invalide")
 
         person = CustomUser.objects.get(pk=user_id)
         event = Event.objects.get(pk=event_id)
-        event.attendees.remove(person)
-        event.presents.add(person)
+        # people are either attendees or present, never both
+        with transaction.atomic():
+            event.attendees.remove(person)
+            event.presents.add(person)
         action.send(request.user, verb="a validé la présence de", action_object=person,  target=event)   
 
         return JsonResponse({'status': "OK", 'user_id': user_id})
@@ -127,17 +97,18 @@ def set_absent(request):
         # TODO change this
         return HttpResponse("Circulez, il n'y a rien à voir")
     else:
-        serial = URLSafeSerializer('some_secret_key',
-                                    salt='presence')
-
-        data = serial.loads(request.POST['idents'])
-        event_id = data['event_id']
-        user_id = data['user_id']
+        try:
+            event_id, user_id = tokens.load_presence_token(
+                request.POST['idents'])
+        except BadData:
+            return HttpResponseBadRequest("Jeton invalide")
 
         person = CustomUser.objects.get(pk=user_id)
         event = Event.objects.get(pk=event_id)
-        event.presents.remove(person)
-        event.attendees.add(person)
+        # people are either attendees or present, never both
+        with transaction.atomic():
+            event.presents.remove(person)
+            event.attendees.add(person)
         action.send(request.user, verb="a dé-validé la présence de", action_object=person,  target=event)   
 
         return JsonResponse({'status': "OK", 'user_id': user_id})
@@ -156,44 +127,115 @@ def get_organizations(request):
 
         return JsonResponse({'status': "OK", "organizations": volunteer_of})
 
+def _serialize_places(places):
+    ret = {}
+    for place in places.select_related('organization', 'type', 'address'):
+        organization = place.organization
+        organization_detail_url = reverse('organization_detail',
+                                          args=[organization.pk,
+                                                organization.slug])
+
+        place_detail_url = reverse('place_detail',
+                                   args=[place.pk,
+                                         place.slug])
+
+        ret[place.pk] = {
+            'pk': place.pk,
+            'name': place.name,
+            'place_detail_url': place_detail_url,
+            "address": place.address.formatted,
+            'type': place.type.name,
+            'organization': organization.name,
+            'organization_url': organization_detail_url,
+            'latitude': place.latitude,
+            'longitude': place.longitude,
+            'picture': place.picture.url,
+            'description': Truncator(place.description_html).chars(
+                250, html=True),
+            }
+    return ret
+
+@versioned_condition('places', 'organizations')
 def get_all_places(request):
     if request.method != 'GET':
         # TODO change this
         return HttpResponse("Circulez, il n'y a rien à voir")
     else:
-        places = {}
-        places_qs = Place.objects.all()
-        for place in places_qs:
-            place_slug = place.slug
-            place_pk = place.pk
-            organization = place.organization
-            organization_detail_url = reverse('organization_detail',
-                                              args=[organization.pk,
-                                                    organization.slug])
-
-            place_detail_url = reverse('place_detail',
-                                       args=[place_pk,
-                                             place_slug])
-
-            longitude = place.address.longitude
-            latitude = place.address.latitude
-
-            places[place_pk] = {
-                'pk': place_pk,
-                'name': place.name,
-                'place_detail_url': place_detail_url,
-                "address": place.address.formatted,
-                'type': place.type.name,
-                'organization': place.organization.name,
-                'organization_url': organization_detail_url,
-                'latitude': latitude,
-                'longitude': longitude,
-                'picture': place.picture.url,
-                'description': place.description[:250],
-                }
-
+        places = _serialize_places(Place.objects.all())
         return JsonResponse({'status': "OK", "places": places})
 
+# below this zoom level the map gets clusters of places instead of places
+PLACES_CLUSTER_MAX_ZOOM = 13
+# km
+PLACES_DEFAULT_RADIUS = 10
+PLACES_MAX_RADIUS = 500
+
+def _places_in_box(south, west, north, east):
+    # the (latitude, longitude) index narrows the latitude band, west > east
+    # when the box crosses the antimeridian
+    places = Place.objects.filter(latitude__gte=south, latitude__lte=north)
+    if west <= east:
+        return places.filter(longitude__gte=west, longitude__lte=east)
+    return places.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+
+@versioned_condition('places', 'organizations')
+def list_places_in_bbox(request):
+    if request.method != 'GET':
+        # TODO change this
+        return HttpResponse("Circulez, il n'y a rien à voir")
+    else:
+        try:
+            south, west, north, east = (float(request.GET[corner]) for corner
+                                        in ('south', 'west', 'north', 'east'))
+            zoom = int(request.GET.get('zoom', PLACES_CLUSTER_MAX_ZOOM))
+        except (KeyError, ValueError):
+            return JsonResponse({'status': -1})
+
+        places = _places_in_box(south, west, north, east)
+        if zoom >= PLACES_CLUSTER_MAX_ZOOM:
+            return JsonResponse({'status': "OK",
+                                 "places": _serialize_places(places)})
+
+        # places sharing a geohash prefix are counted in the database
+        precision = geo.cluster_precision(zoom)
+        cells = (places.annotate(cell=Substr('geohash', 1, precision))
+                 .values('cell').order_by('cell')
+                 .annotate(count=Count('pk'), latitude=Avg('latitude'),
+                           longitude=Avg('longitude')))
+        clusters = [{'geohash': cell['cell'],
+                     'count': cell['count'],
+                     'latitude': cell['latitude'],
+                     'longitude': cell['longitude'],
+                     'bounds': geo.bounds(cell['cell'])}
+                    for cell in cells]
+        return JsonResponse({'status': "OK", "clusters": clusters})
+
+@versioned_condition('places', 'organizations')
+def list_places_around(request):
+    if request.method != 'GET':
+        # TODO change this
+        return HttpResponse("Circulez, il n'y a rien à voir")
+    else:
+        try:
+            latitude = float(request.GET['latitude'])
+            longitude = float(request.GET['longitude'])
+            radius = min(float(request.GET.get('radius',
+                                               PLACES_DEFAULT_RADIUS)),
+                         PLACES_MAX_RADIUS)
+        except (KeyError, ValueError):
+            return JsonResponse({'status': -1})
+
+        places = _places_in_box(*geo.bounding_box(latitude, longitude, radius))
+        around = []
+        for place in _serialize_places(places).values():
+            place['distance'] = geo.distance(latitude, longitude,
+                                             place['latitude'],
+                                             place['longitude'])
+            if place['distance'] <= radius:
+                around += [place]
+        around.sort(key=lambda place: place['distance'])
+        return JsonResponse({'status': "OK", "places": around})
+
 def get_places_for_organization(request):
     if request.method != 'POST':
         # TODO change this
@@ -230,118 +272,247 @@ def get_dates(request):
         return JsonResponse({'status': "OK", "dates": events})
 
 
+def _future_events_in_context(context_pk=None, context_user=None,
+                              context_place=None, context_org=None):
+    today = timezone.now()
+    events = Event.objects.filter(starts_at__gte=today, published=True)
+
+    if context_place:
+        events = events.filter(location__pk=context_pk)
+    elif context_org:
+        events = events.filter(organization__pk=context_pk)
+    elif context_user:
+        lst = [Q(attendees__pk=context_pk) , Q(presents__pk=context_pk) , Q(organizers__pk=context_pk)]
+        events = events.filter(reduce(OR, lst)).distinct()
+
+    # organization, location and type are serialized for every row
+    return events.select_related('organization', 'location', 'type')
+
+
+def _annotate_membership(events, user):
+    # flags the requesting user's bookings in the events query itself, so the
+    # attendees / presents / organizers M2Ms are never loaded row by row
+    if not user.is_authenticated:
+        return events
+    memberships = {
+        'user_in_attendees': Event.attendees.through.objects.filter(
+            event=OuterRef('pk'), customuser=user),
+        'user_in_presents': Event.presents.through.objects.filter(
+            event=OuterRef('pk'), customuser=user),
+        'user_in_organizers': Event.organizers.through.objects.filter(
+            event=OuterRef('pk'), customuser=user),
+    }
+    return events.annotate(**{flag: Exists(query)
+                              for flag, query in memberships.items()})
+
+
+def _serialize_organization(organization):
+    return {
+        'pk': organization.pk,
+        'name': organization.name,
+        'slug': organization.slug,
+        'organization_detail_url': reverse(
+            'organization_detail', args=[organization.pk, organization.slug]),
+    }
+
+
+def _serialize_place(place):
+    return {
+        'pk': place.pk,
+        'name': place.name,
+        'truncated_name': place.name[0:25],
+        'slug': place.slug,
+        'place_detail_url': reverse('place_detail',
+                                    args=[place.pk, place.slug]),
+    }
+
+
+def _serialize_activity(activity):
+    return {
+        'pk': activity.pk,
+        'name': activity.name,
+        'truncated_name': activity.name[0:25],
+        'slug': activity.slug,
+        'activity_detail_url': reverse('activity_detail',
+                                       args=[activity.pk, activity.slug]),
+    }
+
+
+def _serialize_events(all_future_events):
+    events = []
+    organizations = {}
+    places = {}
+    activitys = {}
+
+    for event in all_future_events:
+        event_pk = event.pk
+        event_slug = event.slug
+        event_detail_url = reverse('event_detail', args=[event_pk, event_slug])
+        event_start_timestamp = event.starts_at.timestamp() * 1000
+        organization = event.organization
+        place = event.location
+        activity = event.type
+
+        if organization.pk not in organizations:
+            organizations[organization.pk] = _serialize_organization(
+                organization)
+
+        if place.pk not in places:
+            places[place.pk] = _serialize_place(place)
+
+        if activity.pk not in activitys:
+            activitys[activity.pk] = _serialize_activity(activity)
+
+        events += [{
+            'pk': event_pk,
+            'title': event.title,
+            'slug': event_slug,
+            'available_seats': event.available_seats,
+            'type_picture_url': activity.picture.url,
+            'event_detail_url': event_detail_url,
+            'book_url': reverse('booking_form', args=[event_pk]),
+            'edit_url': reverse('event_edit', args=[event_pk]),
+            'organization_pk': organization.pk,
+            'place_pk': place.pk,
+            'type_pk': activity.pk,
+            'published': event.published,
+            'starts_at': event.starts_at.strftime("%H:%M"),
+            'ends_at': event.ends_at.strftime("%H:%M"),
+            'start_timestamp': event_start_timestamp,
+            'user_in_attendees': getattr(event, 'user_in_attendees', False),
+            'user_in_presents': getattr(event, 'user_in_presents', False),
+            'user_in_organizers': getattr(event, 'user_in_organizers', False),
+            'day_month_str': dates.day_month(event.starts_at),
+        }]
+
+    return events, organizations, places, activitys
+
+
+@versioned_condition('events', 'places', 'organizations', 'activities',
+                      per_user=True, timed=True)
 def list_events_in_context(request, context_pk=None, context_type=None, context_user=None, context_place=None, context_org=None ):
     if request.method != 'GET':
         # TODO change this
         return HttpResponse("Circulez, il n'y a rien à voir")
     else:
-        events = []
-        organizations = {}
-        places = {}
-        activitys = {}
-        today = timezone.now()
+        all_future_events = _future_events_in_context(
+            context_pk, context_user, context_place, context_org)
+        all_future_events = _annotate_membership(
+            all_future_events, request.user).order_by('starts_at')
 
-        if context_place:
-            this_place = Place.objects.get(pk=context_pk)
-            all_future_events = Event.objects.filter(
-                location=this_place, 
-                starts_at__gte=today, 
-                published=True).order_by('starts_at')
-        
-        elif context_org:
-            this_organization = Organization.objects.get(pk=context_pk)
-            all_future_events = Event.objects.filter(
-                organization=this_organization, 
-                starts_at__gte=today, 
-                published=True).order_by('starts_at')
-        
-        elif context_user:
-            lst = [Q(attendees__pk=context_pk) , Q(presents__pk=context_pk) , Q(organizers__pk=context_pk)]
-            all_future_events = Event.objects.filter(reduce(OR, lst)).filter(
-                starts_at__gte=today, 
-                published=True).order_by('starts_at')
-
-        else:
-            all_future_events = Event.objects.filter(
-                starts_at__gte=today, 
-                published=True).order_by('starts_at')
-
-
-        locale.setlocale(locale.LC_ALL, 'fr_FR')
+        events, organizations, places, activitys = _serialize_events(
+            all_future_events)
 
-        for event in all_future_events:
-            event_pk = event.pk
-            event_slug = event.slug
-            event_detail_url = reverse('event_detail', args=[event_pk, event_slug])
-            event_start_timestamp = event.starts_at.timestamp() * 1000
-            organization = event.organization
-            place = event.location
-            activity = event.type
-
-            if organization.pk not in organizations:
-                organization_slug = organization.slug
-                organization_pk = organization.pk
-                organization_detail_url = reverse('organization_detail',
-                                                  args=[organization_pk,
-                                                        organization_slug])
-                organizations[organization_pk] = {
-                    'pk': organization_pk,
-                    'name': organization.name,
-                    'slug': organization_slug,
-                    'organization_detail_url': organization_detail_url,
-                }
-            
-            if place.pk not in places:
-                place_slug = place.slug
-                place_pk = place.pk
-                place_detail_url = reverse('place_detail',
-                                                  args=[place_pk,
-                                                        place_slug])
-                places[place_pk] = {
-                    'pk': place_pk,
-                    'name': place.name,
-                    'truncated_name': place.name[0:25],
-                    'slug': place_slug,
-                    'place_detail_url': place_detail_url,
-                }
+        return JsonResponse({'status': "OK", "dates": events, "organizations": organizations, "places": places, "activities": activitys, })
 
-            if activity.pk not in activitys:
-                activity_slug = activity.slug
-                activity_pk = activity.pk
-                activity_detail_url = reverse('activity_detail',
-                                                    args=[activity_pk,
-                                                        activity_slug])
-                activitys[activity_pk] = {
-                    'pk': activity_pk,
-                    'name': activity.name,
-                    'truncated_name': activity.name[0:25],
-                    'slug': activity_slug,
-                    'activity_detail_url': activity_detail_url,
-                }
+EVENTS_PAGE_SIZE = 20
+EVENTS_PAGE_MAX_SIZE = 100
+
+
+def _encode_cursor(event):
+    position = '%s|%d' % (event.starts_at.isoformat(), event.pk)
+    return urlsafe_b64encode(position.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    # raises ValueError on anything that wasn't produced by _encode_cursor
+    try:
+        position = urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+    starts_at, _, pk = position.partition('|')
+    starts_at = parse_datetime(starts_at)
+    if starts_at is None:
+        raise ValueError("invalid cursor")
+    return starts_at, int(pk)
+
+
+def _filter_events(events, params):
+    # server-side version of the filters of the event list sidebar
+    if params.get('organization'):
+        events = events.filter(organization__pk=int(params['organization']))
+    if params.get('place'):
+        events = events.filter(location__pk=int(params['place']))
+    if params.get('activity'):
+        events = events.filter(type__pk=int(params['activity']))
+    if params.get('start_date'):
+        start_date = parse_date(params['start_date'])
+        if start_date is None:
+            raise ValueError("invalid start_date")
+        events = events.filter(starts_at__date__gte=start_date)
+    if params.get('end_date'):
+        end_date = parse_date(params['end_date'])
+        if end_date is None:
+            raise ValueError("invalid end_date")
+        events = events.filter(starts_at__date__lte=end_date)
+    return events
+
+
+@versioned_condition('events', 'places', 'organizations', 'activities',
+                      per_user=True, timed=True)
+def list_events_page(request, context_pk=None, context_user=None, context_place=None, context_org=None):
+    if request.method != 'GET':
+        # TODO change this
+        return HttpResponse("Circulez, il n'y a rien à voir")
+    else:
+        try:
+            limit = min(int(request.GET.get('limit', EVENTS_PAGE_SIZE)),
+                        EVENTS_PAGE_MAX_SIZE)
+            all_future_events = _filter_events(
+                _future_events_in_context(
+                    context_pk, context_user, context_place, context_org),
+                request.GET)
+            if request.GET.get('cursor'):
+                starts_at, pk = _decode_cursor(request.GET['cursor'])
+                # keyset pagination on (starts_at, pk): resume strictly after
+                # the last event of the previous page
+                all_future_events = all_future_events.filter(
+                    Q(starts_at__gt=starts_at) |
+                    Q(starts_at=starts_at, pk__gt=pk))
+        except ValueError:
+            return JsonResponse({'status': -1})
 
-            events += [{
-                'pk': event.pk,
-                'title': event.title,
-                'slug': event_slug,
-                'available_seats': event.available_seats,
-                'type_picture_url': event.type.picture.url,
-                'event_detail_url': event_detail_url,
-                'book_url': reverse('booking_form', args=[event_pk]),
-                'edit_url': reverse('event_edit', args=[event_pk]),
-                'organization_pk': organization.pk,
-                'place_pk': event.location.pk,
-                'type_pk': event.type.pk,
-                'published': event.published,
-                'starts_at': event.starts_at.strftime("%H:%M"),
-                'ends_at': event.ends_at.strftime("%H:%M"),
-                'start_timestamp': event_start_timestamp,
-                'user_in_attendees': request.user in event.attendees.all(),
-                'user_in_presents': request.user in event.presents.all(),
-                'user_in_organizers': request.user in event.organizers.all(),
-                'day_month_str': event.starts_at.strftime("%d %B"),
-            }]
+        if limit < 1:
+            return JsonResponse({'status': -1})
 
-        return JsonResponse({'status': "OK", "dates": events, "organizations": organizations, "places": places, "activities": activitys, })
+        page = list(_annotate_membership(all_future_events, request.user)
+                    .order_by('starts_at', 'pk')[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = _encode_cursor(page[-1])
+
+        events, organizations, places, activitys = _serialize_events(page)
+
+        return JsonResponse({'status': "OK", "dates": events, "organizations": organizations, "places": places, "activities": activitys, "next_cursor": next_cursor, })
+
+@versioned_condition('events', 'places', 'organizations', 'activities',
+                      timed=True)
+def list_event_facets(request):
+    """
+    The organizations, places and activities of all the upcoming events, the
+    choices of the event list filters, whatever page of it is loaded.
+    """
+    if request.method != 'GET':
+        # TODO change this
+        return HttpResponse("Circulez, il n'y a rien à voir")
+    else:
+        all_future_events = _future_events_in_context()
+        organizations = Organization.objects.filter(
+            pk__in=all_future_events.values('organization'))
+        places = Place.objects.filter(
+            pk__in=all_future_events.values('location'))
+        activities = Activity.objects.filter(
+            pk__in=all_future_events.values('type'))
+
+        return JsonResponse({
+            'status': "OK",
+            'organizations': {organization.pk: _serialize_organization(
+                organization) for organization in organizations},
+            'places': {place.pk: _serialize_place(place) for place in places},
+            'activities': {activity.pk: _serialize_activity(activity)
+                           for activity in activities},
+        })
 
 def book_event(request):
     if request.method != 'POST':
@@ -353,36 +524,23 @@ def book_event(request):
         event_id = post_data['event_id'][0]
         user = CustomUser.objects.get(email=request.user.email)
         event = Event.objects.get(pk=event_id)
-        organization = event.organization
-        attendees = event.attendees.all()
-
-        user_volunteer_orgs = OrganizationPerson.objects.filter(user=user,
-                                                      role__gte=OrganizationPerson.VOLUNTEER)
 
-
-        if user in attendees:
-            if organization not in user_volunteer_orgs:
-                event.available_seats += 1
-            event.attendees.remove(user)
+        if booking.cancel_seat(event, user):
             action.send(user, verb="s'est désinscrit de", target=event)    
-            event.save()
             return JsonResponse({'status': 'unbook',
                                  'available_seats': event.available_seats})
-        else:
-            if event.available_seats >= 0:
-                if organization not in user_volunteer_orgs:
-                    event.available_seats -= 1          
-                action.send(user, verb="s'est inscrit à", target=event)    
-                follow(user, event, actor_only=False)
-                event.attendees.add(user)
-                # send booking mail here or notification here
-                send_booking_mail(request, user, event)
-                #send_notification(request, user)
-                
-            else:
-                return JsonResponse({'status': -1})
-
-        event.save()
+
+        try:
+            booking.book_seat(event, user)
+        except booking.EventFull:
+            return JsonResponse({'status': -1})
+
+        action.send(user, verb="s'est inscrit à", target=event)    
+        follow(user, event, actor_only=False)
+        # send booking mail here or notification here
+        send_booking_mail(request, user, event)
+        #send_notification(request, user)
+
         return JsonResponse({'status': 'unbook',
                              'available_seats': event.available_seats})
 
@@ -422,34 +580,21 @@ def add_users(request):
         event_pk = post_data['event_pk'][0]
         user_list = post_data['user_list'][0].split(',')
         event = Event.objects.get(pk=event_pk)
-        every_attendee = event.attendees.all() | event.presents.all() | event.organizers.all()
+        users = CustomUser.objects.filter(
+            pk__in=[user_pk for user_pk in user_list if user_pk])
+
+        booked, marked_present = booking.enrol_users(event, users)
+
+        Action.objects.bulk_create([
+            Action(actor=request.user, verb="a inscris", action_object=user,
+                   target=event, timestamp=timezone.now())
+            for user in booked])
+        # bulk_create sends no post_save
+        bump_version('actions')
+
         seats = event.available_seats
-        presents_pk = []
-        attending_pk = []
-
-        for user_pk in user_list:
-            user = CustomUser.objects.get(pk=user_pk)
-            now = timezone.now()
-
-            if event.starts_at <= now:
-                event.presents.add(user)
-                pesents_pk += [user.pk]
-            else:
-                if user not in every_attendee:
-                    print("a")
-                    seats -= 1
-
-                    event.attendees.add(user)
-                    attending_pk += [user.pk]
-                    action.send(request.user, verb="a inscris", action_object=user,  target=event)   
-                else:
-                    event.presents.add(user) 
-                    presents_pk += [user.pk]
-                    
-
-
-        event.available_seats = seats
-        event.save()
+        presents_pk = [user.pk for user in marked_present]
+        attending_pk = [user.pk for user in booked]
         return JsonResponse({'status': 'OK',
                              'seats': seats,
                              'presents_pk': presents_pk,
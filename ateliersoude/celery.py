@@ -21,9 +21,16 @@ app.conf.beat_schedule = {
 		'schedule': crontab(),
                 'args': ()
 	},
-	'every-minute2': {
+	# reconciliation only, the events are published by their own
+	# tasks, see plateformeweb.publication
+	'every-quarter': {
 		'task': 'tasks.publish_events',
-		'schedule': crontab(),
+		'schedule': crontab(minute='*/15'),
+                'args': ()
+	},
+	'every-night': {
+		'task': 'tasks.extend_event_series',
+		'schedule': crontab(hour=3, minute=0),
                 'args': ()
 	}
 }
@@ -0,0 +1,38 @@
+from __future__ import absolute_import
+
+from .common import *
+
+# settings of the generate_benchmark_data and run_benchmarks commands: a
+# local PostgreSQL configured like common, or SQLite with
+# BENCHMARK_DATABASE=sqlite
+
+SECRET_KEY = 'benchmark'
+GOOGLE_API_KEY = 'e'
+EASY_MAPS_GOOGLE_MAPS_API_KEY = 'e'
+
+if os.environ.get('BENCHMARK_DATABASE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'benchmark.sqlite3'),
+        }
+    }
+else:
+    DATABASES['default']['HOST'] = POSTGRES_HOST or 'localhost'
+
+# no Redis needed, each process has its own cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# the tasks queued by a request, e.g. the booking mails, are only published
+# to an in-process broker that nothing consumes: the timed requests pay what
+# they pay in production, no Redis nor worker needed
+CELERY_TASK_ALWAYS_EAGER = False
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+
+# and no mail ever reaches an SMTP server
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
@@ -71,7 +71,6 @@ INSTALLED_APPS = [
     'import_export',
     'fontawesome',
     'simple_history',
-    'debug_toolbar',
     'plateformeweb.apps.PlateformeWebAppConfig',
     'address',
     'avatar',
@@ -89,8 +88,9 @@ SITE_ID = 1
 DBSETTINGS_USE_SITES = False
 
 MIDDLEWARE = [
-    # put the following line first, unless it breaks other middleware
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    # first, to measure the whole request
+    'plateformeweb.middleware.RequestStatsMiddleware',
+    'plateformeweb.middleware.ProfilingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -103,6 +103,12 @@ MIDDLEWARE = [
     'django.contrib.admindocs.middleware.XViewMiddleware',
 ]
 
+# the debug toolbar slows every request down, development only
+if DEBUG:
+    INSTALLED_APPS += ['debug_toolbar']
+    # put it first, unless it breaks other middleware
+    MIDDLEWARE.insert(0, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'ateliersoude.urls'
 
 TEMPLATES = [
@@ -119,10 +125,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.request',
-                'plateformeweb.context_processors.user_data',
-                'plateformeweb.context_processors.last_events',
-                'plateformeweb.context_processors.user_in_organization',
-                'plateformeweb.context_processors.admin_of_organizations',
+                'plateformeweb.context_processors.site_context',
             ],
         },
     },
@@ -241,6 +244,10 @@ LOGGING = {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
         },
+        'plateformeweb.middleware': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
         'plateformeweb.forms': {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
@@ -290,7 +297,8 @@ DEBUG_TOOLBAR_PANELS = [
     'debug_toolbar.panels.signals.SignalsPanel',
     'debug_toolbar.panels.logging.LoggingPanel',
   # 'debug_toolbar.panels.redirects.RedirectsPanel',
-    'debug_toolbar.panels.profiling.ProfilingPanel',
+  # profiles every request, see PROFILING_SAMPLE_RATE instead
+  # 'debug_toolbar.panels.profiling.ProfilingPanel',
 ]
 
 # Celery application definition
@@ -301,6 +309,82 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Paris'
 
+# Shared cache, on its own Redis database
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    }
+}
+
+# seconds the per-user values of the template context stay cached
+USER_CONTEXT_CACHE_TTL = 60
+# seconds the role index of an organization stays cached, the membership
+# signals invalidate it earlier
+ORGANIZATION_ROLES_CACHE_TTL = 3600
+# seconds a page rendered for anonymous visitors stays cached, changes to
+# the models it shows invalidate it earlier
+PAGE_CACHE_TTL = 600
+# seconds the ETag of the upcoming events lists stays valid, nothing else
+# changes it when one of them starts
+TIMED_ETAG_SECONDS = 60
+
+# followers notified per bulk insert of queued mails
+NOTIFICATION_CHUNK_SIZE = 500
+
+# recurring events only get Event rows this many days ahead, the
+# tasks.extend_event_series task moves the window forward every night
+EVENT_SERIES_HORIZON_DAYS = 90
+
+# events due within this many minutes have their publication task queued,
+# must exceed the 15 minutes between two runs of tasks.publish_events
+PUBLICATION_WINDOW_MINUTES = 30
+
+# per-view request statistics, see plateformeweb.middleware: each process
+# adds its own to the shared cache every QUERY_STATS_FLUSH_SECONDS
+QUERY_STATS_FLUSH_SECONDS = 60
+# queries allowed per request by URL name, beyond which a warning is logged
+QUERY_BUDGETS = {
+    'list_events_in_context': 10,
+    'list_events_page': 10,
+    'get_all_places': 5,
+    'list_places_in_bbox': 5,
+    'event_detail': 20,
+    'event_list': 15,
+    'book': 25,
+}
+QUERY_BUDGET_DEFAULT = 50
+
+# sampled profiling, see plateformeweb.middleware: one request in
+# PROFILING_SAMPLE_RATE (0 for none) runs under cProfile, as does the next
+# request to a view slower than PROFILING_SLOW_MS (None for no threshold)
+PROFILING_SAMPLE_RATE = int(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SLOW_MS = os.environ.get('PROFILING_SLOW_MS')
+PROFILING_SLOW_MS = int(PROFILING_SLOW_MS) if PROFILING_SLOW_MS else None
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# signed links, see plateformeweb.tokens: cancel links stop working when
+# their event ends, or after this many seconds
+CANCEL_TOKEN_MAX_AGE = 365 * 24 * 3600
+# seconds the presence toggles of an event page keep working
+PRESENCE_TOKEN_MAX_AGE = 24 * 3600
+# when the cancel links signed with the former, public, key were last mailed
+# out (an aware datetime, e.g. the deployment of plateformeweb.tokens): they
+# are accepted until CANCEL_TOKEN_MAX_AGE after it. None refuses them, and no
+# other link is ever accepted with that key
+LEGACY_TOKENS_SIGNED_UNTIL = None
+
+# tasks.send_queued_mail claims the queued mails by batches of
+# MAILER_BATCH_SIZE, at most MAILER_MAX_BATCHES batches per run
+MAILER_BATCH_SIZE = 100
+MAILER_MAX_BATCHES = 20
+# mails per minute and recipient domain, None for no limit
+MAILER_RATE_LIMITS = {}
+MAILER_DEFAULT_RATE_LIMIT = None
+
 EMAIL_USE_TLS = True
 EMAIL_HOST = SMTP_HOST
 EMAIL_HOST_USER = EMAIL_ADRESSE
@@ -4,4 +4,19 @@ from .common import *
 
 SECRET_KEY = 'e'
 GOOGLE_API_KEY = 'e'
-EASY_MAPS_GOOGLE_MAPS_API_KEY = 'e'
\ No newline at end of file
+EASY_MAPS_GOOGLE_MAPS_API_KEY = 'e'
+
+# run celery tasks in process
+CELERY_TASK_ALWAYS_EAGER = True
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# timings of plateformeweb/tests/tests_benchmarks.py, run with BENCHMARKS=1
+LOGGING['loggers']['plateformeweb.benchmarks'] = {
+    'handlers': ['console'],
+    'level': 'INFO',
+}
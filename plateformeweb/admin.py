@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Condition, Event, Activity, PlaceType, Place, Organization, OrganizationPerson
+from .models import Condition, Event, EventSeries, Activity, PlaceType, Place, Organization, OrganizationPerson
 
 class EventAdmin(admin.ModelAdmin):
     list_display = (
@@ -7,6 +7,10 @@ class EventAdmin(admin.ModelAdmin):
         'location', 'slug')
     ordering = ('-starts_at',)
 
+class EventSeriesAdmin(admin.ModelAdmin):
+    list_display = (
+        'type', 'organization', 'owner', 'location', 'materialized_until')
+
 class ActivityAdmin(admin.ModelAdmin):
     list_display = ('name',)
 
@@ -30,6 +34,7 @@ class OrganizationPersonAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Event, EventAdmin)
+admin.site.register(EventSeries, EventSeriesAdmin)
 admin.site.register(Condition, ConditionAdmin)
 admin.site.register(Activity, ActivityAdmin)
 admin.site.register(PlaceType, PlaceTypeAdmin)
@@ -13,5 +13,6 @@ class PlateformeWebAppConfig(AppConfig):
         registry.register(self.get_model('Event'))
         CustomUser = apps.get_model('users', 'CustomUser')
         registry.register(CustomUser)
+        from . import signals  # noqa: connects the cache invalidation
 
 
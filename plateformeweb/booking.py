@@ -0,0 +1,209 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import bump_versions
+from .models import Event, OrganizationPerson
+
+
+# Seats are reserved and released under a row lock on the event, with a
+# conditional UPDATE as the last word on the seat count: concurrent bookings
+# of the last seats can neither oversell the event nor lose a decrement.
+# Whether a booking takes a seat is decided under that lock too, and recorded
+# in Event.seat_holders: a cancellation gives back the seat its booking took,
+# whatever the role of the user became in between.
+
+
+class EventFull(Exception):
+    pass
+
+
+def takes_seat(event, user):
+    # volunteers and admins of the organization don't use up a seat
+    return not OrganizationPerson.objects.filter(
+        user=user, organization_id=event.organization_id,
+        role__gte=OrganizationPerson.VOLUNTEER).exists()
+
+
+def book_seat(event, user):
+    """
+    Adds user to the attendees of event, taking one of its seats unless user
+    is a volunteer or an admin of its organization. Returns False if user was
+    already attending or marked present, and raises EventFull when no seat is
+    left. event.available_seats is refreshed.
+    """
+    with transaction.atomic():
+        locked = Event.objects.select_for_update().get(pk=event.pk)
+        event.available_seats = locked.available_seats
+        if (locked.attendees.filter(pk=user.pk).exists() or
+                locked.presents.filter(pk=user.pk).exists()):
+            return False
+        if takes_seat(locked, user):
+            taken = Event.objects.filter(
+                pk=event.pk, available_seats__gt=0).update(
+                available_seats=F('available_seats') - 1)
+            if not taken:
+                raise EventFull(event)
+            event.available_seats -= 1
+            locked.seat_holders.add(user)
+        locked.attendees.add(user)
+    return True
+
+
+# outcomes of book_seats, by event
+BOOKED = 'booked'
+ALREADY_BOOKED = 'already_booked'
+FULL = 'full'
+NOT_FOUND = 'not_found'
+
+
+def book_seats(event_pks, user):
+    """
+    Bulk counterpart of book_seat, for one user booking many events at once.
+    Every event is locked in a single statement, the seats are taken with a
+    single conditional update and the attendees added with a single insert,
+    whatever the number of events. Volunteers and admins of an organization
+    don't use up a seat of its events. Returns {event pk: BOOKED,
+    ALREADY_BOOKED, FULL or NOT_FOUND}.
+    """
+    event_pks = set(event_pks)
+    results = dict.fromkeys(event_pks, NOT_FOUND)
+    attendees_through = Event.attendees.through
+    with transaction.atomic():
+        # in primary key order, like every other locker of several events
+        events = list(Event.objects.select_for_update()
+                      .filter(pk__in=event_pks).order_by('pk'))
+        joined = set(attendees_through.objects.filter(
+            event_id__in=event_pks, customuser_id=user.pk).values_list(
+            'event_id', flat=True))
+        joined |= set(Event.presents.through.objects.filter(
+            event_id__in=event_pks, customuser_id=user.pk).values_list(
+            'event_id', flat=True))
+        staff_of = set(OrganizationPerson.objects.filter(
+            user=user.pk, role__gte=OrganizationPerson.VOLUNTEER,
+            organization_id__in={event.organization_id for event in events})
+            .values_list('organization_id', flat=True))
+
+        booked, seats = [], []
+        for event in events:
+            if event.pk in joined:
+                results[event.pk] = ALREADY_BOOKED
+            elif event.organization_id in staff_of:
+                booked += [event.pk]
+            elif event.available_seats > 0:
+                booked += [event.pk]
+                seats += [event.pk]
+            else:
+                results[event.pk] = FULL
+
+        if seats:
+            taken = Event.objects.filter(
+                pk__in=seats, available_seats__gt=0).update(
+                available_seats=F('available_seats') - 1)
+            if taken != len(seats):
+                # can't happen under the row locks
+                raise EventFull(seats)
+            seat_holders_through = Event.seat_holders.through
+            seat_holders_through.objects.bulk_create([
+                seat_holders_through(event_id=pk, customuser_id=user.pk)
+                for pk in seats])
+        if booked:
+            attendees_through.objects.bulk_create([
+                attendees_through(event_id=pk, customuser_id=user.pk)
+                for pk in booked])
+            # bulk_create sends no m2m_changed
+            bump_versions('events', ('user', user.pk))
+        results.update(dict.fromkeys(booked, BOOKED))
+    return results
+
+
+def cancel_seat(event, user):
+    """
+    Removes user from the attendees of event, giving back the seat their
+    booking took if it did. Returns False if user wasn't attending.
+    event.available_seats is refreshed.
+    """
+    with transaction.atomic():
+        locked = Event.objects.select_for_update().get(pk=event.pk)
+        event.available_seats = locked.available_seats
+        if not locked.attendees.filter(pk=user.pk).exists():
+            return False
+        locked.attendees.remove(user)
+        released, _ = Event.seat_holders.through.objects.filter(
+            event_id=event.pk, customuser_id=user.pk).delete()
+        if released:
+            Event.objects.filter(pk=event.pk).update(
+                available_seats=F('available_seats') + 1)
+            event.available_seats += 1
+    return True
+
+
+def enrol_users(event, users):
+    """
+    Bulk counterpart of book_seat, for organizers adding people to an event.
+    Before the event starts, users who haven't joined it yet become attendees
+    as long as seats are left, volunteers and admins of its organization
+    taking none, and those who already did are marked present; once it has
+    started everybody is marked present. People marked present leave the
+    attendees, keeping their seat. Returns the lists of users booked and
+    marked present. event.available_seats is refreshed.
+    """
+    attendees_through = Event.attendees.through
+    presents_through = Event.presents.through
+    with transaction.atomic():
+        locked = Event.objects.select_for_update().get(pk=event.pk)
+        attendees = set(attendees_through.objects.filter(
+            event_id=event.pk).values_list('customuser_id', flat=True))
+        presents = set(presents_through.objects.filter(
+            event_id=event.pk).values_list('customuser_id', flat=True))
+        organizers = set(Event.organizers.through.objects.filter(
+            event_id=event.pk).values_list('customuser_id', flat=True))
+
+        booked, seated = [], []
+        if locked.starts_at <= timezone.now():
+            marked_present = list(users)
+        else:
+            joined = attendees | presents | organizers
+            newcomers = [user for user in users if user.pk not in joined]
+            marked_present = [user for user in users if user.pk in joined]
+            staff = set()
+            if newcomers:
+                staff = set(OrganizationPerson.objects.filter(
+                    user__in=[user.pk for user in newcomers],
+                    organization_id=locked.organization_id,
+                    role__gte=OrganizationPerson.VOLUNTEER).values_list(
+                    'user_id', flat=True))
+            seats = max(locked.available_seats, 0)
+            for user in newcomers:
+                if user.pk in staff:
+                    booked += [user]
+                elif len(seated) < seats:
+                    booked += [user]
+                    seated += [user]
+
+        if seated:
+            taken = Event.objects.filter(
+                pk=event.pk, available_seats__gte=len(seated)).update(
+                available_seats=F('available_seats') - len(seated))
+            if not taken:
+                raise EventFull(event)
+            seat_holders_through = Event.seat_holders.through
+            seat_holders_through.objects.bulk_create([
+                seat_holders_through(event_id=event.pk, customuser_id=user.pk)
+                for user in seated])
+        if booked:
+            attendees_through.objects.bulk_create([
+                attendees_through(event_id=event.pk, customuser_id=user.pk)
+                for user in booked])
+            # bulk_create sends no m2m_changed
+            bump_versions('events', *[('user', user.pk) for user in booked])
+        presents_through.objects.bulk_create([
+            presents_through(event_id=event.pk, customuser_id=user.pk)
+            for user in marked_present if user.pk not in presents])
+        bump_versions(*[('user', user.pk) for user in marked_present])
+        moved = [user.pk for user in marked_present if user.pk in attendees]
+        if moved:
+            attendees_through.objects.filter(
+                event_id=event.pk, customuser_id__in=moved).delete()
+        event.available_seats = locked.available_seats - len(seated)
+    return booked, marked_present
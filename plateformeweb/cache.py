@@ -0,0 +1,166 @@
+import datetime
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+
+# Versioned cache keys: every scope ('events', ('user', 42), ...) has a
+# version number stored in the cache, and the keys cached for a scope embed
+# it. Bumping the version invalidates all of them at once, the stale entries
+# simply expire. Versions are millisecond timestamps of the last change.
+
+VERSION_KEY = 'version:%s'
+
+
+def scope_name(scope):
+    if isinstance(scope, (tuple, list)):
+        return ':'.join(str(part) for part in scope)
+    return str(scope)
+
+
+def now_version():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """
+    Returns the current version of each of scopes, starting the ones that
+    have none yet.
+    """
+    keys = [VERSION_KEY % scope_name(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: now_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            # another process may have started it in the meantime
+            cache.add(key, version, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, now_version()) for key in keys]
+
+
+def get_version(scope):
+    return get_versions(scope)[0]
+
+
+def bump_versions(*scopes):
+    """
+    Invalidates every key cached for scopes.
+    """
+    if not scopes:
+        return
+    keys = [VERSION_KEY % scope_name(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    version = now_version()
+    # always move forward, even twice in the same millisecond
+    cache.set_many({key: max(version, current.get(key, 0) + 1)
+                    for key in keys}, timeout=None)
+
+
+def bump_version(scope):
+    bump_versions(scope)
+
+
+def versioned_key(name, *scopes):
+    """
+    Returns a cache key for name that changes whenever one of scopes is
+    bumped.
+    """
+    versions = get_versions(*scopes)
+    return '%s:%s' % (name, ':'.join(str(version) for version in versions))
+
+
+def request_versions(request, scopes, per_user):
+    """
+    Returns the versions of scopes, plus the requesting user's when per_user
+    is set, read once per request.
+    """
+    scopes = list(scopes)
+    if per_user and request.user.is_authenticated:
+        scopes += [('user', request.user.pk)]
+    memo = request.__dict__.setdefault('_versions', {})
+    key = tuple(scope_name(scope) for scope in scopes)
+    if key not in memo:
+        memo[key] = get_versions(*scopes)
+    return memo[key]
+
+
+def time_version(request):
+    """
+    Returns the start of the current period of TIMED_ETAG_SECONDS, as a
+    millisecond timestamp like the versions, the same for the whole request.
+    """
+    if '_time_version' not in request.__dict__:
+        period = settings.TIMED_ETAG_SECONDS * 1000
+        now = int(timezone.now().timestamp() * 1000)
+        request._time_version = now - now % period
+    return request._time_version
+
+
+def versioned_condition(*scopes, per_user=False, timed=False):
+    """
+    Decorator answering conditional GETs from the versions of scopes alone,
+    before the view and its queries run. The ETag changes with any of them,
+    with the user when per_user is set, and every TIMED_ETAG_SECONDS when
+    timed is set, for views whose results depend on the current time;
+    Last-Modified is the most recent of them.
+    """
+    def validators(request):
+        versions = request_versions(request, scopes, per_user)
+        if timed:
+            versions = versions + [time_version(request)]
+        return versions
+
+    def etag(request, *args, **kwargs):
+        versions = validators(request)
+        user = request.user.pk if per_user else None
+        return '%s-%s' % (user or 0, '-'.join(str(v) for v in versions))
+
+    def last_modified(request, *args, **kwargs):
+        versions = validators(request)
+        return datetime.datetime.fromtimestamp(max(versions) / 1000,
+                                               timezone.utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def cache_anonymous_page(*scopes):
+    """
+    Decorator caching the pages rendered for anonymous visitors under keys
+    versioned by scopes, so any change to them serves fresh pages. Visitors
+    with a session or pending messages, and responses that set cookies or
+    use the CSRF token, always go through the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD') or
+                    settings.SESSION_COOKIE_NAME in request.COOKIES or
+                    'messages' in request.COOKIES or
+                    request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            path = '%s|%s' % (request.get_full_path(),
+                              getattr(request, 'LANGUAGE_CODE', ''))
+            key = '%s:%s' % (versioned_key('page', *scopes),
+                             hashlib.md5(path.encode('utf-8')).hexdigest())
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if callable(getattr(response, 'render', None)):
+                response = response.render()
+            if (response.status_code == 200 and not response.cookies and
+                    not getattr(response, 'streaming', False) and
+                    not request.META.get('CSRF_COOKIE_USED')):
+                cache.set(key, (response.content, response['Content-Type']),
+                          settings.PAGE_CACHE_TTL)
+            return response
+        return wrapper
+    return decorator
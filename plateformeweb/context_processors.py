@@ -1,64 +1,143 @@
-from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+from django.utils.functional import SimpleLazyObject, cached_property
 from django.utils.timezone import now
-from plateformeweb.models import Event, PublishedEvent, Place, Organization, OrganizationPerson
-from users.models import CustomUser
+from plateformeweb.models import Event, OrganizationPerson
+from plateformeweb.cache import versioned_key
 
 
 # See https://stackoverflow.com/a/28533875
 
-# NOTE requiert plateformeweb.context_processors.user_data dans les context
+# NOTE requiert plateformeweb.context_processors.site_context dans les context
 # processors de settings.py
 
-# rajoute 2 variables de template dans le contexte
+# rajoute ces variables de template dans le contexte
 # - my_events_attending (events futurs ou le user participe, publiés uniquement)
+# - my_last_event_attending (le prochain d'entre eux)
 # - my_events_organizing (tous les events futurs où le user organise, publiés
 #   ou non)
+# - last_events (les 4 prochains events publiés)
+# - user_in_organization (les rôles du user dans les organisations)
+# - admin_of_organizations (le user administre-t-il une organisation ?)
 
-# les variables de templates donnent accès au queryset (lazy evaluation, donc
-# pas de requête si pas d'affichage), exemple:
+# chaque variable est évaluée au premier accès seulement (pas de requête si
+# pas d'affichage), exemple:
 
 #     <ul>
 #         {% for item in my_events_attending %}
 #             <li>{{ item.title }}</li>
 #         {% endfor %}
 #     </ul>
-#     <ul>
-#         {% for item in my_events_organizing %}
-#             <li>{{ item.title }}</li>
-#         {% endfor %}
-#     </ul>
 
-# See
-# https://docs.djangoproject.com/en/1.11/topics/db/queries/#spanning-multi-valued-relationships
-# for the filter() call
-
-
-def user_data(request):
-    if isinstance(request.user, AnonymousUser) or request.user is None:
-        return {}
-    events_attending = PublishedEvent.objects.all().filter(
-        attendees=request.user, ends_at__gte=now())
-    last_event_attending = PublishedEvent.objects.all().filter(
-        attendees=request.user, ends_at__gte=now()).order_by('starts_at')[:1]
-    events_organizing = Event.objects.all().filter(
-        organizers=request.user, ends_at__gte=now())
-    return {'my_events_attending': events_attending,
-            'my_last_event_attending': last_event_attending,
-            'my_events_organizing': events_organizing}
-
-
-def last_events(request):
-    events = PublishedEvent.objects.all().filter(
-        starts_at__gte=now()).order_by('starts_at')[:4]
-    return {'last_events': events}
-
-def user_in_organization(request):
-    users = OrganizationPerson.objects.all()
-    return {'user_in_organization' : users}
-
-def admin_of_organizations(request):
-    if(request.user.is_authenticated):
-        orgs = OrganizationPerson.objects.filter(user=request.user, role__gte=OrganizationPerson.ADMIN)
-        if orgs:
-            return {'admin_of_organizations': True }
-    return {'admin_of_organizations': False }
+# les valeurs du user sont gardées USER_CONTEXT_CACHE_TTL secondes dans le
+# cache, plateformeweb.signals les invalide quand ses réservations ou ses
+# rôles changent
+
+
+class SiteContext():
+    """
+    Values shared by every template of a request. Each one is computed on
+    first use, at most once per request, and comes from the cache when
+    possible.
+    """
+    def __init__(self, request):
+        self.user = getattr(request, 'user', None)
+
+    @property
+    def authenticated(self):
+        return self.user is not None and self.user.is_authenticated
+
+    def cached(self, name, compute, *scopes):
+        key = versioned_key(name, *scopes)
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, settings.USER_CONTEXT_CACHE_TTL)
+        return value
+
+    @cached_property
+    def user_events(self):
+        """
+        Future events the user attends or organizes, in a single query.
+        """
+        if not self.authenticated:
+            return []
+
+        def compute():
+            attendees = Event.attendees.through.objects.filter(
+                event=OuterRef('pk'), customuser=self.user.pk)
+            organizers = Event.organizers.through.objects.filter(
+                event=OuterRef('pk'), customuser=self.user.pk)
+            return list(Event.objects.filter(ends_at__gte=now())
+                        .annotate(attending=Exists(attendees),
+                                  organizing=Exists(organizers))
+                        .filter(Q(attending=True) | Q(organizing=True))
+                        .select_related('organization', 'location', 'type')
+                        .order_by('starts_at'))
+        return self.cached('user_events', compute,
+                           ('user', self.user.pk), 'events')
+
+    @cached_property
+    def my_events_attending(self):
+        today = now()
+        return [event for event in self.user_events
+                if event.attending and event.published
+                and event.publish_at <= today and event.ends_at >= today]
+
+    @cached_property
+    def my_last_event_attending(self):
+        return self.my_events_attending[:1]
+
+    @cached_property
+    def my_events_organizing(self):
+        today = now()
+        return [event for event in self.user_events
+                if event.organizing and event.ends_at >= today]
+
+    @cached_property
+    def user_in_organization(self):
+        if not self.authenticated:
+            return []
+
+        def compute():
+            return list(OrganizationPerson.objects.filter(user=self.user.pk)
+                        .select_related('organization'))
+        # the menu shows the names of the organizations
+        return self.cached('user_in_organization', compute,
+                           ('user', self.user.pk), 'organizations')
+
+    @cached_property
+    def administered_organizations(self):
+        return [person.organization for person in self.user_in_organization
+                if person.role >= OrganizationPerson.ADMIN]
+
+    @cached_property
+    def admin_of_organizations(self):
+        return bool(self.administered_organizations)
+
+    @cached_property
+    def last_events(self):
+        def compute():
+            today = now()
+            return list(Event.objects.filter(
+                published=True, publish_at__lte=today, starts_at__gte=today)
+                .select_related('organization', 'location', 'type')
+                .order_by('starts_at')[:4])
+        return self.cached('last_events', compute, 'events')
+
+
+def site_context(request):
+    site = SiteContext(request)
+
+    def lazy(name):
+        return SimpleLazyObject(lambda: getattr(site, name))
+
+    return {'site': site,
+            'my_events_attending': lazy('my_events_attending'),
+            'my_last_event_attending': lazy('my_last_event_attending'),
+            'my_events_organizing': lazy('my_events_organizing'),
+            'last_events': lazy('last_events'),
+            'user_in_organization': lazy('user_in_organization'),
+            'administered_organizations': lazy('administered_organizations'),
+            'admin_of_organizations': lazy('admin_of_organizations')}
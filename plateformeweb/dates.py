@@ -0,0 +1,53 @@
+# French formatting of the event dates without locale.setlocale, which is
+# process-wide, slow, and races between the threads or greenlets of a
+# worker. The outputs match strftime under the fr_FR locale.
+
+import datetime
+from django.utils import timezone
+
+DAYS = ('lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi',
+        'dimanche')
+MONTHS = ('janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet',
+          'août', 'septembre', 'octobre', 'novembre', 'décembre')
+
+
+def day_month(value):
+    """
+    ex 01 janvier, like strftime("%d %B")
+    """
+    return '%02d %s' % (value.day, MONTHS[value.month - 1])
+
+
+def full_date(value):
+    """
+    ex lundi 01 janvier 2018, like strftime("%A %d %B %Y")
+    """
+    return '%s %s %d' % (DAYS[value.weekday()], day_month(value), value.year)
+
+
+def time(value):
+    """
+    ex 20:01:12, like strftime("%X")
+    """
+    return '%02d:%02d:%02d' % (value.hour, value.minute, value.second)
+
+
+def interval(starts_at, ends_at):
+    """
+    ex lundi 01 janvier 2018 de 20:01:12 à 22:01:12
+    """
+    return '%s de %s à %s' % (full_date(starts_at), time(starts_at),
+                              time(ends_at))
+
+
+def occurrence(day, starts_after, ends_after, publish_countdown):
+    """
+    (starts_at, ends_at, publish_at) of the event held on the day of day in
+    the current time zone, starts_after and ends_after from its midnight
+    """
+    midnight = timezone.make_aware(datetime.datetime.combine(
+        timezone.localtime(day).date(), datetime.time()))
+    starts_at = midnight + starts_after
+    return (starts_at,
+            midnight + ends_after,
+            starts_at - datetime.timedelta(days=publish_countdown))
@@ -0,0 +1,110 @@
+import math
+
+
+# Pure-Python geohash (https://en.wikipedia.org/wiki/Geohash) and distance
+# helpers for the place index: no PostGIS needed. Places sharing a geohash
+# prefix lie in the same cell, which is how the map clusters them.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+DECODE = {char: index for index, char in enumerate(BASE32)}
+
+EARTH_RADIUS = 6371.0  # km
+
+# stored geohash length, cells of about 5 m
+PRECISION = 9
+
+
+def encode(latitude, longitude, precision=12):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            value, interval = longitude, lon_range
+        else:
+            value, interval = latitude, lat_range
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            interval[0] = middle
+        else:
+            bits = bits << 1
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars += [BASE32[bits]]
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def bounds(geohash):
+    """
+    Returns the (south, west, north, east) corners of the geohash cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = DECODE[char]
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if bits >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def decode(geohash):
+    """
+    Returns the (latitude, longitude) center of the geohash cell.
+    """
+    south, west, north, east = bounds(geohash)
+    return (south + north) / 2, (west + east) / 2
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance in km, with the haversine formula.
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = (math.sin(delta_phi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(1.0, a)))
+
+
+def bounding_box(latitude, longitude, radius):
+    """
+    Returns the (south, west, north, east) box enclosing the circle of radius
+    km around the point, west > east when it crosses the antimeridian.
+    """
+    delta_lat = math.degrees(radius / EARTH_RADIUS)
+    south = max(-90.0, latitude - delta_lat)
+    north = min(90.0, latitude + delta_lat)
+    cos_lat = math.cos(math.radians(latitude))
+    if north >= 90.0 or south <= -90.0 or cos_lat <= 0:
+        return south, -180.0, north, 180.0
+    delta_lon = math.degrees(radius / (EARTH_RADIUS * cos_lat))
+    if delta_lon >= 180.0:
+        return south, -180.0, north, 180.0
+    west = (longitude - delta_lon + 540.0) % 360.0 - 180.0
+    east = (longitude + delta_lon + 540.0) % 360.0 - 180.0
+    return south, west, north, east
+
+
+def cluster_precision(zoom):
+    """
+    Geohash length whose cells are about a quarter of a map tile wide at
+    zoom, between 1 and PRECISION.
+    """
+    return max(1, min(PRECISION, zoom // 2))
@@ -0,0 +1,161 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from post_office.connections import connections
+from post_office.models import Email, Log, STATUS
+
+logger = logging.getLogger(__name__)
+
+
+# Sender for the mails queued by post_office. Each batch is claimed with
+# SELECT ... FOR UPDATE SKIP LOCKED and stays locked until its statuses are
+# written, so several workers can drain the queue without sending a mail
+# twice. One SMTP connection is reused for every batch of a run, and closed
+# with the one post_office opens per thread to build the messages.
+
+COUNTERS = ('sent', 'failed', 'deferred')
+COUNTER_KEY = 'mailer:%s'
+RATE_KEY = 'mailer:rate:%s:%d'
+
+
+def throughput():
+    """
+    Returns the number of mails sent, failed and deferred (because of a rate
+    limit) so far, as counted in the cache.
+    """
+    values = cache.get_many([COUNTER_KEY % name for name in COUNTERS])
+    return {name: values.get(COUNTER_KEY % name, 0) for name in COUNTERS}
+
+
+def count(name, value):
+    if not value:
+        return
+    key = COUNTER_KEY % name
+    cache.add(key, 0, timeout=None)
+    cache.incr(key, value)
+
+
+def domains(email):
+    recipients = list(email.to) + list(email.cc) + list(email.bcc)
+    return {recipient.rpartition('@')[2].lower() for recipient in recipients}
+
+
+class RateLimiter():
+    """
+    Per-domain limits, in mails per minute, shared by every worker through
+    the cache. Domains missing from MAILER_RATE_LIMITS get
+    MAILER_DEFAULT_RATE_LIMIT, None meaning unlimited.
+    """
+    def __init__(self):
+        self.limits = settings.MAILER_RATE_LIMITS
+        self.default = settings.MAILER_DEFAULT_RATE_LIMIT
+        self.minute = int(timezone.now().timestamp() // 60)
+
+    def acquire(self, domains):
+        """
+        Takes one slot for each of domains, or none of them if one is
+        exhausted. Returns whether the mail can be sent this minute.
+        """
+        taken = []
+        for domain in domains:
+            limit = self.limits.get(domain, self.default)
+            if limit is None:
+                continue
+            key = RATE_KEY % (domain, self.minute)
+            cache.add(key, 0, timeout=120)
+            taken += [key]
+            if cache.incr(key) > limit:
+                for key in taken:
+                    cache.decr(key)
+                return False
+        return True
+
+
+def claim_batch(size, exclude=()):
+    now = timezone.now()
+    order = settings.POST_OFFICE.get('SENDING_ORDER', ['-priority'])
+    return list(Email.objects.select_for_update(skip_locked=True)
+                .filter(status=STATUS.queued)
+                .filter(Q(scheduled_time__isnull=True) |
+                        Q(scheduled_time__lte=now))
+                .exclude(pk__in=exclude)
+                .order_by(*order)[:size])
+
+
+def send_batch(connection, limiter, size, exclude=()):
+    """
+    Claims and sends up to size queued mails over connection, skipping the
+    pks in exclude. Returns the mails claimed, sent, failed and deferred.
+    """
+    sent, failed, deferred = [], [], []
+    errors = {}
+    with transaction.atomic():
+        emails = claim_batch(size, exclude)
+        for email in emails:
+            if not limiter.acquire(domains(email)):
+                # left queued, the lock goes away with the transaction
+                deferred += [email]
+                continue
+            try:
+                connection.send_messages([email.email_message()])
+                sent += [email]
+            except Exception as e:
+                logger.exception('Failed to send email %s', email.pk)
+                errors[email.pk] = e
+                failed += [email]
+
+        now = timezone.now()
+        Email.objects.filter(pk__in=[e.pk for e in sent]).update(
+            status=STATUS.sent, last_updated=now)
+        Email.objects.filter(pk__in=[e.pk for e in failed]).update(
+            status=STATUS.failed, last_updated=now)
+
+        logs = [Log(email=email, status=STATUS.failed,
+                    exception_type=type(errors[email.pk]).__name__,
+                    message=str(errors[email.pk]))
+                for email in failed]
+        if settings.POST_OFFICE.get('LOG_LEVEL', 2) >= 2:
+            logs += [Log(email=email, status=STATUS.sent, message='')
+                     for email in sent]
+        Log.objects.bulk_create(logs)
+
+    count('sent', len(sent))
+    count('failed', len(failed))
+    count('deferred', len(deferred))
+    return emails, sent, failed, deferred
+
+
+def send_queued(batch_size=None, max_batches=None):
+    """
+    Sends queued mails batch after batch over a single SMTP connection, until
+    the queue is drained, only rate limited mails are left or max_batches
+    batches were sent. Returns the counts of this run.
+    """
+    batch_size = batch_size or settings.MAILER_BATCH_SIZE
+    max_batches = max_batches or settings.MAILER_MAX_BATCHES
+    limiter = RateLimiter()
+    totals = {name: 0 for name in COUNTERS}
+    # rate limited mails wait for the next run
+    deferred_pks = set()
+
+    connection = get_connection()
+    connection.open()
+    try:
+        for _ in range(max_batches):
+            emails, sent, failed, deferred = send_batch(
+                connection, limiter, batch_size, deferred_pks)
+            totals['sent'] += len(sent)
+            totals['failed'] += len(failed)
+            totals['deferred'] += len(deferred)
+            deferred_pks |= {email.pk for email in deferred}
+            if len(emails) < batch_size:
+                break
+    finally:
+        connection.close()
+        # opened by email_message(), would stay open for the thread's life
+        connections.close()
+    return totals
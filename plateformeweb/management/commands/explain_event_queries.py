@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from plateformeweb.models import Event, Organization, Place, PublishedEvent
+
+
+class Command(BaseCommand):
+    help = ("Prints the query plans of the hot Event queries. Run it before "
+            "and after migrating plateformeweb 0007 to compare them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true', dest='analyze',
+            help="run the queries and report actual timings (PostgreSQL)")
+
+    def queries(self):
+        now = timezone.now()
+        organization = Organization.objects.order_by('pk').first()
+        place = Place.objects.order_by('pk').first()
+        future = Event.objects.filter(starts_at__gte=now, published=True)
+        yield 'future published events', future.order_by('starts_at')[:20]
+        if organization:
+            yield 'future events of an organization', future.filter(
+                organization=organization).order_by('starts_at')[:20]
+        if place:
+            yield 'future events of a place', future.filter(
+                location=place).order_by('starts_at')[:20]
+        yield 'events to publish (tasks.publish_events)', Event.objects.filter(
+            publish_at__lte=now, starts_at__gte=now, published=False)
+        yield 'PublishedEvent', PublishedEvent.objects.filter(
+            starts_at__gte=now).order_by('starts_at')[:4]
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'postgresql':
+            explain = 'EXPLAIN ANALYZE ' if options['analyze'] else 'EXPLAIN '
+        elif connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+
+        with connection.cursor() as cursor:
+            for name, queryset in self.queries():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(explain + sql, params)
+                self.stdout.write("-- %s\n%s\n" % (name, sql % tuple(
+                    repr(param) for param in params)))
+                for row in cursor.fetchall():
+                    self.stdout.write('    ' + ' '.join(str(col) for col in row))
+                self.stdout.write('')
@@ -0,0 +1,175 @@
+import datetime
+import random
+import uuid
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import CustomUser
+from plateformeweb.cache import bump_versions
+from plateformeweb.models import (Activity, Event, Organization,
+                                  OrganizationPerson, Place, PlaceType)
+
+
+class Command(BaseCommand):
+    help = ("Generates synthetic organizations, places, activities, users "
+            "and events spread over the past and next years, with their "
+            "attendance, to benchmark the hot paths, e.g. with --events "
+            "1000000. See also run_benchmarks.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=100000)
+        parser.add_argument('--organizations', type=int, default=20)
+        parser.add_argument('--places', type=int, default=100)
+        parser.add_argument('--activities', type=int, default=3,
+                            help="activities per organization")
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--members', type=int, default=10,
+                            help="members per organization")
+        parser.add_argument('--attendance', type=float, default=0.7,
+                            help="average share of the seats booked")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            dest='batch_size')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.attendance = options['attendance']
+        # keeps the names and slugs of successive runs apart
+        self.run = uuid.uuid4().hex[:8]
+        self.owner = CustomUser.objects.filter(is_superuser=True).first()
+
+        users = self.create_users(options['users'], options['batch_size'])
+        organizations = self.create_organizations(options['organizations'])
+        members = self.create_members(organizations, users,
+                                      options['members'])
+        places = self.create_places(options['places'], organizations)
+        activities = self.create_activities(organizations,
+                                            options['activities'])
+
+        created = 0
+        while created < options['events']:
+            count = min(options['batch_size'], options['events'] - created)
+            self.create_events(created, count, places, activities, users,
+                               members)
+            created += count
+            self.stdout.write("%d/%d events" % (created, options['events']))
+
+        # bulk_create sends no signal
+        bump_versions('events', 'places', 'organizations', 'activities',
+                      'memberships')
+
+    def create_users(self, count, batch_size):
+        # hashing is slow on purpose, every user shares the same password
+        password = make_password('password')
+        emails = ['bench-%s-%d@example.com' % (self.run, i)
+                  for i in range(count)]
+        CustomUser.objects.bulk_create(
+            [CustomUser(email=email, password=password) for email in emails],
+            batch_size=batch_size)
+        self.stdout.write("%d users, password 'password'" % count)
+        return list(CustomUser.objects.filter(
+            email__startswith='bench-%s-' % self.run)
+            .values_list('pk', flat=True))
+
+    def create_organizations(self, count):
+        return [Organization.objects.create(
+            name='bench %s %d' % (self.run, i), owner=self.owner, active=True)
+            for i in range(count)]
+
+    def create_members(self, organizations, users, count):
+        """
+        Gives each organization count members among users, one of them admin
+        and a few volunteers. Returns their pks by organization pk.
+        """
+        members = {}
+        persons = []
+        for organization in organizations:
+            sample = self.random.sample(users, min(count, len(users)))
+            members[organization.pk] = sample
+            for index, user in enumerate(sample):
+                if index == 0:
+                    role = OrganizationPerson.ADMIN
+                elif index % 4 == 0:
+                    role = OrganizationPerson.VOLUNTEER
+                else:
+                    role = OrganizationPerson.MEMBER
+                persons += [OrganizationPerson(
+                    organization=organization, user_id=user, role=role)]
+        OrganizationPerson.objects.bulk_create(persons)
+        return members
+
+    def create_places(self, count, organizations):
+        place_type, created = PlaceType.objects.get_or_create(
+            name='bench', defaults={'slug': 'bench'})
+        return [Place.objects.create(
+            name='bench %s %d' % (self.run, i), type=place_type,
+            organization=organizations[i % len(organizations)],
+            owner=self.owner, address='', picture='foo.jpg')
+            for i in range(count)]
+
+    def create_activities(self, organizations, count):
+        return {organization.pk: [Activity.objects.create(
+            name='bench %s %d' % (organization.name, i),
+            organization=organization, picture='static/img/event-card.jpg')
+            for i in range(count)] for organization in organizations}
+
+    def create_events(self, first, count, places, activities, users, members):
+        now = timezone.now()
+        events = []
+        for i in range(first, first + count):
+            place = self.random.choice(places)
+            # two thirds in the past, like a site running for a while
+            starts_at = now + datetime.timedelta(
+                days=self.random.uniform(-730, 365))
+            publish_at = starts_at - datetime.timedelta(
+                days=self.random.randint(1, 30))
+            seats = self.random.randint(5, 30)
+            booked = self.random.sample(users, min(len(users), seats, int(
+                seats * self.random.uniform(0, 2 * self.attendance))))
+            event = Event(
+                title='bench', slug='bench-%s-%d' % (self.run, i),
+                organization_id=place.organization_id, owner=self.owner,
+                type=self.random.choice(activities[place.organization_id]),
+                location=place, published=publish_at <= now,
+                publish_at=publish_at, starts_at=starts_at,
+                ends_at=starts_at + datetime.timedelta(hours=3),
+                # the seats left
+                available_seats=seats - len(booked))
+            event.slug_reserved = True
+            event.booked = booked
+            events += [event]
+
+        with transaction.atomic():
+            last = Event.objects.order_by('-pk').values_list(
+                'pk', flat=True).first() or 0
+            Event.objects.bulk_create(events)
+            # bulk_create only sets primary keys on PostgreSQL, and a long
+            # slug__in hits the SQLite variable limit
+            pks = dict(Event.objects.filter(
+                pk__gt=last, slug__startswith='bench-%s-' % self.run)
+                .values_list('slug', 'pk'))
+
+            attendees, presents, organizers, seat_holders = [], [], [], []
+            for event in events:
+                event.pk = pks[event.slug]
+                if members[event.organization_id]:
+                    organizers += [Event.organizers.through(
+                        event_id=event.pk, customuser_id=self.random.choice(
+                            members[event.organization_id]))]
+                for user in event.booked:
+                    seat_holders += [Event.seat_holders.through(
+                        event_id=event.pk, customuser_id=user)]
+                    # attendees marked present leave the attendee list
+                    if event.starts_at < now and self.random.random() < 0.8:
+                        presents += [Event.presents.through(
+                            event_id=event.pk, customuser_id=user)]
+                    else:
+                        attendees += [Event.attendees.through(
+                            event_id=event.pk, customuser_id=user)]
+
+            Event.organizers.through.objects.bulk_create(organizers)
+            Event.attendees.through.objects.bulk_create(attendees)
+            Event.presents.through.objects.bulk_create(presents)
+            Event.seat_holders.through.objects.bulk_create(seat_holders)
@@ -0,0 +1,63 @@
+import glob
+import os
+import pstats
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Merges the request traces stored by "
+            "plateformeweb.middleware.ProfilingMiddleware into one report, "
+            "optionally restricted to some views and user roles.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', action='append', default=[],
+                            help="URL name, may be repeated")
+        parser.add_argument('--role', action='append', default=[],
+                            help="anonymous, user, visitor, member, "
+                                 "volunteer, admin or superuser, may be "
+                                 "repeated")
+        parser.add_argument('--sort', default='cumulative',
+                            help="pstats sort key, e.g. tottime")
+        parser.add_argument('--limit', type=int, default=40)
+        parser.add_argument('--callers', action='store_true', dest='callers',
+                            help="print the callers of the functions listed")
+        parser.add_argument('--output',
+                            help="also write the merged trace, for snakeviz "
+                                 "and the like")
+        parser.add_argument('--clear', action='store_true', dest='clear',
+                            help="delete the traces merged")
+
+    def handle(self, *args, **options):
+        paths = []
+        traces = Counter()
+        for path in sorted(glob.glob(os.path.join(settings.PROFILING_DIR,
+                                                  '*.prof'))):
+            # <url name>.<role>.<time>-<id>.prof
+            view, role = os.path.basename(path).split('.')[:2]
+            if options['view'] and view not in options['view']:
+                continue
+            if options['role'] and role not in options['role']:
+                continue
+            paths += [path]
+            traces[view, role] += 1
+
+        if not paths:
+            raise CommandError("No trace in %s" % settings.PROFILING_DIR)
+
+        for (view, role), count in sorted(traces.items()):
+            self.stdout.write("%5d  %s (%s)" % (count, view, role))
+        self.stdout.write('')
+
+        stats = pstats.Stats(*paths, stream=self.stdout)
+        stats.strip_dirs().sort_stats(options['sort'])
+        stats.print_stats(options['limit'])
+        if options['callers']:
+            stats.print_callers(options['limit'])
+        if options['output']:
+            stats.dump_stats(options['output'])
+
+        if options['clear']:
+            for path in paths:
+                os.remove(path)
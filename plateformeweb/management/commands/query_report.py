@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+
+from plateformeweb import middleware
+
+
+# column: (title, value from the totals of a view)
+COLUMNS = [
+    ('requests', lambda s: s['requests']),
+    ('queries', lambda s: s['queries'] / s['requests']),
+    ('max q.', lambda s: s['max_queries']),
+    ('sql ms', lambda s: s['sql_us'] / s['requests'] / 1000),
+    ('tpl ms', lambda s: s['template_us'] / s['requests'] / 1000),
+    ('total ms', lambda s: s['total_us'] / s['requests'] / 1000),
+    ('hits %', lambda s: 100 * s['cache_hits'] /
+     max(1, s['cache_hits'] + s['cache_misses'])),
+    ('over', lambda s: s['over_budget']),
+]
+
+SORTS = {
+    'queries': 'queries',
+    'sql': 'sql ms',
+    'template': 'tpl ms',
+    'total': 'total ms',
+    'requests': 'requests',
+    'over': 'over',
+}
+
+
+class Command(BaseCommand):
+    help = ("Prints the worst views from the request statistics gathered by "
+            "plateformeweb.middleware.RequestStatsMiddleware, averaged per "
+            "request.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORTS),
+                            default='queries')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--reset', action='store_true', dest='reset',
+                            help="clear the statistics after printing them")
+
+    def handle(self, *args, **options):
+        stats = {name: totals
+                 for name, totals in middleware.collected().items()
+                 if totals['requests']}
+        if not stats:
+            self.stdout.write("No statistics yet.")
+            return
+
+        column = [title for title, value in COLUMNS].index(
+            SORTS[options['sort']])
+        rows = sorted(
+            ([name] + [value(totals) for title, value in COLUMNS]
+             for name, totals in stats.items()),
+            key=lambda row: row[column + 1], reverse=True)
+
+        width = max(len(name) for name in stats)
+        self.stdout.write(' '.join(
+            ['view'.ljust(width)] +
+            [title.rjust(9) for title, value in COLUMNS]))
+        for row in rows[:options['limit']]:
+            self.stdout.write(' '.join(
+                [row[0].ljust(width)] +
+                [('%.1f' % value if isinstance(value, float)
+                  else str(value)).rjust(9) for value in row[1:]]))
+
+        if options['reset']:
+            middleware.clear()
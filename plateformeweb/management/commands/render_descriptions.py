@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_markdown.utils import markdown
+
+from plateformeweb.models import Activity, Organization, Place
+
+
+class Command(BaseCommand):
+    help = ("Fills the description_html of organizations, places and "
+            "activities from their markdown description")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', dest='all',
+            help="render every description again, not only the missing ones")
+
+    def handle(self, *args, **options):
+        for model in (Organization, Place, Activity):
+            objects = model.objects.exclude(description='')
+            if not options['all']:
+                objects = objects.filter(description_html='')
+
+            count = 0
+            with transaction.atomic():
+                for pk, description in objects.values_list('pk',
+                                                           'description'):
+                    # update() skips save() and its signals
+                    model.objects.filter(pk=pk).update(
+                        description_html=markdown(description))
+                    count += 1
+            self.stdout.write("%s: %d descriptions rendered" % (
+                model._meta.verbose_name_plural, count))
@@ -0,0 +1,196 @@
+import json
+import subprocess
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import CustomUser
+from plateformeweb.context_processors import site_context
+from plateformeweb.models import (Event, Organization, OrganizationPerson,
+                                  Place)
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(timings, rank):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * rank / 100))]
+
+
+class Command(BaseCommand):
+    help = ("Measures the latency percentiles and query counts of the hot "
+            "endpoints against the current database, filled with "
+            "generate_benchmark_data, and writes them as JSON. Use "
+            "--settings=ateliersoude.settings.benchmark for a local "
+            "PostgreSQL, or SQLite with BENCHMARK_DATABASE=sqlite.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help="measured requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', action='append', default=[],
+                            help="endpoint to run, may be repeated")
+        parser.add_argument('--output', help="JSON file, default stdout")
+        parser.add_argument('--compare',
+                            help="JSON file of a previous run to compare to")
+
+    def handle(self, *args, **options):
+        endpoints = self.endpoints()
+        if options['only']:
+            unknown = set(options['only']) - {name for name, call in endpoints}
+            if unknown:
+                raise CommandError("Unknown endpoints: %s" %
+                                   ', '.join(sorted(unknown)))
+            endpoints = [(name, call) for name, call in endpoints
+                         if name in options['only']]
+
+        results = {}
+        for name, call in endpoints:
+            results[name] = self.measure(call, options['requests'],
+                                         options['warmup'])
+            self.stderr.write(self.summary(name, results[name]))
+
+        report = {
+            'commit': self.commit(),
+            'database': connection.vendor,
+            'date': timezone.now().isoformat(),
+            'data': {
+                'organizations': Organization.objects.count(),
+                'places': Place.objects.count(),
+                'events': Event.objects.count(),
+                'users': CustomUser.objects.count(),
+                'attendances': Event.attendees.through.objects.count(),
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), report)
+
+    def endpoints(self):
+        """
+        Returns (name, call) for each endpoint measured, call doing one
+        request and returning its status code.
+        """
+        now = timezone.now()
+        event = (Event.objects.filter(published=True, starts_at__gte=now,
+                                      attendees__isnull=False)
+                 .order_by('starts_at').first())
+        if event is None:
+            raise CommandError("No future event with attendees, run "
+                               "generate_benchmark_data first.")
+        attendee = event.attendees.first()
+        # books and cancels in turn, the event needs a seat left
+        bookable = (Event.objects.filter(published=True, starts_at__gte=now,
+                                         available_seats__gt=0)
+                    .exclude(attendees=attendee).order_by('starts_at').first())
+        member = (OrganizationPerson.objects.filter(
+            organization=event.organization_id,
+            role__gte=OrganizationPerson.VOLUNTEER)
+            .select_related('user').first())
+        user = member.user if member else attendee
+
+        anonymous = Client()
+        client = Client()
+        client.force_login(user)
+        booker = Client()
+        booker.force_login(attendee)
+
+        def get(client, url, **params):
+            return lambda: client.get(url, params).status_code
+
+        def context():
+            request = RequestFactory().get('/')
+            request.user = user
+            values = site_context(request)
+            for name, value in values.items():
+                if name != 'site':
+                    # evaluates the lazy value
+                    bool(value)
+            return 200
+
+        endpoints = [
+            ('list_events_in_context', get(
+                anonymous, reverse('list_events_in_context'))),
+            ('list_events_organization', get(
+                anonymous, reverse('list_events_organization',
+                                   args=[event.organization_id]))),
+            ('list_events_page', get(
+                anonymous, reverse('list_events_page'))),
+            ('list_events_page_user', get(
+                client, reverse('list_events_page_user', args=[user.pk]))),
+            ('get_all_places', get(anonymous, reverse('get_all_places'))),
+            ('list_places_in_bbox', get(
+                anonymous, reverse('list_places_in_bbox'), south=41,
+                west=-5.5, north=51.5, east=10, zoom=6)),
+            ('event_detail', get(client, reverse(
+                'event_detail', args=[event.pk, event.slug]))),
+            ('event_detail_anonymous', get(anonymous, reverse(
+                'event_detail', args=[event.pk, event.slug]))),
+            ('event_list', get(client, reverse('event_list'))),
+            ('site_context', context),
+        ]
+        if bookable:
+            endpoints += [('book_event', lambda: booker.post(
+                reverse('book'), {'event_id': bookable.pk}).status_code)]
+        return endpoints
+
+    def measure(self, call, requests, warmup):
+        for i in range(warmup):
+            call()
+
+        timings, queries, statuses = [], [], set()
+        for i in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                statuses.add(call())
+                timings += [(time.perf_counter() - start) * 1000]
+            queries += [len(captured)]
+
+        latency = {'p%d' % rank: round(percentile(timings, rank), 2)
+                   for rank in PERCENTILES}
+        latency['mean'] = round(sum(timings) / len(timings), 2)
+        latency['max'] = round(max(timings), 2)
+        return {'requests': requests,
+                'status': sorted(statuses),
+                'latency_ms': latency,
+                'queries': {'min': min(queries), 'max': max(queries),
+                            'mean': round(sum(queries) / len(queries), 2)}}
+
+    def summary(self, name, result):
+        return "%-26s p50 %8.2f ms  p99 %8.2f ms  %s queries" % (
+            name, result['latency_ms']['p50'], result['latency_ms']['p99'],
+            result['queries']['max'])
+
+    def compare(self, previous, report):
+        self.stderr.write("\ncompared to %s (%s):" % (
+            previous.get('commit'), previous.get('date')))
+        for name, result in sorted(report['endpoints'].items()):
+            before = previous['endpoints'].get(name)
+            if before is None:
+                continue
+            self.stderr.write("%-26s p50 %+7.1f%%  queries %+d" % (
+                name,
+                (result['latency_ms']['p50'] /
+                 max(before['latency_ms']['p50'], 0.01) - 1) * 100,
+                result['queries']['max'] - before['queries']['max']))
+
+    def commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
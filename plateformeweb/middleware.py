@@ -0,0 +1,313 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connection
+from django.template.backends.django import Template
+from django.urls import Resolver404, resolve
+
+
+logger = logging.getLogger(__name__)
+
+
+# Per-view request statistics, cheap enough for production: query count and
+# SQL time (from the debug cursor, forced on for the request), template
+# render time and cache hits, aggregated in process memory by URL name and
+# added to the shared cache every QUERY_STATS_FLUSH_SECONDS. The query_report
+# command prints them. A request running more queries than the QUERY_BUDGETS
+# of its view logs a warning.
+
+STATS_KEY = 'querystats:%s:%s'
+NAMES_KEY = 'querystats:names'
+# summed counters, times in microseconds since the cache only adds integers
+COUNTERS = ('requests', 'queries', 'sql_us', 'template_us', 'total_us',
+            'cache_hits', 'cache_misses', 'over_budget')
+
+_local = threading.local()
+
+
+def current():
+    """
+    Returns the statistics of the request running in this thread, if any.
+    """
+    return getattr(_local, 'stats', None)
+
+
+def timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        stats = current()
+        # nested renders (render_to_string in a tag) count once
+        if stats is None or stats['rendering']:
+            return render(self, *args, **kwargs)
+        stats['rendering'] = True
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats['template_us'] += int((time.perf_counter() - start) * 1e6)
+            stats['rendering'] = False
+    wrapper.instrumented = True
+    return wrapper
+
+
+def counted_get(get):
+    def wrapper(self, key, default=None, *args, **kwargs):
+        value = get(self, key, default, *args, **kwargs)
+        stats = current()
+        if stats is not None:
+            if value is default:
+                stats['cache_misses'] += 1
+            else:
+                stats['cache_hits'] += 1
+        return value
+    wrapper.instrumented = True
+    return wrapper
+
+
+def counted_get_many(get_many):
+    def wrapper(self, keys, *args, **kwargs):
+        values = get_many(self, keys, *args, **kwargs)
+        stats = current()
+        if stats is not None:
+            stats['cache_hits'] += len(values)
+            stats['cache_misses'] += len(keys) - len(values)
+        return values
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument():
+    """
+    Wraps the template and cache backends to report to the current request,
+    once per process.
+    """
+    if not getattr(Template.render, 'instrumented', False):
+        Template.render = timed_render(Template.render)
+    backend = type(caches['default'])
+    if not getattr(backend.get, 'instrumented', False):
+        backend.get = counted_get(backend.get)
+    if not getattr(backend.get_many, 'instrumented', False):
+        backend.get_many = counted_get_many(backend.get_many)
+
+
+class RequestStatsMiddleware():
+    lock = threading.Lock()
+    # {url name: {counter: value}}, plus max_queries
+    pending = {}
+    flushed_at = time.time()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument()
+
+    def __call__(self, request):
+        stats = {counter: 0 for counter in COUNTERS}
+        stats['rendering'] = False
+        _local.stats = stats
+        debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        # the log is capped and may already hold queries (tests, commands)
+        first = len(connection.queries_log)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats['total_us'] = int((time.perf_counter() - start) * 1e6)
+            queries = list(connection.queries_log)[first:]
+            connection.force_debug_cursor = debug_cursor
+            _local.stats = None
+
+        stats['requests'] = 1
+        stats['queries'] = len(queries)
+        stats['sql_us'] = int(sum(float(query['time']) for query in queries)
+                              * 1e6)
+        name = self.url_name(request)
+        budget = settings.QUERY_BUDGETS.get(name,
+                                            settings.QUERY_BUDGET_DEFAULT)
+        if budget is not None and len(queries) > budget:
+            stats['over_budget'] = 1
+            logger.warning("%s ran %d queries, over its budget of %d (%s)",
+                           name, len(queries), budget, request.path)
+        self.record(name, stats)
+        return response
+
+    def url_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return '<unresolved>'
+        return match.url_name or match.view_name
+
+    def record(self, name, stats):
+        with self.lock:
+            totals = self.pending.setdefault(
+                name, dict({counter: 0 for counter in COUNTERS},
+                           max_queries=0))
+            for counter in COUNTERS:
+                totals[counter] += stats[counter]
+            totals['max_queries'] = max(totals['max_queries'],
+                                        stats['queries'])
+            elapsed = time.time() - self.flushed_at
+            if elapsed < settings.QUERY_STATS_FLUSH_SECONDS:
+                return
+            pending = RequestStatsMiddleware.pending
+            RequestStatsMiddleware.pending = {}
+            RequestStatsMiddleware.flushed_at = time.time()
+        flush(pending)
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.pending = {}
+            cls.flushed_at = time.time()
+
+
+def flush(pending):
+    """
+    Adds the statistics gathered by this process to the shared ones.
+    """
+    if not pending:
+        return
+    names = cache.get(NAMES_KEY) or set()
+    if not names.issuperset(pending):
+        cache.set(NAMES_KEY, names | set(pending), None)
+    for name, totals in pending.items():
+        for counter in COUNTERS:
+            key = STATS_KEY % (name, counter)
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, totals[counter])
+            except ValueError:
+                # evicted in between
+                cache.set(key, totals[counter], None)
+        key = STATS_KEY % (name, 'max_queries')
+        if totals['max_queries'] > (cache.get(key) or 0):
+            cache.set(key, totals['max_queries'], None)
+
+
+def collected():
+    """
+    Returns the shared statistics, {url name: {counter: value}}.
+    """
+    names = cache.get(NAMES_KEY) or set()
+    keys = {STATS_KEY % (name, counter): (name, counter)
+            for name in names for counter in COUNTERS + ('max_queries',)}
+    stats = {name: dict.fromkeys(COUNTERS + ('max_queries',), 0)
+             for name in names}
+    for key, value in cache.get_many(list(keys)).items():
+        name, counter = keys[key]
+        stats[name][counter] = value
+    return stats
+
+
+def clear():
+    names = cache.get(NAMES_KEY) or set()
+    cache.delete_many([STATS_KEY % (name, counter) for name in names
+                       for counter in COUNTERS + ('max_queries',)])
+    cache.delete(NAMES_KEY)
+
+
+# Sampled profiling of real traffic, opt-in: one request in
+# PROFILING_SAMPLE_RATE runs under cProfile, as does the next request to a
+# view that took more than PROFILING_SLOW_MS. Each trace is written to
+# PROFILING_DIR, named after the URL name and the role of the user, and the
+# profile_report command merges them.
+
+ROLE_NAMES = {
+    30: 'admin',
+    20: 'volunteer',
+    10: 'member',
+    0: 'visitor',
+}
+
+
+def user_role(user):
+    """
+    Returns the highest role of user in any organization, as a name.
+    """
+    from .rules import organization_roles
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_superuser:
+        return 'superuser'
+    roles = [role for org_roles in organization_roles(user).values()
+             for role in org_roles]
+    return ROLE_NAMES.get(max(roles), 'user') if roles else 'user'
+
+
+def trace_path(name, role):
+    # no separator nor dot in the names, the report splits on them
+    name = ''.join(char if char.isalnum() or char in '-_' else '_'
+                   for char in name)
+    return os.path.join(settings.PROFILING_DIR, '%s.%s.%d-%s.prof' % (
+        name, role, int(time.time()), uuid.uuid4().hex[:8]))
+
+
+class ProfilingMiddleware():
+    lock = threading.Lock()
+    # URL names of the views found slow, profiled on their next request
+    slow = set()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def url_name(self, request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return match.url_name or match.view_name
+
+    def sampled(self, request):
+        rate = settings.PROFILING_SAMPLE_RATE
+        if rate and random.randrange(rate) == 0:
+            return True
+        if self.slow:
+            name = self.url_name(request)
+            with self.lock:
+                if name in self.slow:
+                    self.slow.discard(name)
+                    return True
+        return False
+
+    def __call__(self, request):
+        profiler = None
+        if self.sampled(request):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is running in this process
+                profiler = None
+
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        elapsed = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        name = match and (match.url_name or match.view_name)
+        if name is None:
+            return response
+        threshold = settings.PROFILING_SLOW_MS
+        if profiler is None and threshold is not None and elapsed > threshold:
+            with self.lock:
+                self.slow.add(name)
+        if profiler is not None:
+            self.store(profiler, name, getattr(request, 'user', None))
+        return response
+
+    def store(self, profiler, name, user):
+        # best effort, the response is served anyway
+        try:
+            os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+            profiler.dump_stats(trace_path(name, user_role(user)))
+        except OSError:
+            logger.exception("Could not store the profile of %s", name)
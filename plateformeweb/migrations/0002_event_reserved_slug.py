@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import plateformeweb.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plateformeweb', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='slug',
+            field=plateformeweb.models.ReservedSlugField(default='', editable=False, populate_from='title', unique=True),
+        ),
+    ]
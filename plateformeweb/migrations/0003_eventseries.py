@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('plateformeweb', '0002_event_reserved_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSeries',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available_seats', models.IntegerField(blank=True, default=0, verbose_name='Available seats')),
+                ('rule', models.TextField(verbose_name='Recurrence rule')),
+                ('starts_after', models.DurationField(verbose_name='Start time')),
+                ('ends_after', models.DurationField(verbose_name='End time')),
+                ('publish_countdown', models.PositiveSmallIntegerField(default=7, verbose_name='Days of publication beforehand')),
+                ('materialized_until', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('location', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='plateformeweb.Place')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='plateformeweb.Organization')),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='plateformeweb.Activity')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='plateformeweb.EventSeries'),
+        ),
+    ]
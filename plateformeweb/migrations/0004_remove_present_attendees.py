@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+
+def remove_present_attendees(apps, schema_editor):
+    # EventView used to do this on every page view, people marked present
+    # are now taken out of the attendees when they are marked
+    Event = apps.get_model('plateformeweb', 'Event')
+    attendees = Event.attendees.through
+    presents = Event.presents.through
+    present = presents.objects.filter(event_id=OuterRef('event_id'),
+                                      customuser_id=OuterRef('customuser_id'))
+    overlap = list(attendees.objects.annotate(present=Exists(present)).filter(
+        present=True).values_list('pk', flat=True))
+    attendees.objects.filter(pk__in=overlap).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plateformeweb', '0003_eventseries'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_present_attendees,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from plateformeweb import geo
+
+
+def copy_coordinates(apps, schema_editor):
+    Place = apps.get_model('plateformeweb', 'Place')
+    for place in Place.objects.select_related('address').exclude(
+            address__latitude=None).exclude(address__longitude=None):
+        latitude = place.address.latitude
+        longitude = place.address.longitude
+        Place.objects.filter(pk=place.pk).update(
+            latitude=latitude, longitude=longitude,
+            geohash=geo.encode(latitude, longitude, geo.PRECISION))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plateformeweb', '0004_remove_present_attendees'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=9),
+        ),
+        migrations.AlterIndexTogether(
+            name='place',
+            index_together=set([('latitude', 'longitude')]),
+        ),
+        migrations.RunPython(copy_coordinates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django_markdown.utils import markdown
+
+
+def render_descriptions(apps, schema_editor):
+    for name in ('Organization', 'Place', 'Activity'):
+        model = apps.get_model('plateformeweb', name)
+        for pk, description in model.objects.exclude(
+                description='').values_list('pk', 'description'):
+            model.objects.filter(pk=pk).update(
+                description_html=markdown(description))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plateformeweb', '0005_place_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(render_descriptions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# partial indexes, PostgreSQL only: the future published events the listings
+# read, and the unpublished ones tasks.publish_events looks for
+PARTIAL_INDEXES = [
+    ('event_future_org_idx',
+     '(organization_id, starts_at) WHERE published'),
+    ('event_future_place_idx',
+     '(location_id, starts_at) WHERE published'),
+    ('event_to_publish_idx',
+     '(publish_at, starts_at) WHERE NOT published'),
+]
+
+
+def create_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in PARTIAL_INDEXES:
+        schema_editor.execute('CREATE INDEX %s ON plateformeweb_event %s' % (
+            name, definition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in PARTIAL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plateformeweb', '0006_description_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['published', 'starts_at'], name='event_published_starts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['organization', 'starts_at'], name='event_org_starts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['location', 'starts_at'], name='event_place_starts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['published', 'publish_at'], name='event_published_publish_idx'),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def record_seat_holders(apps, schema_editor):
+    # the attendees booked so far took a seat unless they were volunteers or
+    # admins of the organization; people marked present can't cancel anymore
+    Event = apps.get_model('plateformeweb', 'Event')
+    OrganizationPerson = apps.get_model('plateformeweb', 'OrganizationPerson')
+    attendees = Event.attendees.through
+    seat_holders = Event.seat_holders.through
+    staff = OrganizationPerson.objects.filter(
+        user_id=OuterRef('customuser_id'),
+        organization_id=OuterRef('event__organization_id'),
+        role__gte=20)  # OrganizationPerson.VOLUNTEER
+    rows = attendees.objects.annotate(staff=Exists(staff)).filter(
+        staff=False).values_list('event_id', 'customuser_id')
+    seat_holders.objects.bulk_create([
+        seat_holders(event_id=event_id, customuser_id=user_id)
+        for event_id, user_id in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('plateformeweb', '0007_event_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='seat_holders',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='seat_holder_user', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(record_seat_holders,
+                             migrations.RunPython.noop),
+    ]
@@ -5,13 +5,47 @@ from django.urls import reverse
 from address.models import AddressField
 from users.models import CustomUser
 from django.conf import settings
+from django.core.cache import cache
 from autoslug import AutoSlugField
 from django_markdown.models import MarkdownField
+from django_markdown.utils import markdown
 from easy_maps.widgets import AddressWithMapWidget
-import locale
+import datetime
+from dateutil.rrule import rrulestr
+from .cache import versioned_key
+from . import dates, geo
 # ------------------------------------------------------------------------------
 
-class Organization(models.Model):
+class RenderedDescriptionMixin():
+    """
+    Keeps description_html, the HTML of the markdown description, so pages
+    don't convert it on every render. It is only converted again on save
+    when the description changed since the instance was loaded.
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rendered_description = instance.__dict__.get('description')
+        return instance
+
+    def render_description(self):
+        if (self.description != getattr(self, '_rendered_description', None)
+                or self.description and not self.description_html):
+            self.description_html = markdown(self.description)
+            self._rendered_description = self.description
+            return True
+        return False
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.render_description()
+        elif 'description' in update_fields and self.render_description():
+            kwargs['update_fields'] = list(update_fields) + ['description_html']
+        super().save(*args, **kwargs)
+
+
+class Organization(RenderedDescriptionMixin, models.Model):
     name = models.CharField(max_length=100, null=False,
                             blank=False,
                             verbose_name=_("Organization name"))
@@ -19,6 +53,8 @@ class Organization(models.Model):
     description = MarkdownField(verbose_name=_("Activity description"),
                             null=False,
                             blank=False, default="")
+    description_html = models.TextField(blank=True, default="",
+                                        editable=False)
     picture = models.ImageField(verbose_name=_('Image'), upload_to='organizations/', null=True)
     active = models.BooleanField(verbose_name=_('Active'))
     slug = AutoSlugField(populate_from='name', unique=True, default='')
@@ -111,38 +147,52 @@ class OrganizationAdministrator(OrganizationPerson):
 
 # extend the Organization with convenience methods
 
+def get_roles(self):
+    """
+    Returns the users of the organization by role, {role: [user, ...]}, read
+    with a single query. The index is memoized on the instance. Only the
+    (user pk, role) pairs are kept in the shared cache, until
+    plateformeweb.signals sees a membership change, the users themselves are
+    read again by primary key.
+    """
+    roles = getattr(self, '_roles', None)
+    if roles is None:
+        key = versioned_key('organization_roles', ('organization', self.pk))
+        pairs = cache.get(key)
+        if pairs is None:
+            persons = list(OrganizationPerson.objects.filter(
+                organization=self).select_related('user').order_by('pk'))
+            pairs = [(person.user_id, person.role) for person in persons]
+            users = {person.user_id: person.user for person in persons}
+            cache.set(key, pairs, settings.ORGANIZATION_ROLES_CACHE_TTL)
+        else:
+            users = CustomUser.objects.in_bulk(
+                {user_id for user_id, role in pairs})
+        roles = {role: [] for role, name in OrganizationPerson.MEMBER_TYPES}
+        for user_id, role in pairs:
+            if user_id in users:
+                roles[role] += [users[user_id]]
+        self._roles = roles
+    return roles
+
+
 def get_admins(self):
-    queryset = OrganizationPerson.objects.filter(role=OrganizationPerson.ADMIN, organization=self)
-    ret = []
-    for query in queryset:
-        ret += [query.user]
-    return ret
+    return list(self.roles()[OrganizationPerson.ADMIN])
 
 
 def get_volunteers(self):
-    queryset = OrganizationPerson.objects.filter(role=OrganizationPerson.VOLUNTEER, organization=self)
-    ret = []
-    for query in queryset:
-        ret += [query.user]
-    return ret
+    return list(self.roles()[OrganizationPerson.VOLUNTEER])
 
 
 def get_members(self):
-    queryset = OrganizationPerson.objects.filter(role=OrganizationPerson.MEMBER, organization=self)
-    ret = []
-    for query in queryset:
-        ret += [query.user]
-    return ret
+    return list(self.roles()[OrganizationPerson.MEMBER])
 
 
 def get_visitors(self):
-    queryset = OrganizationPerson.objects.filter(role=OrganizationPerson.VISITOR, organization=self)
-    ret = []
-    for query in queryset:
-        ret += [query.user]
-    return ret
+    return list(self.roles()[OrganizationPerson.VISITOR])
 
 
+Organization.roles = get_roles
 Organization.admins = get_admins
 Organization.visitors = get_visitors
 Organization.members = get_members
@@ -162,7 +212,7 @@ class PlaceType(models.Model):
     def get_other_place():
         return PlaceType.get_or_create(name="Other")[0]
 
-class Place(models.Model):
+class Place(RenderedDescriptionMixin, models.Model):
     name = models.CharField(max_length=100, null=False,
                             blank=False,
                             verbose_name=_("Name"))
@@ -173,6 +223,8 @@ class Place(models.Model):
     description = MarkdownField(verbose_name=_("Place description"),
                             null=False,
                             blank=False, default="")
+    description_html = models.TextField(blank=True, default="",
+                                        editable=False)
 
     type = models.ForeignKey(PlaceType, verbose_name=_('Type'),
                              null=False,
@@ -185,9 +237,34 @@ class Place(models.Model):
                            verbose_name=_("Postal address"))
     picture = models.ImageField(verbose_name=_('Image'), upload_to='places/')
 
+    # copied from the address on save, for the spatial lookups
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=geo.PRECISION, blank=True,
+                               default='', editable=False, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        index_together = [('latitude', 'longitude')]
+
+    def sync_coordinates(self):
+        address = self.address if self.address_id else None
+        latitude = getattr(address, 'latitude', None)
+        longitude = getattr(address, 'longitude', None)
+        if latitude is None or longitude is None:
+            self.latitude = self.longitude = None
+            self.geohash = ''
+        else:
+            self.latitude = latitude
+            self.longitude = longitude
+            self.geohash = geo.encode(latitude, longitude, geo.PRECISION)
+
+    def save(self, *args, **kwargs):
+        self.sync_coordinates()
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('place_detail', args=(self.pk, self.slug,))
 
@@ -217,7 +294,7 @@ class Condition(models.Model):
         return self.name
 
 # EventType is an activity
-class Activity(models.Model):
+class Activity(RenderedDescriptionMixin, models.Model):
     name = models.CharField(verbose_name=_("Activity type"), max_length=100,
                             null=False,
                             blank=False, default="")
@@ -227,6 +304,8 @@ class Activity(models.Model):
     description = MarkdownField(verbose_name=_("Activity description"),
                             null=False,
                             blank=False, default="")
+    description_html = models.TextField(blank=True, default="",
+                                        editable=False)
     picture = models.ImageField(verbose_name=_('Image'), upload_to='activities/')
 
     def __str__(self):
@@ -241,6 +320,64 @@ class Activity(models.Model):
 
 # ------------------------------------------------------------------------------
 
+class EventSeries(models.Model):
+    """
+    A recurring event, described by an RFC 5545 recurrence (DTSTART, RRULE,
+    RDATE and EXDATE lines). Its Event rows are only created for a rolling
+    horizon, see plateformeweb.occurrences.materialize.
+    """
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE,
+                                     null=False)
+    owner = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
+    type = models.ForeignKey(Activity, on_delete=models.DO_NOTHING)
+    location = models.ForeignKey(Place, on_delete=models.DO_NOTHING, null=True)
+    available_seats = models.IntegerField(verbose_name=_('Available seats'),
+                                          null=False, blank=True, default=0)
+    rule = models.TextField(verbose_name=_("Recurrence rule"))
+    # offsets from midnight of each occurrence's day, the end may be past
+    # midnight
+    starts_after = models.DurationField(verbose_name=_("Start time"))
+    ends_after = models.DurationField(verbose_name=_("End time"))
+    publish_countdown = models.PositiveSmallIntegerField(
+        verbose_name=_("Days of publication beforehand"), default=7)
+    materialized_until = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def recurrence(self):
+        # raises ValueError if the rule can't be parsed
+        return rrulestr(self.rule, forceset=True)
+
+    def occurrences(self, after, until):
+        """
+        Yields (starts_at, ends_at, publish_at) for the days of the series
+        in ]after, until].
+        """
+        for day in self.recurrence():
+            if timezone.is_naive(day):
+                day = timezone.make_aware(day)
+            if day <= after:
+                continue
+            if day > until:
+                break
+            yield dates.occurrence(day, self.starts_after, self.ends_after,
+                                   self.publish_countdown)
+
+    def __str__(self):
+        return '%s (%s)' % (self.type, self.rule)
+
+
+class ReservedSlugField(AutoSlugField):
+    # AutoSlugField probes the table for a free slug each time a row is saved,
+    # even through bulk_create; bulk generators reserve unique slugs up front
+    # and flag their instances with slug_reserved to skip the probe
+    def pre_save(self, instance, add):
+        if getattr(instance, 'slug_reserved', False):
+            return getattr(instance, self.attname)
+        return super().pre_save(instance, add)
+
+
 class Event(models.Model):
     title = models.CharField(verbose_name=_("Title"), max_length=150,
                              null=True,
@@ -260,8 +397,8 @@ class Event(models.Model):
         blank=False,
         default=timezone.now)
     type = models.ForeignKey(Activity, on_delete=models.DO_NOTHING)
-    slug = AutoSlugField(populate_from=('title'), default='',
-                         unique=True)
+    slug = ReservedSlugField(populate_from=('title'), default='',
+                             unique=True)
     starts_at = models.DateTimeField(verbose_name=_("Start date and time"),
                                      null=False,
                                      blank=False,
@@ -281,30 +418,41 @@ class Event(models.Model):
     organizers = models.ManyToManyField(
         CustomUser, related_name='organizer_user', verbose_name=_('Organizers'),
         blank=True)
+    # the people holding one of the seats, given back when they cancel:
+    # volunteers and admins of the organization book without taking one
+    seat_holders = models.ManyToManyField(
+        CustomUser, related_name='seat_holder_user', editable=False,
+        blank=True)
     location = models.ForeignKey(Place, on_delete=models.DO_NOTHING, null=True)
+    series = models.ForeignKey(EventSeries, on_delete=models.SET_NULL,
+                               null=True, blank=True, related_name='events')
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # the listings filter on these and order by starts_at, PostgreSQL
+        # also gets partial indexes, see migration 0007
+        indexes = [
+            models.Index(fields=['published', 'starts_at'],
+                         name='event_published_starts_idx'),
+            models.Index(fields=['organization', 'starts_at'],
+                         name='event_org_starts_idx'),
+            models.Index(fields=['location', 'starts_at'],
+                         name='event_place_starts_idx'),
+            models.Index(fields=['published', 'publish_at'],
+                         name='event_published_publish_idx'),
+        ]
+
     def date_interval_format(self):
-        locale.setlocale(locale.LC_ALL, 'fr_FR')
-        starts_at_date = self.starts_at.date().strftime("%A %d %B %Y")
-        starts_at_time = self.starts_at.time().strftime("%X")
-        ends_at_time = self.ends_at.time().strftime("%X")
-
-        # ex Lundi 01 Janvier 2018 de 20:01:12 à 22:01:12
-        string = starts_at_date
-        string += " de "
-        string += starts_at_time
-        string += " à "
-        string += ends_at_time
-        return string
+        # ex lundi 01 janvier 2018 de 20:01:12 à 22:01:12
+        return dates.interval(self.starts_at, self.ends_at)
 
     def get_absolute_url(self):
         return reverse('event_detail', args=(self.pk, self.slug,))
 
     def __str__(self):
-        full_title = '%s %s' % (self.title, self.starts_at.date().strftime("%A %d %B %Y"))
+        full_title = '%s %s' % (self.title, dates.full_date(self.starts_at))
         return full_title
 
 class PublishedEventManager(models.Manager):
@@ -0,0 +1,135 @@
+import datetime
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from actstream.models import Action, Follow
+
+from . import publication
+from .cache import bump_versions
+from .models import Event, EventSeries
+
+
+# Batch generator for recurring events: every occurrence is built in memory
+# and written with a handful of bulk inserts, whatever the number of dates.
+
+
+def reserve_slugs(base, count):
+    """
+    Returns count event slugs derived from base that aren't taken yet,
+    numbered the way AutoSlugField numbers duplicates (base, base-2, ...).
+    """
+    max_length = Event._meta.get_field('slug').max_length
+    # leave room for the "-<index>" suffix
+    base = slugify(base)[:max_length - 6].strip('-') or 'event'
+    taken = set(Event.objects.filter(slug__startswith=base)
+                .values_list('slug', flat=True))
+
+    slugs = []
+    index = 1
+    while len(slugs) < count:
+        slug = base if index == 1 else '%s-%d' % (base, index)
+        if slug not in taken:
+            slugs += [slug]
+        index += 1
+    return slugs
+
+
+def create_occurrences(owner, dates, slug, **fields):
+    """
+    Creates one Event per (starts_at, ends_at, publish_at) tuple of dates,
+    sharing fields (organization, type, location, ...). owner organizes and
+    follows every occurrence, and a creation action is recorded for each.
+    Returns the created events.
+    """
+    dates = list(dates)
+    slugs = reserve_slugs(slug, len(dates))
+    now = timezone.now()
+
+    events = []
+    for (starts_at, ends_at, publish_at), event_slug in zip(dates, slugs):
+        event = Event(owner=owner, slug=event_slug, starts_at=starts_at,
+                      ends_at=ends_at, publish_at=publish_at, **fields)
+        event.slug_reserved = True
+        events += [event]
+
+    with transaction.atomic():
+        Event.objects.bulk_create(events)
+        # bulk_create only sets primary keys on PostgreSQL, the slugs are
+        # unique on every backend
+        pks = dict(Event.objects.filter(slug__in=slugs)
+                   .values_list('slug', 'pk'))
+        for event in events:
+            event.pk = pks[event.slug]
+
+        # bulk_create sends no post_save nor m2m_changed
+        bump_versions('events', 'actions',
+                      *([('user', owner.pk)] if owner else []))
+        publication.schedule(events)
+
+        if owner is None:
+            # series whose creator was deleted
+            return events
+
+        organizers = Event.organizers.through
+        organizers.objects.bulk_create([
+            organizers(event_id=event.pk, customuser_id=owner.pk)
+            for event in events])
+
+        Action.objects.bulk_create([
+            Action(actor=owner, verb=' a créé ', action_object=event,
+                   target=event.location, timestamp=now)
+            for event in events])
+
+        event_type = ContentType.objects.get_for_model(Event)
+        Follow.objects.bulk_create([
+            Follow(user=owner, content_type=event_type,
+                   object_id=str(event.pk), actor_only=False, started=now)
+            for event in events])
+
+    return events
+
+
+def series_horizon():
+    return timezone.now() + datetime.timedelta(
+        days=settings.EVENT_SERIES_HORIZON_DAYS)
+
+
+def materialize(series, until=None):
+    """
+    Creates the events of series up to until (default: the rolling horizon)
+    that weren't created yet, never in the past. Returns them.
+    """
+    until = until or series_horizon()
+    with transaction.atomic():
+        # serializes the periodic task and the creation view
+        series = EventSeries.objects.select_for_update().get(pk=series.pk)
+        # occurrences are days, today's one still counts
+        today = timezone.make_aware(datetime.datetime.combine(
+            timezone.localdate(), datetime.time()))
+        after = today - datetime.timedelta(microseconds=1)
+        after = max(series.materialized_until or after, after)
+        if until <= after:
+            return []
+
+        slug = str(series.type)
+        slug += '-' + series.organization.slug
+        if series.location is not None:
+            slug += '-' + series.location.slug
+
+        events = []
+        dates = list(series.occurrences(after, until))
+        if dates:
+            events = create_occurrences(
+                series.owner, dates, slug,
+                series=series,
+                title=series.type.name,
+                organization=series.organization,
+                available_seats=series.available_seats,
+                location=series.location,
+                type=series.type,
+            )
+        series.materialized_until = until
+        series.save(update_fields=['materialized_until', 'updated_at'])
+    return events
@@ -0,0 +1,98 @@
+import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import Event
+
+
+# Publication of the events at their publish_at. The events due within the
+# next PUBLICATION_WINDOW_MINUTES each get a Celery task with that ETA, queued
+# when they are saved or when the window reaches them. tasks.publish_events
+# moves the window forward and publishes any event a task missed (worker
+# down, lost message), it no longer needs to run every minute.
+# Extra tasks are harmless: publishing is a conditional update.
+
+SCHEDULED_UNTIL_KEY = 'publication:scheduled_until'
+
+
+def window_end(now=None):
+    return (now or timezone.now()) + datetime.timedelta(
+        minutes=settings.PUBLICATION_WINDOW_MINUTES)
+
+
+def unpublished(now=None):
+    """
+    Events that aren't published yet and haven't started.
+    """
+    return Event.objects.filter(published=False,
+                                starts_at__gte=now or timezone.now())
+
+
+def publish(events, now=None):
+    """
+    Publishes events whose publish_at has passed, invalidating the cached
+    listings. Returns the number of events published.
+    """
+    now = now or timezone.now()
+    published = events.filter(published=False, publish_at__lte=now,
+                              starts_at__gte=now).update(published=True)
+    if published:
+        # a queryset update sends no post_save
+        bump_version('events')
+    return published
+
+
+def enqueue(events):
+    """
+    Queues a publication task for each of the (pk, publish_at) events once
+    the current transaction is committed, so the task sees the saved row.
+    """
+    from . import tasks
+
+    def send():
+        for pk, publish_at in events:
+            tasks.publish_event.apply_async((pk,), eta=publish_at)
+
+    if events:
+        transaction.on_commit(send)
+
+
+def aware(value):
+    # the mass creation view builds naive dates, saved in the current timezone
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def schedule(events):
+    """
+    Queues the publication of the saved events that fall within the window
+    already scheduled, the sweep takes care of the later ones.
+    """
+    until = cache.get(SCHEDULED_UNTIL_KEY) or window_end()
+    now = timezone.now()
+    enqueue([(event.pk, aware(event.publish_at)) for event in events
+             if not event.published and aware(event.starts_at) >= now
+             and aware(event.publish_at) <= until])
+
+
+def sweep():
+    """
+    Publishes the events whose time has come and queues the tasks of those
+    entering the window. Returns the number of events published.
+    """
+    now = timezone.now()
+    published = publish(Event.objects.all(), now)
+
+    start = cache.get(SCHEDULED_UNTIL_KEY) or now
+    until = window_end(now)
+    # moved first: the events saved from now on up to until schedule
+    # themselves, at worst twice
+    cache.set(SCHEDULED_UNTIL_KEY, until, None)
+    enqueue(list(unpublished(now).filter(
+        publish_at__gt=max(start, now), publish_at__lte=until)
+        .values_list('pk', 'publish_at')))
+    return published
@@ -12,21 +12,37 @@ class AppError(Exception):
 
 # PREDICATES
 
-def is_org_whatever_for_object(user, obj, org_member_class):
+# The organization roles of a user are read once, in a single query, and
+# memoized on the user object, which lives as long as the request: checking
+# a permission on many objects is then an in-memory lookup per object.
+
+def organization_roles(user):
+    """
+    Returns {organization id: set of roles} for user.
+    """
+    roles = getattr(user, '_organization_roles', None)
+    if roles is None:
+        roles = {}
+        if user.is_authenticated:
+            persons = OrganizationPerson.objects.filter(user=user.pk)
+            for org_id, role in persons.values_list('organization_id', 'role'):
+                roles.setdefault(org_id, set()).add(role)
+        user._organization_roles = roles
+    return roles
+
+
+def is_org_whatever_for_object(user, obj, role):
     try:
         if isinstance(obj, Organization):
-            org = obj
-        elif hasattr(obj, 'organization'):
-            org = obj.organization
+            org_id = obj.pk
+        elif hasattr(obj, 'organization_id'):
+            org_id = obj.organization_id
         else:
             raise AppError(
                 "object is neither an organization, nor has an organization "
                 "field",
                 obj)
-        if org_member_class.objects.filter(user=user).filter(
-                organization=org).exists():
-            return True
-        return False
+        return role in organization_roles(user).get(org_id, ())
 
     # TODO error handling
     except AppError as e:
@@ -36,24 +52,25 @@ def is_org_whatever_for_object(user, obj, org_member_class):
 
 @rules.predicate
 def is_org_admin_for_object(user, obj):
-    return is_org_whatever_for_object(user, obj, OrganizationAdministrator)
+    return is_org_whatever_for_object(user, obj, OrganizationPerson.ADMIN)
 
 
 @rules.predicate
 def is_org_volunteer_for_object(user, obj):
-    return is_org_whatever_for_object(user, obj, OrganizationVolunteer)
+    return is_org_whatever_for_object(user, obj, OrganizationPerson.VOLUNTEER)
 
 
 @rules.predicate
 def is_org_member_for_object(user, obj):
-    return is_org_whatever_for_object(user, obj, OrganizationMember)
+    return is_org_whatever_for_object(user, obj, OrganizationPerson.MEMBER)
 
 
 @rules.predicate
 def is_owner_for_object(user, obj):
     if not hasattr(obj, 'owner'):
         raise AppError("object doesn't have an 'owner' field", obj)
-    return obj.owner == user
+    # compare the ids, loading the owner would cost a query per object
+    return user.is_authenticated and obj.owner_id == user.pk
 
 
 # RULES
@@ -0,0 +1,103 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from actstream.models import Action
+from address.models import Address
+
+from .cache import bump_version, bump_versions
+from . import geo, publication
+from .models import (Activity, Event, Organization, OrganizationPerson,
+                     Place, PlaceType)
+
+
+# Invalidation of the versioned cache keys (see plateformeweb.cache) used by
+# the template context, the organization role index and the API validators,
+# and sync of the place coordinates.
+# Bulk inserts and queryset updates don't send these signals, the code doing
+# them bumps the versions itself.
+
+
+@receiver(m2m_changed, sender=Event.attendees.through)
+@receiver(m2m_changed, sender=Event.presents.through)
+@receiver(m2m_changed, sender=Event.organizers.through)
+def event_people_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # the seats left and the bookings are part of the event listings
+    if reverse:
+        # user.attendee_user.add(event) and the like
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_versions('events', ('user', instance.pk))
+    elif action in ('post_add', 'post_remove'):
+        bump_versions('events', *[('user', pk) for pk in pk_set])
+    elif action == 'pre_clear':
+        users = sender.objects.filter(event=instance).values_list(
+            'customuser_id', flat=True)
+        bump_versions('events', *[('user', pk) for pk in users])
+
+
+# no sender: OrganizationVolunteer is a subclass with its own table, saving
+# one only sends its own post_save
+@receiver(post_save)
+@receiver(post_delete)
+def organization_person_changed(sender, instance, **kwargs):
+    if not isinstance(instance, OrganizationPerson):
+        return
+    bump_versions('memberships', ('user', instance.user_id),
+                  ('organization', instance.organization_id))
+    # the instance cached on the person may be reused in this request
+    if OrganizationPerson.organization.is_cached(instance):
+        instance.organization.__dict__.pop('_roles', None)
+    if OrganizationPerson.user.is_cached(instance):
+        instance.user.__dict__.pop('_organization_roles', None)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, instance, **kwargs):
+    bump_version('events')
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, **kwargs):
+    # queues its publication at publish_at
+    if not instance.published:
+        publication.schedule([instance])
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def organization_changed(sender, instance, **kwargs):
+    bump_version('organizations')
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+@receiver(post_save, sender=PlaceType)
+@receiver(post_delete, sender=PlaceType)
+def place_changed(sender, instance, **kwargs):
+    bump_version('places')
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def activity_changed(sender, instance, **kwargs):
+    bump_version('activities')
+
+
+@receiver(post_save, sender=Action)
+@receiver(post_delete, sender=Action)
+def action_changed(sender, instance, **kwargs):
+    # the activity streams of the detail pages
+    bump_version('actions')
+
+
+@receiver(post_save, sender=Address)
+def address_changed(sender, instance, **kwargs):
+    # keeps the coordinates copied on the places in sync
+    if instance.latitude is None or instance.longitude is None:
+        coordinates = {'latitude': None, 'longitude': None, 'geohash': ''}
+    else:
+        coordinates = {'latitude': instance.latitude,
+                       'longitude': instance.longitude,
+                       'geohash': geo.encode(instance.latitude,
+                                             instance.longitude, geo.PRECISION)}
+    if Place.objects.filter(address=instance).update(**coordinates):
+        bump_version('places')
@@ -1,7 +1,6 @@
 from __future__ import absolute_import, unicode_literals
 
 from celery.schedules import crontab
-from django.core import management
 
 # from plateformeweb.tasks import publish_events
 import os
@@ -14,12 +13,123 @@ def test(param):
 
 @shared_task(name='tasks.send_queued_mail')
 def send_queued_mail():
-    management.call_command('send_queued_mail')
+    from plateformeweb import mailer
+    return mailer.send_queued()
+
+@shared_task(name='tasks.send_notification')
+def send_notification(content_type_id, object_id, target_type):
+    from django.conf import settings
+    from django.contrib.contenttypes.models import ContentType
+    from django.template.loader import render_to_string
+    from actstream.models import Follow
+    from post_office import mail
+
+    content_type = ContentType.objects.get_for_id(content_type_id)
+    target_object = content_type.get_object_for_this_type(pk=object_id)
+
+    if target_type == "actor":
+        notification = target_object.actor_actions.all()[:1]
+    elif target_type == "action_object":
+        notification = target_object.action_object_actions.all()[:1]
+    elif target_type == "target":
+        notification = target_object.target_actions.all()[:1]
+
+    # the same message goes to every follower, render it once
+    message = render_to_string('mail/notification.html',
+                               {'notification': notification})
+    subject = "nouvelle notification"
+
+    emails = list(Follow.objects.filter(
+        content_type=content_type, object_id=str(object_id)).values_list(
+        'user__email', flat=True))
+
+    # one bulk insert per chunk, the queued mails are then sent by
+    # tasks.send_queued_mail
+    size = settings.NOTIFICATION_CHUNK_SIZE
+    for start in range(0, len(emails), size):
+        mail.send_many([{
+            'recipients': [email],
+            'sender': 'no-reply@atelier-soude.fr',
+            'subject': subject,
+            'message': message,
+            'html_message': message,
+            'priority': 'medium',
+        } for email in emails[start:start + size]])
+
+def booking_mail(event, user, base_url):
+    """
+    Returns the post_office fields of the booking confirmation of user for
+    event, links made absolute with base_url.
+    """
+    from urllib.parse import urljoin
+    from django.template.loader import render_to_string
+    from django.urls import reverse
+    from plateformeweb import dates, tokens
+
+    cancel_token = tokens.cancel_token(event, user)
+    cancel_url = urljoin(base_url,
+                         reverse('cancel_reservation', args=[cancel_token]))
+    event_url = urljoin(base_url,
+                        reverse('event_detail', args=[event.pk, event.slug]))
+
+    params = {'cancel_url': cancel_url,
+              'event_url': event_url,
+              'event': event}
+
+    message = render_to_string('mail/relance.html', params)
+
+    date = dates.day_month(event.starts_at)
+    location = event.location.name
+    subject = "Votre réservation pour le " + date + " à " + location
+
+    return {'recipients': [user.email],
+            'sender': 'no-reply@atelier-soude.fr',
+            'subject': subject,
+            'message': message,
+            'html_message': message,
+            # queued, sent by tasks.send_queued_mail
+            'priority': 'medium'}
+
+@shared_task(name='tasks.send_booking_mail')
+def send_booking_mail(event_id, user_id, base_url):
+    from post_office import mail
+    from plateformeweb.models import Event
+    from users.models import CustomUser
+
+    event = Event.objects.select_related('location').get(pk=event_id)
+    user = CustomUser.objects.get(pk=user_id)
+
+    mail.send(**booking_mail(event, user, base_url))
+
+@shared_task(name='tasks.send_booking_mails')
+def send_booking_mails(event_ids, user_id, base_url):
+    from post_office import mail
+    from plateformeweb.models import Event
+    from users.models import CustomUser
+
+    # the confirmations of a mass booking, queued with a single insert
+    events = Event.objects.select_related('location').filter(pk__in=event_ids)
+    user = CustomUser.objects.get(pk=user_id)
+
+    mail.send_many([booking_mail(event, user, base_url)
+                    for event in events.order_by('starts_at')])
+
+@shared_task(name='tasks.publish_event')
+def publish_event(event_id):
+    from plateformeweb.models import Event
+    from plateformeweb.publication import publish
+    # no-op when the event was published, or postponed, in the meantime
+    return publish(Event.objects.filter(pk=event_id))
 
 @shared_task(name='tasks.publish_events')
 def publish_events():
-    from plateformeweb.models import Event
-    from django.utils import timezone
-    today = timezone.now()
-    unpublished_events = Event.objects.filter(publish_at__lte=today, starts_at__gte=today, published=False)
-    unpublished_events.update(published=True)
+    from plateformeweb.publication import sweep
+    return sweep()
+
+@shared_task(name='tasks.extend_event_series')
+def extend_event_series():
+    from plateformeweb.models import EventSeries
+    from plateformeweb.occurrences import materialize, series_horizon
+    horizon = series_horizon()
+    for series in EventSeries.objects.exclude(materialized_until__gte=horizon):
+        materialize(series, horizon)
@@ -1,13 +1,9 @@
 from django import template
-from itsdangerous import URLSafeSerializer, BadData
 
 register = template.Library()
 
-@register.filter(name="serialize_id")
-def serialize_id(user_id, event_id):
-    serial = URLSafeSerializer('some_secret_key',
-                                salt='presence')
-
-    data = {'user_id': user_id,
-            'event_id': event_id}
-    return serial.dumps(data)
+@register.filter(name="token_for")
+def token_for(presence_tokens, user_id):
+    # presence_tokens signed in one go by the view, see
+    # plateformeweb.tokens.presence_tokens, for its organizers only
+    return presence_tokens.get(user_id, '')
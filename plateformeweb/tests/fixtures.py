@@ -0,0 +1,32 @@
+from users.models import CustomUser
+from plateformeweb.models import Activity, Organization, Place, PlaceType
+
+
+class FixturesMixin():
+    """
+    Creates the superuser, organization, place type, activity and place most
+    tests start from. Comes before TestCase in the bases.
+    """
+    def setUp(self):
+        super().setUp()
+        self.admin = CustomUser.objects.create_superuser('sankara', 'password')
+        self.organization = Organization.objects.create(
+            name = 'Atelier Soudé',
+            slug = 'ateliersoude',
+            owner = self.admin,
+            active = True,
+            picture = 'foo.jpg')
+        self.placetype = PlaceType.objects.create(
+            name = 'repaircafe',
+            slug = 'repaircafe')
+        self.activity = Activity.objects.create(
+            name = 'cafe',
+            organization = self.organization,
+            picture = 'static/img/event-card.jpg')
+        self.place = Place.objects.create(
+            name = 'croixluizet',
+            type = self.placetype,
+            slug = 'croixluizet',
+            organization = self.organization,
+            address = '',
+            picture = 'foo.jpg')
@@ -0,0 +1,59 @@
+import threading
+from contextlib import contextmanager
+from django.test import override_settings
+from post_office.connections import connections
+
+try:
+    import asyncore
+    import smtpd
+except ImportError:  # removed from the standard library in Python 3.12
+    smtpd = None
+
+
+# Local SMTP stand-in for the mail benchmarks and tests: it accepts every
+# message and keeps it in memory.
+
+# seconds to wait for the server thread, which only stops once every client
+# connection is closed
+JOIN_TIMEOUT = 5
+
+
+if smtpd is not None:
+    class SinkSMTPServer(smtpd.SMTPServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.messages = []
+
+        def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+            self.messages += [(mailfrom, rcpttos, data)]
+
+
+def forget_post_office_connections():
+    # post_office keeps one connection per thread, built from the settings of
+    # its first use
+    connections.close()
+    connections._connections.connections = {}
+
+
+@contextmanager
+def local_smtp_server():
+    server = SinkSMTPServer(('127.0.0.1', 0), None)
+    port = server.socket.getsockname()[1]
+    thread = threading.Thread(target=asyncore.loop,
+                              kwargs={'timeout': 0.05}, daemon=True)
+    thread.start()
+    smtp_settings = override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1', EMAIL_PORT=port, EMAIL_HOST_USER='',
+        EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False)
+    try:
+        with smtp_settings:
+            forget_post_office_connections()
+            yield server
+    finally:
+        forget_post_office_connections()
+        server.close()
+        thread.join(JOIN_TIMEOUT)
+        if thread.is_alive():
+            asyncore.close_all()
+            raise AssertionError("An SMTP connection was left open")
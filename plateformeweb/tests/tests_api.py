@@ -0,0 +1,290 @@
+import datetime
+from unittest import mock
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from address.models import Address
+from users.models import CustomUser
+from plateformeweb.models import *
+from plateformeweb import geo
+
+from .fixtures import FixturesMixin
+
+
+class EventsTestCase(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user('lumumba', 'password')
+
+    def create_events(self, count):
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        events = []
+        for i in range(count):
+            event = Event.objects.create(
+                title = 'repairtoday',
+                organization = self.organization,
+                owner = self.admin,
+                type = self.activity,
+                location = self.place,
+                published = True,
+                available_seats = 10,
+                starts_at = starts_at + datetime.timedelta(days=i),
+                ends_at = starts_at + datetime.timedelta(days=i, hours=2))
+            events += [event]
+        return events
+
+
+class TestListEventsInContext(EventsTestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(queries), resp.json()
+
+    def test_query_count_does_not_grow_with_events(self):
+        self.client.login(username='lumumba', password='password')
+        url = reverse('list_events_in_context')
+
+        self.create_events(1)
+        few_queries, few = self.count_queries(url)
+
+        self.create_events(20)
+        many_queries, many = self.count_queries(url)
+
+        self.assertEqual(len(few['dates']), 1)
+        self.assertEqual(len(many['dates']), 21)
+        self.assertEqual(few_queries, many_queries)
+
+    def test_membership_flags(self):
+        attending, organizing, other = self.create_events(3)
+        attending.attendees.add(self.user)
+        organizing.organizers.add(self.user)
+        self.client.login(username='lumumba', password='password')
+
+        resp = self.client.get(reverse('list_events_in_context'))
+        dates = {event['pk']: event for event in resp.json()['dates']}
+
+        self.assertTrue(dates[attending.pk]['user_in_attendees'])
+        self.assertFalse(dates[attending.pk]['user_in_organizers'])
+        self.assertTrue(dates[organizing.pk]['user_in_organizers'])
+        self.assertFalse(dates[other.pk]['user_in_attendees'])
+        self.assertFalse(dates[other.pk]['user_in_presents'])
+
+    def test_anonymous_user_has_no_membership(self):
+        self.create_events(2)
+        resp = self.client.get(reverse('list_events_in_context'))
+        for event in resp.json()['dates']:
+            self.assertFalse(event['user_in_attendees'])
+
+    def test_user_context_lists_each_event_once(self):
+        event, = self.create_events(1)
+        event.attendees.add(self.user)
+        event.organizers.add(self.user)
+
+        resp = self.client.get(reverse('list_events_user',
+                                       args=[self.user.pk]))
+        self.assertEqual([e['pk'] for e in resp.json()['dates']], [event.pk])
+
+
+class TestListEventsPage(EventsTestCase):
+    def fetch_all(self, url, **params):
+        pks = []
+        params['limit'] = 3
+        while True:
+            resp = self.client.get(url, params)
+            self.assertEqual(resp.status_code, 200)
+            page = resp.json()
+            self.assertLessEqual(len(page['dates']), 3)
+            pks += [event['pk'] for event in page['dates']]
+            if page['next_cursor'] is None:
+                return pks
+            params['cursor'] = page['next_cursor']
+
+    def test_pages_cover_every_event_once_in_order(self):
+        events = self.create_events(8)
+        # same start time: the pk breaks the tie between pages
+        Event.objects.filter(pk__in=[e.pk for e in events[:4]]).update(
+            starts_at=events[0].starts_at)
+
+        pks = self.fetch_all(reverse('list_events_page'))
+        self.assertEqual(pks, [e.pk for e in events])
+
+    def test_filters(self):
+        events = self.create_events(4)
+        other_place = Place.objects.create(
+            name = 'guillotiere',
+            type = self.placetype,
+            organization = self.organization,
+            address = '',
+            picture = 'foo.jpg')
+        Event.objects.filter(pk=events[1].pk).update(location=other_place)
+
+        pks = self.fetch_all(reverse('list_events_page'), place=other_place.pk)
+        self.assertEqual(pks, [events[1].pk])
+
+        day = events[2].starts_at.date().isoformat()
+        pks = self.fetch_all(reverse('list_events_page'),
+                             start_date=day, end_date=day)
+        self.assertEqual(pks, [events[2].pk])
+
+    def test_invalid_cursor(self):
+        resp = self.client.get(reverse('list_events_page'),
+                               {'cursor': 'not-a-cursor'})
+        self.assertEqual(resp.json()['status'], -1)
+
+    def test_facets_cover_every_page(self):
+        events = self.create_events(5)
+        places = [Place.objects.create(
+            name = name,
+            type = self.placetype,
+            organization = self.organization,
+            address = '',
+            picture = 'foo.jpg') for name in ('guillotiere', 'belleville')]
+        # the last page only has the guillotiere, belleville is over
+        Event.objects.filter(pk=events[4].pk).update(location=places[0])
+        Event.objects.filter(pk=events[3].pk).update(
+            location=places[1],
+            starts_at=timezone.now() - datetime.timedelta(days=1))
+
+        first_page = self.client.get(reverse('list_events_page'),
+                                     {'limit': 3}).json()
+        self.assertNotIn(str(places[0].pk), first_page['places'])
+
+        with self.assertNumQueries(3):
+            facets = self.client.get(reverse('list_event_facets')).json()
+        self.assertEqual(sorted(facets['places']),
+                         sorted([str(self.place.pk), str(places[0].pk)]))
+        self.assertEqual(list(facets['organizations']),
+                         [str(self.organization.pk)])
+        self.assertEqual(list(facets['activities']), [str(self.activity.pk)])
+
+
+class TestPlacesApi(EventsTestCase):
+    # two places in Lyon, one in Paris
+    coordinates = [('croixrousse', 45.7745, 4.8320),
+                   ('guillotiere', 45.7540, 4.8430),
+                   ('belleville', 48.8720, 2.3770)]
+
+    def setUp(self):
+        super().setUp()
+        for name, latitude, longitude in self.coordinates:
+            Place.objects.create(
+                name = name,
+                type = self.placetype,
+                slug = name,
+                organization = self.organization,
+                address = Address.objects.create(raw=name, latitude=latitude,
+                                                 longitude=longitude),
+                picture = 'foo.jpg')
+
+    def test_coordinates_copied_from_the_address(self):
+        place = Place.objects.get(slug='belleville')
+        self.assertEqual((place.latitude, place.longitude), (48.8720, 2.3770))
+        self.assertEqual(place.geohash, geo.encode(48.8720, 2.3770,
+                                                   geo.PRECISION))
+
+        place.address.latitude = 48.8
+        place.address.save()
+        place.refresh_from_db()
+        self.assertEqual(place.latitude, 48.8)
+
+    def test_places_in_bbox(self):
+        resp = self.client.get(reverse('list_places_in_bbox'), {
+            'south': 45.7, 'west': 4.7, 'north': 45.8, 'east': 4.9,
+            'zoom': 14})
+        names = {place['name'] for place in resp.json()['places'].values()}
+        self.assertEqual(names, {'croixrousse', 'guillotiere'})
+
+    def test_clusters_at_low_zoom(self):
+        resp = self.client.get(reverse('list_places_in_bbox'), {
+            'south': 40, 'west': -5, 'north': 50, 'east': 10, 'zoom': 7})
+        counts = sorted(cluster['count'] for cluster in resp.json()['clusters'])
+        self.assertEqual(counts, [1, 2])
+
+    def test_places_around(self):
+        resp = self.client.get(reverse('list_places_around'), {
+            'latitude': 45.7640, 'longitude': 4.8357, 'radius': 5})
+        names = [place['name'] for place in resp.json()['places']]
+        self.assertEqual(sorted(names), ['croixrousse', 'guillotiere'])
+
+    def test_get_all_places_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('get_all_places'))
+        self.assertEqual(len(resp.json()['places']), 4)
+        self.assertEqual(len(queries), 1)
+
+    def test_invalid_box(self):
+        resp = self.client.get(reverse('list_places_in_bbox'), {'south': 'x'})
+        self.assertEqual(resp.json()['status'], -1)
+
+
+class TestGeohash(TestCase):
+    def test_encode_decode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        latitude, longitude = geo.decode('u4pruydqqvj')
+        self.assertAlmostEqual(latitude, 57.64911, places=4)
+        self.assertAlmostEqual(longitude, 10.40744, places=4)
+
+    def test_bounding_box_contains_the_circle(self):
+        south, west, north, east = geo.bounding_box(45.76, 4.84, 10)
+        self.assertLess(geo.distance(45.76, 4.84, north, 4.84), 10.01)
+        self.assertLess(geo.distance(45.76, 4.84, 45.76, east), 10.1)
+
+
+class TestConditionalGet(EventsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_events(3)
+
+    def test_not_modified_without_queries(self):
+        for url in (reverse('get_all_places'),
+                    reverse('list_events_in_context'),
+                    reverse('list_events_place', args=[self.place.pk]),
+                    reverse('list_events_page')):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.has_header('Last-Modified'))
+
+            with self.assertNumQueries(0):
+                resp = self.client.get(url,
+                                       HTTP_IF_NONE_MATCH=resp['ETag'])
+            self.assertEqual(resp.status_code, 304)
+
+    def test_changes_invalidate_the_etag(self):
+        url = reverse('list_events_in_context')
+        etag = self.client.get(url)['ETag']
+
+        self.place.name = 'gerland'
+        self.place.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+        etag = resp['ETag']
+        Event.objects.first().attendees.add(self.user)
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_started_events_invalidate_the_etag(self):
+        first = Event.objects.order_by('starts_at').first()
+        for url in (reverse('list_events_in_context'),
+                    reverse('list_events_page')):
+            etag = self.client.get(url)['ETag']
+
+            later = first.starts_at + datetime.timedelta(minutes=1)
+            with mock.patch('django.utils.timezone.now', lambda: later):
+                resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200)
+            pks = [event['pk'] for event in resp.json()['dates']]
+            self.assertEqual(len(pks), 2)
+            self.assertNotIn(first.pk, pks)
+
+    def test_etag_depends_on_the_user(self):
+        url = reverse('list_events_in_context')
+        etag = self.client.get(url)['ETag']
+
+        self.client.login(username='lumumba', password='password')
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,248 @@
+import datetime
+import locale
+import logging
+import os
+import time
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+from django.db import connection
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from itsdangerous import URLSafeSerializer
+
+from users.models import CustomUser
+from plateformeweb.models import *
+from plateformeweb import occurrences
+from post_office import mail
+from post_office.models import Email
+
+from .fixtures import FixturesMixin
+from .smtp import local_smtp_server, smtpd
+
+
+# Coarse benchmarks of the hot paths. The unit tests run them on a little
+# data and only assert on what doesn't depend on the machine (query counts,
+# row counts, identical output). With BENCHMARKS=1 in the environment they
+# run at full size and log their timings to plateformeweb.benchmarks.
+
+BENCHMARKS = bool(os.environ.get('BENCHMARKS'))
+
+logger = logging.getLogger('plateformeweb.benchmarks')
+
+
+timings_only = unittest.skipUnless(BENCHMARKS,
+                                   "only measures timings, set BENCHMARKS=1")
+
+
+class BenchmarkTestCase(FixturesMixin, TestCase):
+    @contextmanager
+    def benchmark(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            yield queries
+            elapsed = time.perf_counter() - start
+        if BENCHMARKS:
+            logger.info("%s: %.1f ms, %d queries", name, elapsed * 1000,
+                        len(queries))
+
+    def percentile(self, timings, rank):
+        timings = sorted(timings)
+        return timings[min(len(timings) - 1, int(len(timings) * rank / 100))]
+
+
+class TestEventSeriesBenchmark(BenchmarkTestCase):
+    occurrences = 500 if BENCHMARKS else 20
+
+    def test_create_occurrences(self):
+        first = timezone.now() + datetime.timedelta(days=1)
+        dates = [(first + datetime.timedelta(weeks=week),
+                  first + datetime.timedelta(weeks=week, hours=3),
+                  first + datetime.timedelta(weeks=week, days=-7))
+                 for week in range(self.occurrences)]
+
+        with self.benchmark("%d occurrences" % self.occurrences) as queries:
+            events = occurrences.create_occurrences(
+                self.admin, dates, 'cafe-ateliersoude-croixluizet',
+                title=self.activity.name,
+                organization=self.organization,
+                available_seats=10,
+                location=self.place,
+                type=self.activity)
+
+        self.assertEqual(Event.objects.count(), self.occurrences)
+        self.assertEqual(len({event.slug for event in events}),
+                         self.occurrences)
+        self.assertEqual(
+            Event.organizers.through.objects.filter(
+                customuser=self.admin).count(),
+            self.occurrences)
+        # bulk inserts only: SQLite splits them in batches of ~80 rows
+        self.assertLess(len(queries), 50)
+
+    def test_reserve_slugs_skips_taken_ones(self):
+        Event.objects.create(title='cafe', slug='cafe',
+                             organization=self.organization,
+                             type=self.activity, location=self.place)
+        Event.objects.create(title='cafe', slug='cafe-3',
+                             organization=self.organization,
+                             type=self.activity, location=self.place)
+
+        self.assertEqual(occurrences.reserve_slugs('cafe', 3),
+                         ['cafe-2', 'cafe-4', 'cafe-5'])
+
+
+def inline_booking_mail(request, user, event):
+    # api.views.send_booking_mail before tasks.send_booking_mail: rendered
+    # twice and sent over SMTP, post_office's DEFAULT_PRIORITY being 'now'
+    serial = URLSafeSerializer('some_secret_key', salt='cancel_reservation')
+    cancel_token = serial.dumps({'event_id': event.id, 'user_id': user.id})
+    cancel_url = request.build_absolute_uri(
+        reverse('cancel_reservation', args=[cancel_token]))
+    event_url = request.build_absolute_uri(
+        reverse('event_detail', args=[event.id, event.slug]))
+    params = {'cancel_url': cancel_url,
+              'event_url': event_url,
+              'event': event}
+    msg_plain = render_to_string('mail/relance.html', params)
+    msg_html = render_to_string('mail/relance.html', params)
+    subject = "Votre réservation pour le %s à %s" % (
+        event.starts_at.date().strftime("%d %B"), event.location.name)
+    mail.send([user.email], 'no-reply@atelier-soude.fr', subject=subject,
+              message=msg_plain, html_message=msg_html)
+
+
+@timings_only
+@unittest.skipIf(smtpd is None, "no local SMTP stand-in on this Python")
+class TestBookingLatencyBenchmark(BenchmarkTestCase):
+    bookings = 200
+
+    def setUp(self):
+        super().setUp()
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        self.event = Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            published = True,
+            available_seats = 2 * self.bookings,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+
+    def book(self, user):
+        self.client.force_login(user)
+        start = time.perf_counter()
+        response = self.client.post(
+            '/api/book/', 'event_id=%d' % self.event.pk,
+            content_type='application/x-www-form-urlencoded')
+        return response, start
+
+    def test_booking_p95(self):
+        # logged in with force_login, no password to hash
+        CustomUser.objects.bulk_create([
+            CustomUser(email='user%d@example.com' % i)
+            for i in range(2 * self.bookings)])
+        users = list(CustomUser.objects.filter(
+            email__startswith='user').order_by('pk'))
+
+        with local_smtp_server() as server:
+            # before: the confirmation was rendered and sent in the request
+            inline = []
+            with mock.patch('api.views.send_booking_mail', inline_booking_mail):
+                for user in users[:self.bookings]:
+                    response, start = self.book(user)
+                    inline += [time.perf_counter() - start]
+                    self.assertEqual(response.json()['status'], 'unbook')
+            self.assertEqual(len(server.messages), self.bookings)
+
+            # after: the request only enqueues the task once committed, which
+            # a TestCase never does
+            queued = []
+            emails = Email.objects.count()
+            for user in users[self.bookings:]:
+                response, start = self.book(user)
+                queued += [time.perf_counter() - start]
+                self.assertEqual(response.json()['status'], 'unbook')
+            self.assertEqual(Email.objects.count(), emails)
+            self.assertEqual(len(server.messages), self.bookings)
+
+        logger.info("booking p95: %.1f ms with inline mail, %.1f ms queued",
+                    self.percentile(inline, 95) * 1000,
+                    self.percentile(queued, 95) * 1000)
+
+
+class TestDescriptionRenderBenchmark(BenchmarkTestCase):
+    activities = 500 if BENCHMARKS else 10
+    description = ("## Réparer son vélo\n\n"
+                   "Venez avec votre *vélo* et vos **outils** : nous vous "
+                   "aidons à le [réparer](https://atelier-soude.fr).\n\n"
+                   "- chambres à air\n- freins\n- dérailleurs\n")
+
+    def test_render_activity_list(self):
+        activities = []
+        for i in range(self.activities):
+            activity = Activity(name='cafe %d' % i,
+                                organization=self.organization,
+                                description=self.description,
+                                picture='static/img/event-card.jpg')
+            activity.render_description()
+            activities += [activity]
+        Activity.objects.bulk_create(activities)
+        activities = list(Activity.objects.exclude(pk=self.activity.pk))
+
+        on_render = Template("{% load django_markdown %}"
+                             "{% for activity in activities %}"
+                             "{{ activity.description|markdown }}"
+                             "{% endfor %}")
+        stored = Template("{% for activity in activities %}"
+                          "{{ activity.description_html|safe }}"
+                          "{% endfor %}")
+        context = Context({'activities': activities})
+
+        with self.benchmark("%d descriptions converted on render" %
+                            self.activities):
+            converted = on_render.render(context)
+        with self.benchmark("%d stored descriptions" % self.activities):
+            html = stored.render(context)
+        self.assertEqual(html, converted)
+
+
+class TestDateFormatBenchmark(BenchmarkTestCase):
+    events = 10000 if BENCHMARKS else 100
+
+    def test_date_interval_format(self):
+        start = datetime.datetime(2018, 1, 1, 20, 1, 12,
+                                  tzinfo=datetime.timezone.utc)
+        events = [Event(title='repairtoday',
+                        starts_at=start + datetime.timedelta(days=i, hours=i),
+                        ends_at=start + datetime.timedelta(days=i, hours=i + 2))
+                  for i in range(self.events)]
+
+        with self.benchmark("%d dates formatted" % self.events):
+            formatted = [event.date_interval_format() for event in events]
+
+        previous = locale.setlocale(locale.LC_ALL)
+        try:
+            locale.setlocale(locale.LC_ALL, 'fr_FR.UTF-8')
+        except locale.Error:
+            return
+        try:
+            # before: the locale was switched for every date
+            with self.benchmark("%d dates formatted with setlocale" %
+                                self.events):
+                with_locale = []
+                for event in events:
+                    locale.setlocale(locale.LC_ALL, 'fr_FR.UTF-8')
+                    with_locale += ['%s de %s à %s' % (
+                        event.starts_at.strftime("%A %d %B %Y"),
+                        event.starts_at.strftime("%X"),
+                        event.ends_at.strftime("%X"))]
+        finally:
+            locale.setlocale(locale.LC_ALL, previous)
+        self.assertEqual(formatted, with_locale)
@@ -0,0 +1,275 @@
+import datetime
+import threading
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from users.models import CustomUser
+from plateformeweb.models import *
+from plateformeweb import booking
+
+from .fixtures import FixturesMixin
+
+
+class BookingTestMixin(FixturesMixin):
+    seats = 3
+
+    def setUp(self):
+        super().setUp()
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        self.event = Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            published = True,
+            available_seats = self.seats,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+
+    def create_users(self, count):
+        return [CustomUser.objects.create_user('user%d@example.com' % i,
+                                               'password')
+                for i in range(count)]
+
+
+class TestBookingService(BookingTestMixin, TestCase):
+    def test_book_and_cancel(self):
+        user, = self.create_users(1)
+
+        self.assertTrue(booking.book_seat(self.event, user))
+        self.assertEqual(self.event.available_seats, self.seats - 1)
+        self.assertFalse(booking.book_seat(self.event, user))
+
+        self.assertTrue(booking.cancel_seat(self.event, user))
+        self.assertFalse(booking.cancel_seat(self.event, user))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, self.seats)
+
+    def test_full_event(self):
+        users = self.create_users(self.seats + 1)
+        for user in users[:-1]:
+            booking.book_seat(self.event, user)
+
+        with self.assertRaises(booking.EventFull):
+            booking.book_seat(self.event, users[-1])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 0)
+        self.assertEqual(self.event.attendees.count(), self.seats)
+
+    def test_volunteers_take_no_seat(self):
+        volunteer, = self.create_users(1)
+        OrganizationPerson.objects.create(user=volunteer,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.VOLUNTEER)
+
+        self.assertFalse(booking.takes_seat(self.event, volunteer))
+        booking.book_seat(self.event, volunteer)
+        self.assertEqual(self.event.available_seats, self.seats)
+
+        # nor give one back
+        self.assertTrue(booking.cancel_seat(self.event, volunteer))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, self.seats)
+
+    def test_seat_given_back_as_booked(self):
+        # the role changes between the booking and its cancellation
+        attendee, volunteer = self.create_users(2)
+        person = OrganizationPerson.objects.create(
+            user=volunteer, organization=self.organization,
+            role=OrganizationPerson.VOLUNTEER)
+        booking.book_seat(self.event, attendee)
+        booking.book_seat(self.event, volunteer)
+        OrganizationPerson.objects.create(user=attendee,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.VOLUNTEER)
+        person.delete()
+
+        booking.cancel_seat(self.event, attendee)
+        self.assertEqual(self.event.available_seats, self.seats)
+        booking.cancel_seat(self.event, volunteer)
+        self.assertEqual(self.event.available_seats, self.seats)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, self.seats)
+        self.assertFalse(self.event.seat_holders.exists())
+
+    def test_enrolled_volunteers_take_no_seat(self):
+        volunteer, attendee = self.create_users(2)
+        OrganizationPerson.objects.create(user=volunteer,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.VOLUNTEER)
+
+        booked, _ = booking.enrol_users(self.event, [volunteer, attendee])
+        self.assertEqual(booked, [volunteer, attendee])
+        self.assertEqual(self.event.available_seats, self.seats - 1)
+
+        booking.cancel_seat(self.event, volunteer)
+        booking.cancel_seat(self.event, attendee)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, self.seats)
+
+    def test_enrol_users(self):
+        organizer, attendee, *newcomers = self.create_users(self.seats + 3)
+        self.event.organizers.add(organizer)
+        booking.book_seat(self.event, attendee)
+        users = CustomUser.objects.filter(
+            pk__in=[u.pk for u in [organizer, attendee] + newcomers])
+
+        booked, marked_present = booking.enrol_users(self.event, users)
+
+        self.assertEqual(len(booked), self.seats - 1)
+        self.assertEqual({u.pk for u in marked_present},
+                         {organizer.pk, attendee.pk})
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 0)
+        # the attendee marked present keeps their seat
+        self.assertEqual(self.event.attendees.count(), self.seats - 1)
+        self.assertEqual(self.event.presents.count(), 2)
+        self.assertFalse(self.event.attendees.filter(pk=attendee.pk).exists())
+
+    def test_enrol_users_after_start(self):
+        users = self.create_users(2)
+        Event.objects.filter(pk=self.event.pk).update(
+            starts_at=timezone.now() - datetime.timedelta(hours=1))
+        booked, marked_present = booking.enrol_users(self.event, users)
+
+        self.assertEqual(booked, [])
+        self.assertEqual(self.event.presents.count(), 2)
+        self.assertEqual(self.event.available_seats, self.seats)
+
+    def test_enrol_users_query_count(self):
+        Event.objects.filter(pk=self.event.pk).update(available_seats=50)
+        first, *others = self.create_users(40)
+
+        with CaptureQueriesContext(connection) as one_user:
+            booking.enrol_users(self.event, [first])
+        with CaptureQueriesContext(connection) as many_users:
+            booking.enrol_users(self.event, others)
+        self.assertEqual(len(one_user), len(many_users))
+
+    def create_events(self, count, seats):
+        events = []
+        for i in range(count):
+            event = Event.objects.create(
+                title = 'repairtoday',
+                organization = self.organization,
+                owner = self.admin,
+                type = self.activity,
+                location = self.place,
+                published = True,
+                available_seats = seats,
+                starts_at = self.event.starts_at,
+                ends_at = self.event.ends_at)
+            events += [event]
+        return events
+
+    def test_book_seats(self):
+        user, = self.create_users(1)
+        full, = self.create_events(1, 0)
+        booking.book_seat(self.event, user)
+        free, other = self.create_events(2, 1)
+
+        results = booking.book_seats(
+            [self.event.pk, full.pk, free.pk, other.pk, 0], user)
+
+        self.assertEqual(results, {
+            self.event.pk: booking.ALREADY_BOOKED,
+            full.pk: booking.FULL,
+            free.pk: booking.BOOKED,
+            other.pk: booking.BOOKED,
+            0: booking.NOT_FOUND,
+        })
+        self.assertEqual(set(Event.objects.filter(attendees=user).values_list(
+            'pk', flat=True)), {self.event.pk, free.pk, other.pk})
+        free.refresh_from_db()
+        self.assertEqual(free.available_seats, 0)
+        self.assertEqual(set(Event.objects.filter(seat_holders=user)
+                             .values_list('pk', flat=True)),
+                         {self.event.pk, free.pk, other.pk})
+
+    def test_book_seats_volunteer(self):
+        volunteer, = self.create_users(1)
+        OrganizationPerson.objects.create(user=volunteer,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.VOLUNTEER)
+        full, = self.create_events(1, 0)
+
+        results = booking.book_seats([full.pk], volunteer)
+
+        self.assertEqual(results, {full.pk: booking.BOOKED})
+        full.refresh_from_db()
+        self.assertEqual(full.available_seats, 0)
+
+    def test_book_seats_query_count(self):
+        first, second = self.create_users(2)
+        events = self.create_events(20, 5)
+
+        with CaptureQueriesContext(connection) as one_event:
+            booking.book_seats([events[0].pk], first)
+        with CaptureQueriesContext(connection) as many_events:
+            booking.book_seats([event.pk for event in events], second)
+        self.assertEqual(len(one_event), len(many_events))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class TestConcurrentBooking(BookingTestMixin, TransactionTestCase):
+    threads = 20
+
+    def test_no_overbooking(self):
+        users = self.create_users(self.threads)
+        barrier = threading.Barrier(self.threads)
+        booked = []
+        full = []
+
+        def book(user):
+            try:
+                event = Event.objects.get(pk=self.event.pk)
+                barrier.wait()
+                try:
+                    booking.book_seat(event, user)
+                    booked.append(user.pk)
+                except booking.EventFull:
+                    full.append(user.pk)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=book, args=(user,))
+                   for user in users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.event.refresh_from_db()
+        self.assertEqual(len(booked), self.seats)
+        self.assertEqual(len(full), self.threads - self.seats)
+        self.assertEqual(self.event.available_seats, 0)
+        self.assertEqual(sorted(self.event.attendees.values_list('pk', flat=True)),
+                         sorted(booked))
+
+    def test_no_lost_decrement(self):
+        self.event.available_seats = self.threads
+        self.event.save()
+        users = self.create_users(self.threads)
+        barrier = threading.Barrier(self.threads)
+
+        def book(user):
+            try:
+                event = Event.objects.get(pk=self.event.pk)
+                barrier.wait()
+                booking.book_seat(event, user)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=book, args=(user,))
+                   for user in users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 0)
+        self.assertEqual(self.event.attendees.count(), self.threads)
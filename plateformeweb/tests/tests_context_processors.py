@@ -0,0 +1,75 @@
+import datetime
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+from django.utils import timezone
+
+from users.models import CustomUser
+from plateformeweb.models import *
+from plateformeweb.context_processors import site_context
+
+from .fixtures import FixturesMixin
+
+
+class TestSiteContext(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        self.event = Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            published = True,
+            publish_at = timezone.now() - datetime.timedelta(days=1),
+            available_seats = 3,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+        self.user = CustomUser.objects.create_user('user@example.com',
+                                                   'password')
+
+    def context(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return site_context(request)
+
+    def test_unused_values_cost_nothing(self):
+        with self.assertNumQueries(0):
+            self.context(self.user)
+
+    def test_user_events_in_one_query(self):
+        self.event.attendees.add(self.user)
+        context = self.context(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(context['my_events_attending']),
+                             [self.event])
+            self.assertEqual(list(context['my_last_event_attending']),
+                             [self.event])
+            self.assertEqual(list(context['my_events_organizing']), [])
+
+    def test_cached_per_user(self):
+        self.assertFalse(self.context(self.user)['admin_of_organizations'])
+        with self.assertNumQueries(0):
+            self.assertFalse(
+                self.context(self.user)['admin_of_organizations'])
+
+    def test_invalidated_by_memberships(self):
+        self.assertFalse(self.context(self.user)['admin_of_organizations'])
+        OrganizationPerson.objects.create(user=self.user,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.ADMIN)
+        self.assertTrue(self.context(self.user)['admin_of_organizations'])
+        self.assertEqual(
+            list(self.context(self.user)['administered_organizations']),
+            [self.organization])
+
+    def test_invalidated_by_bookings(self):
+        self.assertEqual(list(self.context(self.user)['my_events_attending']),
+                         [])
+        self.event.attendees.add(self.user)
+        self.assertEqual(list(self.context(self.user)['my_events_attending']),
+                         [self.event])
+        self.event.attendees.clear()
+        self.assertEqual(list(self.context(self.user)['my_events_attending']),
+                         [])
@@ -0,0 +1,56 @@
+import unittest
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from post_office import mail
+from post_office.connections import connections
+from post_office.models import Email, STATUS
+
+from plateformeweb import mailer
+
+from .smtp import local_smtp_server, smtpd
+
+
+@unittest.skipIf(smtpd is None, "no local SMTP stand-in on this Python")
+class TestSendQueued(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def queue(self, *recipients):
+        for recipient in recipients:
+            mail.send([recipient], 'no-reply@atelier-soude.fr',
+                      subject='hello', message='hello', priority='medium')
+
+    def test_batches_over_one_connection(self):
+        self.queue(*['user%d@example.com' % i for i in range(5)])
+
+        with local_smtp_server() as server:
+            totals = mailer.send_queued(batch_size=2)
+            # the connection post_office opened to build the messages too
+            self.assertEqual([c for c in connections.all()
+                              if c.connection is not None], [])
+
+        self.assertEqual(totals, {'sent': 5, 'failed': 0, 'deferred': 0})
+        self.assertEqual(len(server.messages), 5)
+        self.assertFalse(Email.objects.exclude(status=STATUS.sent).exists())
+        self.assertEqual(mailer.throughput()['sent'], 5)
+
+    def test_sent_mails_are_not_claimed_again(self):
+        self.queue('user@example.com')
+
+        with local_smtp_server() as server:
+            mailer.send_queued()
+            mailer.send_queued()
+
+        self.assertEqual(len(server.messages), 1)
+
+    @override_settings(MAILER_RATE_LIMITS={'example.com': 2})
+    def test_rate_limited_domain(self):
+        self.queue(*['user%d@example.com' % i for i in range(4)])
+        self.queue('user@example.org')
+
+        with local_smtp_server() as server:
+            totals = mailer.send_queued(batch_size=2)
+
+        self.assertEqual(totals, {'sent': 3, 'failed': 0, 'deferred': 2})
+        self.assertEqual(len(server.messages), 3)
+        self.assertEqual(Email.objects.filter(status=STATUS.queued).count(), 2)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from users.models import CustomUser
+from plateformeweb.models import *
+from plateformeweb import middleware
+
+from .fixtures import FixturesMixin
+
+
+@override_settings(QUERY_STATS_FLUSH_SECONDS=0)
+class TestRequestStatsMiddleware(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        middleware.RequestStatsMiddleware.reset()
+        super().setUp()
+
+    def test_stats_by_url_name(self):
+        self.client.get(reverse('organization_list'))
+        # served from the anonymous page cache
+        self.client.get(reverse('organization_list'))
+
+        stats = middleware.collected()['organization_list']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertEqual(stats['max_queries'], stats['queries'])
+        self.assertGreater(stats['template_us'], 0)
+        self.assertGreater(stats['cache_hits'], 0)
+        self.assertEqual(stats['over_budget'], 0)
+
+    @override_settings(QUERY_BUDGETS={'organization_list': 0})
+    def test_over_budget(self):
+        with self.assertLogs('plateformeweb.middleware', 'WARNING'):
+            self.client.get(reverse('organization_list'))
+
+        stats = middleware.collected()['organization_list']
+        self.assertEqual(stats['over_budget'], 1)
+
+    def test_clear(self):
+        self.client.get(reverse('organization_list'))
+        middleware.clear()
+
+        self.assertEqual(middleware.collected(), {})
+
+
+class TestProfilingMiddleware(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        middleware.ProfilingMiddleware.slow.clear()
+        self.admin = CustomUser.objects.create_superuser('sankara', 'password')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def traces(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_sampled(self):
+        with self.settings(PROFILING_SAMPLE_RATE=1,
+                           PROFILING_DIR=self.directory):
+            self.client.get(reverse('organization_list'))
+            self.client.login(username='sankara', password='password')
+            self.client.get(reverse('organization_list'))
+
+        traces = self.traces()
+        self.assertEqual(len(traces), 2)
+        self.assertTrue(traces[0].startswith('organization_list.anonymous.'))
+        self.assertTrue(traces[1].startswith('organization_list.superuser.'))
+
+    def test_slow_view_profiled_next_time(self):
+        with self.settings(PROFILING_SAMPLE_RATE=0, PROFILING_SLOW_MS=0,
+                           PROFILING_DIR=self.directory):
+            self.client.get(reverse('organization_list'))
+            self.assertEqual(self.traces(), [])
+            self.client.get(reverse('organization_list'))
+
+        self.assertEqual(len(self.traces()), 1)
+
+    def test_unwritable_directory(self):
+        # below a file, whatever the permissions of the test runner
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+
+        with self.settings(PROFILING_SAMPLE_RATE=1,
+                           PROFILING_DIR=os.path.join(path, 'profiles')):
+            with self.assertLogs('plateformeweb.middleware', 'ERROR'):
+                resp = self.client.get(reverse('organization_list'))
+        self.assertEqual(resp.status_code, 200)
@@ -1,4 +1,7 @@
 import datetime
+import threading
+import unittest
+from django.core.cache import cache
 from django.test import TestCase
 from users.models import CustomUser
 from plateformeweb.models import *
@@ -45,3 +48,175 @@ class TestOrganizationPersonModel(TestCase):
 
     def test_visitor_role_by_default(self):
         self.assertEqual(self.org_person.role, 0)
+
+
+class TestOrganizationRoles(TestCase):
+    "roles come from one query, then from the cache until memberships change"
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_superuser('sankara', 'password')
+        self.org = Organization.objects.create(name="Atelier Soudé", slug="ateliersoude", owner=self.user, active=True)
+        self.volunteers = [CustomUser.objects.create_user('user%d@example.com' % i, 'password') for i in range(5)]
+        for user in self.volunteers:
+            OrganizationPerson.objects.create(user=user, organization=self.org, role=OrganizationPerson.VOLUNTEER)
+        OrganizationPerson.objects.create(user=self.user, organization=self.org, role=OrganizationPerson.ADMIN)
+
+    def test_one_query_for_every_role(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.org.admins(), [self.user])
+            self.assertEqual(self.org.volunteers(), self.volunteers)
+            self.assertEqual(self.org.members(), [])
+            self.assertEqual(self.org.visitors(), [])
+
+    def test_shared_cache(self):
+        self.org.admins()
+        org = Organization.objects.get(pk=self.org.pk)
+        # the users only
+        with self.assertNumQueries(1):
+            self.assertEqual(org.volunteers(), self.volunteers)
+            self.assertEqual(org.admins(), [self.user])
+
+    def test_users_never_stale(self):
+        self.org.admins()
+        self.volunteers[0].first_name = 'Thomas'
+        self.volunteers[0].save()
+        org = Organization.objects.get(pk=self.org.pk)
+        self.assertEqual(org.volunteers()[0].first_name, 'Thomas')
+
+    def test_invalidated_by_memberships(self):
+        self.assertEqual(self.org.members(), [])
+        person = OrganizationPerson.objects.create(user=self.volunteers[0], organization=self.org, role=OrganizationPerson.MEMBER)
+        org = Organization.objects.get(pk=self.org.pk)
+        self.assertEqual(org.members(), [self.volunteers[0]])
+        person.delete()
+        org = Organization.objects.get(pk=self.org.pk)
+        self.assertEqual(org.members(), [])
+
+
+class TestRenderedDescription(TestCase):
+    "description_html is converted on save, only when description changed"
+    def setUp(self):
+        self.user = CustomUser.objects.create_superuser('sankara', 'password')
+        self.org = Organization.objects.create(name="Atelier Soudé", slug="ateliersoude", owner=self.user, active=True, description="*soudure*")
+
+    def test_rendered_on_change_only(self):
+        self.assertIn("<em>soudure</em>", self.org.description_html)
+
+        Organization.objects.filter(pk=self.org.pk).update(description_html="stale")
+        org = Organization.objects.get(pk=self.org.pk)
+        org.name = "Atelier"
+        org.save()
+        org.refresh_from_db()
+        self.assertEqual(org.description_html, "stale")
+
+        org = Organization.objects.get(pk=self.org.pk)
+        org.description = "**brasure**"
+        org.save(update_fields=['description'])
+        org.refresh_from_db()
+        self.assertIn("<strong>brasure</strong>", org.description_html)
+
+
+class TestEventSeriesModel(TestCase):
+    "series only materialize their events up to the requested horizon"
+    def setUp(self):
+        from django.utils import timezone
+        self.user = CustomUser.objects.create_superuser('sankara', 'password')
+        self.org = Organization.objects.create(name="Atelier Soudé", slug="ateliersoude", owner=self.user, active=True)
+        placetype = PlaceType.objects.create(name="repaircafe", slug="repaircafe")
+        self.place = Place.objects.create(name="croixluizet", type=placetype, slug="croixluizet", organization=self.org, address="", picture="foo.jpg")
+        self.activity = Activity.objects.create(name="cafe", organization=self.org, picture="foo.jpg")
+        self.now = timezone.now()
+        self.today = datetime.datetime.combine(timezone.localdate(), datetime.time())
+
+    def create_series(self, rule):
+        return EventSeries.objects.create(
+            organization=self.org, owner=self.user, type=self.activity,
+            location=self.place, available_seats=10, rule=rule,
+            starts_after=datetime.timedelta(hours=14),
+            ends_after=datetime.timedelta(hours=18))
+
+    def rrule_date(self, days):
+        return (self.today + datetime.timedelta(days=days)).strftime("%Y%m%dT%H%M%SZ")
+
+    def test_rolling_materialization(self):
+        from plateformeweb.occurrences import materialize
+        series = self.create_series("DTSTART:%s\nRRULE:FREQ=WEEKLY;COUNT=52" % self.rrule_date(0))
+
+        materialize(series, self.now + datetime.timedelta(days=30))
+        self.assertEqual(series.events.count(), 5)
+
+        materialize(series, self.now + datetime.timedelta(days=30))
+        self.assertEqual(series.events.count(), 5)
+
+        materialize(series, self.now + datetime.timedelta(days=60))
+        self.assertEqual(series.events.count(), 9)
+        first = series.events.order_by('starts_at').first()
+        self.assertEqual(first.starts_at.date(), self.today.date())
+        self.assertEqual(first.starts_at.hour, 14)
+        self.assertEqual(first.publish_at, first.starts_at - datetime.timedelta(days=7))
+
+    def test_excluded_dates(self):
+        from plateformeweb.occurrences import materialize
+        series = self.create_series("DTSTART:%s\nRRULE:FREQ=WEEKLY;COUNT=52\nEXDATE:%s" % (
+            self.rrule_date(0), self.rrule_date(7)))
+
+        materialize(series, self.now + datetime.timedelta(days=30))
+        self.assertEqual(series.events.count(), 4)
+
+    def test_without_location(self):
+        from plateformeweb.occurrences import materialize
+        series = self.create_series("DTSTART:%s\nRRULE:FREQ=WEEKLY;COUNT=52" % self.rrule_date(0))
+        series.location = None
+        series.save()
+
+        materialize(series, self.now + datetime.timedelta(days=30))
+        self.assertEqual(series.events.filter(location=None).count(), 5)
+
+
+class TestEventDates(TestCase):
+    "event dates are formatted in French whatever the locale and the thread"
+    def setUp(self):
+        self.event = Event(
+            title = 'repairtoday',
+            starts_at = datetime.datetime(2018, 1, 1, 20, 1, 12,
+                                          tzinfo=datetime.timezone.utc),
+            ends_at = datetime.datetime(2018, 1, 1, 22, 1, 12,
+                                        tzinfo=datetime.timezone.utc))
+
+    def test_formats(self):
+        self.assertEqual(self.event.date_interval_format(),
+                         'lundi 01 janvier 2018 de 20:01:12 à 22:01:12')
+        self.assertEqual(str(self.event), 'repairtoday lundi 01 janvier 2018')
+
+    def format_concurrently(self, spawn, join):
+        events = [Event(title='repairtoday',
+                        starts_at=self.event.starts_at + datetime.timedelta(days=i),
+                        ends_at=self.event.ends_at + datetime.timedelta(days=i))
+                  for i in range(50)]
+        expected = [event.date_interval_format() for event in events]
+        results = []
+
+        def work():
+            results.append([event.date_interval_format() for event in events])
+
+        join([spawn(work) for i in range(20)])
+        self.assertEqual(results, [expected] * 20)
+
+    def test_threads(self):
+        def spawn(work):
+            thread = threading.Thread(target=work)
+            thread.start()
+            return thread
+
+        def join(threads):
+            for thread in threads:
+                thread.join()
+
+        self.format_concurrently(spawn, join)
+
+    def test_greenlets(self):
+        try:
+            import gevent
+        except ImportError:
+            raise unittest.SkipTest("gevent isn't installed")
+        self.format_concurrently(gevent.spawn, gevent.joinall)
@@ -0,0 +1,80 @@
+import datetime
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from users.models import CustomUser
+from plateformeweb.models import *
+
+from .fixtures import FixturesMixin
+
+
+class TestPermissions(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_organization = Organization.objects.create(
+            name = 'Autre atelier',
+            slug = 'autreatelier',
+            owner = self.admin,
+            active = True)
+        self.org_admin = CustomUser.objects.create_user('admin@example.com',
+                                                        'password')
+        OrganizationPerson.objects.create(user=self.org_admin,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.ADMIN)
+
+    def create_events(self, count, organization):
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        return [Event.objects.create(
+            title = 'repairtoday',
+            organization = organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+            for i in range(count)]
+
+    def fetch(self, user):
+        # a fresh user, as in a new request
+        return CustomUser.objects.get(pk=user.pk)
+
+    def test_admin_rights(self):
+        admin = self.fetch(self.org_admin)
+        own, = self.create_events(1, self.organization)
+        other, = self.create_events(1, self.other_organization)
+
+        self.assertTrue(admin.has_perm('plateformeweb.edit_event', own))
+        self.assertTrue(admin.has_perm('plateformeweb.delete_event', own))
+        self.assertFalse(admin.has_perm('plateformeweb.edit_event', other))
+
+    def test_owner_rights(self):
+        user = CustomUser.objects.create_user('user@example.com', 'password')
+        event, = self.create_events(1, self.other_organization)
+        event.owner = user
+        event.save()
+        user = self.fetch(user)
+
+        self.assertTrue(user.has_perm('plateformeweb.edit_event', event))
+        self.assertFalse(user.has_perm('plateformeweb.delete_event', event))
+
+    def test_queries_independent_of_object_count(self):
+        few = self.create_events(2, self.organization)
+        many = (self.create_events(10, self.organization) +
+                self.create_events(20, self.other_organization))
+
+        def check(user, events):
+            return [(user.has_perm('plateformeweb.edit_event', event),
+                     user.has_perm('plateformeweb.delete_event', event))
+                    for event in events]
+
+        with CaptureQueriesContext(connection) as few_queries:
+            check(self.fetch(self.org_admin), few)
+        with CaptureQueriesContext(connection) as many_queries:
+            perms = check(self.fetch(self.org_admin), many)
+
+        self.assertEqual(len(few_queries), len(many_queries))
+        admin_of = [event.organization_id == self.organization.pk
+                    for event in many]
+        self.assertEqual(perms, [(admin, admin) for admin in admin_of])
@@ -0,0 +1,158 @@
+import datetime
+import json
+from unittest import mock
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from actstream import action
+from actstream.actions import follow
+from post_office.models import Email, STATUS
+
+from users.models import CustomUser
+from plateformeweb.models import *
+from plateformeweb import publication, tasks
+
+from .fixtures import FixturesMixin
+
+
+class TestSendNotification(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        action.send(self.admin, verb=' a créé ', action_object=self.activity)
+        self.followers = [
+            CustomUser.objects.create_user('user%d@example.com' % i, 'password')
+            for i in range(7)]
+        for user in self.followers:
+            follow(user, self.activity, actor_only=False)
+
+    @override_settings(NOTIFICATION_CHUNK_SIZE=3)
+    def test_one_bulk_insert_per_chunk(self):
+        content_type = ContentType.objects.get_for_model(Activity)
+        with CaptureQueriesContext(connection) as queries:
+            tasks.send_notification(content_type.pk, self.activity.pk,
+                                    "action_object")
+
+        inserts = [q for q in queries
+                   if q['sql'].startswith('INSERT INTO "post_office_email"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Email.objects.count(), len(self.followers))
+
+
+class TestSendBookingMail(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        self.event = Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            published = True,
+            available_seats = 3,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+        self.user = CustomUser.objects.create_user('user@example.com',
+                                                   'password')
+
+    def test_mail_built_from_ids(self):
+        tasks.send_booking_mail(self.event.pk, self.user.pk,
+                                'http://example.com/')
+
+        email = Email.objects.get()
+        self.assertEqual(email.to, ['user@example.com'])
+        self.assertIn('croixluizet', email.subject)
+        self.assertIn(
+            'http://example.com/plateformeweb/event/cancel_reservation/',
+            email.html_message)
+
+    # the mails are queued on commit, which never comes in a TestCase
+    @mock.patch('plateformeweb.views.transaction.on_commit',
+                lambda send: send())
+    def test_one_mail_per_mass_booked_event(self):
+        later = Event.objects.create(
+            title = 'repairtomorrow',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            published = True,
+            available_seats = 3,
+            starts_at = self.event.starts_at + datetime.timedelta(days=1),
+            ends_at = self.event.ends_at + datetime.timedelta(days=1))
+        self.client.login(username='user@example.com', password='password')
+
+        resp = self.client.post(reverse('mass_event_book'), {
+            'dates': json.dumps([self.event.pk, later.pk])})
+        self.assertEqual(resp.status_code, 200)
+
+        emails = Email.objects.order_by('pk')
+        self.assertEqual([email.to for email in emails],
+                         [['user@example.com']] * 2)
+        self.assertEqual({email.status for email in emails}, {STATUS.queued})
+        self.assertEqual(
+            [email.html_message.count('/cancel_reservation/')
+             for email in emails], [1, 1])
+
+
+# the publication tasks are queued on commit, which never comes in a TestCase
+@mock.patch('plateformeweb.publication.transaction.on_commit',
+            lambda send: send())
+@mock.patch('plateformeweb.tasks.publish_event.apply_async')
+class TestPublication(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def create_event(self, publish_in):
+        now = timezone.now()
+        starts_at = now + datetime.timedelta(days=2)
+        return Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place,
+            publish_at = now + publish_in,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+
+    def test_scheduled_at_publish_at(self, apply_async):
+        event = self.create_event(datetime.timedelta(minutes=5))
+
+        apply_async.assert_called_once_with((event.pk,), eta=event.publish_at)
+
+    def test_later_events_left_to_the_sweep(self, apply_async):
+        event = self.create_event(datetime.timedelta(days=1))
+        apply_async.assert_not_called()
+
+        with mock.patch('plateformeweb.publication.window_end',
+                        lambda now=None: event.publish_at):
+            publication.sweep()
+        apply_async.assert_called_once_with((event.pk,), eta=event.publish_at)
+
+    def test_publish_event(self, apply_async):
+        event = self.create_event(datetime.timedelta(minutes=5))
+        # not due yet
+        self.assertEqual(tasks.publish_event(event.pk), 0)
+
+        Event.objects.filter(pk=event.pk).update(
+            publish_at=timezone.now() - datetime.timedelta(seconds=1))
+        version = cache.get('version:events')
+        self.assertEqual(tasks.publish_event(event.pk), 1)
+        self.assertTrue(Event.objects.get(pk=event.pk).published)
+        self.assertNotEqual(cache.get('version:events'), version)
+        # already published
+        self.assertEqual(tasks.publish_event(event.pk), 0)
+
+    def test_sweep_publishes_missed_events(self, apply_async):
+        event = self.create_event(datetime.timedelta(minutes=5))
+        Event.objects.filter(pk=event.pk).update(
+            publish_at=timezone.now() - datetime.timedelta(hours=1))
+
+        self.assertEqual(tasks.publish_events(), 1)
+        self.assertTrue(Event.objects.get(pk=event.pk).published)
@@ -0,0 +1,90 @@
+import datetime
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from itsdangerous import BadData, URLSafeSerializer
+
+from plateformeweb.models import *
+from plateformeweb import tokens
+
+from .fixtures import FixturesMixin
+
+
+class TestTokens(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        starts_at = timezone.now() + datetime.timedelta(days=1)
+        self.event = Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            starts_at = starts_at,
+            ends_at = starts_at + datetime.timedelta(hours=2))
+
+    def legacy_token(self, salt, data):
+        return URLSafeSerializer('some_secret_key', salt=salt).dumps(data)
+
+    def test_serializers_reused(self):
+        serializer = tokens.serializer(tokens.PRESENCE)
+        self.assertIs(tokens.serializer(tokens.PRESENCE), serializer)
+        with self.settings(SECRET_KEY='other'):
+            self.assertIsNot(tokens.serializer(tokens.PRESENCE), serializer)
+
+    def test_presence_tokens(self):
+        signed = tokens.presence_tokens(self.event.pk, [1, 2])
+
+        self.assertEqual(tokens.load_presence_token(signed[2]),
+                         (self.event.pk, 2))
+        with self.assertRaises(BadData):
+            tokens.load_cancel_token(signed[2])
+
+    def test_presence_tokens_expire(self):
+        signed = tokens.presence_tokens(self.event.pk, [1])
+
+        with self.settings(PRESENCE_TOKEN_MAX_AGE=-1):
+            with self.assertRaises(BadData):
+                tokens.load_presence_token(signed[1])
+
+    def test_cancel_token(self):
+        token = tokens.cancel_token(self.event, self.admin)
+
+        self.assertEqual(tokens.load_cancel_token(token),
+                         (self.event.pk, self.admin.pk))
+
+    def test_cancel_token_expires_with_the_event(self):
+        self.event.ends_at = timezone.now() - datetime.timedelta(minutes=1)
+        token = tokens.cancel_token(self.event, self.admin)
+
+        with self.assertRaises(BadData):
+            tokens.load_cancel_token(token)
+
+    def test_legacy_cancel_tokens(self):
+        token = self.legacy_token(tokens.CANCEL, {
+            'event_id': self.event.pk, 'user_id': self.admin.pk})
+        # refused by default
+        with self.assertRaises(BadData):
+            tokens.load_cancel_token(token)
+
+        signed_until = timezone.now() - datetime.timedelta(days=10)
+        with self.settings(LEGACY_TOKENS_SIGNED_UNTIL=signed_until):
+            self.assertEqual(tokens.load_cancel_token(token),
+                             (self.event.pk, self.admin.pk))
+
+            # no longer once the last of them is CANCEL_TOKEN_MAX_AGE old
+            with self.settings(CANCEL_TOKEN_MAX_AGE=9 * 24 * 3600):
+                with self.assertRaises(BadData):
+                    tokens.load_cancel_token(token)
+
+    def test_no_legacy_presence_tokens(self):
+        token = self.legacy_token(tokens.PRESENCE, {
+            'event_id': self.event.pk, 'user_id': self.admin.pk})
+
+        with self.settings(LEGACY_TOKENS_SIGNED_UNTIL=timezone.now()):
+            with self.assertRaises(BadData):
+                tokens.load_presence_token(token)
+
+    def test_cancel_view_rejects_bad_tokens(self):
+        resp = self.client.get(reverse('cancel_reservation',
+                                       args=['forged']))
+        self.assertEqual(resp.status_code, 400)
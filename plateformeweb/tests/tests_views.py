@@ -1,9 +1,19 @@
-from django.test import TestCase
+import datetime
+import json
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from users.models import CustomUser
 from plateformeweb.models import *
 
+from .fixtures import FixturesMixin
+
 class TestAllViews(TestCase):
     def setUp(self):
         admin_page = '/admin/'
@@ -136,3 +146,159 @@ class TestAllViews(TestCase):
         for page in authorized_views:
             resp = self.client.get(page)
             assert resp.status_code == 200
+
+
+# measures the view itself, not the anonymous page cache
+@override_settings(PAGE_CACHE_TTL=0)
+class TestEventView(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.volunteer = CustomUser.objects.create_user('bourguiba', 'password')
+        OrganizationPerson.objects.create(user=self.volunteer,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.VOLUNTEER)
+
+    def create_event(self, attendees):
+        event = Event.objects.create(
+            title = 'repairtoday',
+            organization = self.organization,
+            owner = self.admin,
+            type = self.activity,
+            location = self.place)
+        event.organizers.add(self.admin)
+        for i in range(attendees):
+            event.attendees.add(CustomUser.objects.create_user(
+                'user%d-%d@example.com' % (event.pk, i), 'password'))
+        return event
+
+    def get(self, event):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse(
+                'event_detail', kwargs={'pk': event.pk, 'slug': event.slug}))
+        assert resp.status_code == 200
+        return queries
+
+    def test_get_is_read_only(self):
+        event = self.create_event(3)
+        event.presents.add(event.attendees.first())
+        self.client.login(username='bourguiba', password='password')
+
+        queries = self.get(event)
+        writes = [q['sql'] for q in queries
+                  if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(writes, [])
+
+    def test_queries_independent_of_attendees(self):
+        small = self.create_event(2)
+        large = self.create_event(20)
+        # warm the shared caches up
+        self.get(small)
+
+        self.assertEqual(len(self.get(small)), len(self.get(large)))
+
+    def test_presence_tokens_for_organizers_only(self):
+        event = self.create_event(3)
+        url = reverse('event_detail', kwargs={'pk': event.pk,
+                                              'slug': event.slug})
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.context['presence_tokens'], {})
+        self.client.login(username='bourguiba', password='password')
+        self.assertEqual(self.client.get(url).context['presence_tokens'], {})
+
+        # an organizer, who sees the attendees as an admin
+        OrganizationPerson.objects.create(user=self.admin,
+                                          organization=self.organization,
+                                          role=OrganizationPerson.ADMIN)
+        self.client.login(username='sankara', password='password')
+        resp = self.client.get(url)
+        signed = resp.context['presence_tokens']
+        self.assertEqual(set(signed),
+                         {user.pk for user in event.attendees.all()} |
+                         {self.admin.pk})
+        for user in event.attendees.all():
+            self.assertContains(resp, 'id="%s"' % signed[user.pk])
+
+    def test_within_query_budget(self):
+        event = self.create_event(3)
+        event.presents.add(self.volunteer)
+        budget = settings.QUERY_BUDGETS['event_detail']
+
+        for username in (None, 'bourguiba', 'sankara'):
+            if username:
+                self.client.login(username=username, password='password')
+            # the first request, every cache cold
+            cache.clear()
+            ContentType.objects.clear_cache()
+            self.assertLessEqual(len(self.get(event)), budget, username)
+
+
+class TestEventCreateView(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='sankara', password='password')
+
+    def create(self, day, **data):
+        # the dates of the events created by the form
+        before = list(Event.objects.values_list('pk', flat=True))
+        resp = self.client.post(reverse('event_create'), dict({
+            'dates': json.dumps([day.timestamp()]),
+            'starts_at': 14 * 3600,
+            'ends_at': 18 * 3600,
+            'publish_at': 7,
+            'type': self.activity.pk,
+            'organization': self.organization.pk,
+            'available_seats': 10,
+            'location': self.place.pk}, **data))
+        assert resp.status_code == 302
+        return list(Event.objects.exclude(pk__in=before).values_list(
+            'starts_at', 'ends_at', 'publish_at'))
+
+    @override_settings(TIME_ZONE='Europe/Paris')
+    def test_series_and_dates_agree(self):
+        # already the next day in Paris
+        day = timezone.now().replace(hour=23, minute=30, second=0,
+                                     microsecond=0) + datetime.timedelta(days=3)
+        rrule = "DTSTART:%s\nRRULE:FREQ=DAILY;COUNT=1" % day.strftime(
+            "%Y%m%dT%H%M%SZ")
+
+        dates = self.create(day)
+        self.assertEqual(self.create(day, rrule=rrule), dates)
+        starts_at = timezone.localtime(dates[0][0])
+        self.assertEqual(starts_at.date(),
+                         timezone.localtime(day).date())
+        self.assertEqual(starts_at.hour, 14)
+
+
+class TestAnonymousPageCache(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.url = reverse('organization_list')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(self.url)
+        assert resp.status_code == 200
+        return len(queries), resp
+
+    def test_cached_until_a_change(self):
+        self.count_queries()
+        queries, resp = self.count_queries()
+        self.assertEqual(queries, 0)
+        self.assertContains(
+            resp, '<h5 class="card-title">Atelier Soudé</h5>', html=True)
+
+        self.organization.name = 'Atelier Soudé et Sablé'
+        self.organization.save()
+        queries, resp = self.count_queries()
+        self.assertGreater(queries, 0)
+        self.assertContains(
+            resp, '<h5 class="card-title">Atelier Soudé et Sablé</h5>',
+            html=True)
+
+    def test_never_served_to_users(self):
+        self.count_queries()
+        self.client.login(username='sankara', password='password')
+        queries, resp = self.count_queries()
+        self.assertGreater(queries, 0)
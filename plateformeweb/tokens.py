@@ -0,0 +1,107 @@
+import datetime
+import time
+from django.conf import settings
+from django.utils import timezone
+from itsdangerous import (BadData, SignatureExpired, URLSafeSerializer,
+                          URLSafeTimedSerializer)
+
+
+# Signed tokens of the links and forms that act on a booking without a
+# login: cancel links in the confirmation mails, presence toggles of the
+# attendee list. One serializer per salt and SECRET_KEY, built once.
+# Cancel tokens expire when their event ends, presence tokens after
+# PRESENCE_TOKEN_MAX_AGE, both checked before any query.
+
+CANCEL = 'cancel_reservation'
+PRESENCE = 'presence'
+BOOKING = 'book'
+
+# the key every token used to be signed with, public: only cancel links
+# mailed out before LEGACY_TOKENS_SIGNED_UNTIL are still accepted with it
+LEGACY_SECRET = 'some_secret_key'
+
+_serializers = {}
+
+
+def serializer(salt, timed=False, secret=None):
+    secret = secret or settings.SECRET_KEY
+    key = (secret, salt, timed)
+    if key not in _serializers:
+        cls = URLSafeTimedSerializer if timed else URLSafeSerializer
+        _serializers[key] = cls(secret, salt=salt)
+    return _serializers[key]
+
+
+def dumps(salt, data):
+    return serializer(salt).dumps(data)
+
+
+def loads(salt, token):
+    """
+    Returns the data signed in token, raises BadData if it isn't valid.
+    """
+    return serializer(salt).loads(token)
+
+
+def legacy_cancel_accepted(now=None):
+    """
+    Returns whether cancel links signed with the legacy key still work: they
+    carry no timestamp, so they expire CANCEL_TOKEN_MAX_AGE after the last
+    of them was mailed out.
+    """
+    signed_until = settings.LEGACY_TOKENS_SIGNED_UNTIL
+    if signed_until is None:
+        return False
+    max_age = datetime.timedelta(seconds=settings.CANCEL_TOKEN_MAX_AGE)
+    return (now or timezone.now()) < signed_until + max_age
+
+
+def presence_tokens(event_id, user_ids):
+    """
+    Returns {user id: presence token} for the users of an attendee list,
+    valid for PRESENCE_TOKEN_MAX_AGE.
+    """
+    sign = serializer(PRESENCE, timed=True).dumps
+    return {user_id: sign({'user_id': user_id, 'event_id': event_id})
+            for user_id in user_ids}
+
+
+def load_presence_token(token):
+    """
+    Returns the (event id, user id) of a presence token, raises BadData if it
+    isn't valid or has expired.
+    """
+    data = serializer(PRESENCE, timed=True).loads(
+        token, max_age=settings.PRESENCE_TOKEN_MAX_AGE)
+    return data['event_id'], data['user_id']
+
+
+def cancel_token(event, user):
+    """
+    Returns the token of the link cancelling the booking of user for event,
+    valid until the event ends.
+    """
+    return serializer(CANCEL, timed=True).dumps({
+        'event_id': event.pk,
+        'user_id': user.pk,
+        'until': int(event.ends_at.timestamp()),
+    })
+
+
+def load_cancel_token(token):
+    """
+    Returns the (event id, user id) of a cancel token, raises BadData if it
+    isn't valid or its event is over.
+    """
+    try:
+        data = serializer(CANCEL, timed=True).loads(
+            token, max_age=settings.CANCEL_TOKEN_MAX_AGE)
+    except SignatureExpired:
+        raise
+    except BadData:
+        if not legacy_cancel_accepted():
+            raise
+        data = serializer(CANCEL, secret=LEGACY_SECRET).loads(token)
+    if data.get('until', float('inf')) < time.time():
+        raise BadData("The event is over")
+    return data['event_id'], data['user_id']
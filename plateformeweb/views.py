@@ -1,13 +1,20 @@
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.http import JsonResponse, HttpResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponse, HttpResponseRedirect, \
+    HttpResponseBadRequest
 from django.core.exceptions import ValidationError
 from django.views.generic import DetailView, ListView, FormView, CreateView, \
     UpdateView
 from .models import *
-from itsdangerous import URLSafeSerializer, BadData
+from . import booking, dates, occurrences, tasks, tokens
+from .cache import bump_version, cache_anonymous_page
+from itsdangerous import BadData
 from post_office import mail
 from django.urls import reverse_lazy
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.decorators import method_decorator
 from django.utils import timezone
 from logging import getLogger
 from django.template.loader import render_to_string
@@ -28,7 +35,7 @@ from django.db.models.signals import post_save
 from actstream import action
 from actstream.actions import follow, unfollow
 
-from actstream.models import actor_stream, following, followers
+from actstream.models import Action, Follow, actor_stream, following, followers
 
 from django.core.mail import send_mail
 from django.utils.timezone import now
@@ -44,36 +51,25 @@ def homepage(request):
         return render (request, 'plateformeweb/home.html')
 
 def send_notification(request, target_object, target_type):
-    send_to = followers(target_object)
-    
-    if target_type == "actor":
-        notification = target_object.actor_actions.all()[:1]
-    elif target_type == "action_object":
-        notification = target_object.action_object_actions.all()[:1]
-    elif target_type == "target":
-        notification = target_object.target_actions.all()[:1]
-
-    params = {'notification': notification }
-
-    msg_plain = render_to_string('mail/notification.html',
-                                params)
-    msg_html = render_to_string('mail/notification.html',
-                                params)
-
-    subject = "nouvelle notification"
-
-    for user in send_to:
-        mail.send(
-            [user.email],
-            'no-reply@atelier-soude.fr',
-            subject=subject,
-            message=msg_plain,
-            html_message=msg_html
-        )
+    # rendering and queuing the mails of every follower is done by a worker
+    content_type = ContentType.objects.get_for_model(target_object)
+    transaction.on_commit(lambda: tasks.send_notification.delay(
+        content_type.pk, target_object.pk, target_type))
+
+
+def send_booking_mail(request, user, event):
+    # the confirmation is rendered and sent by a worker, only the ids and the
+    # site root for the absolute links travel with the task
+    base_url = request.build_absolute_uri('/')
+    transaction.on_commit(lambda: tasks.send_booking_mail.delay(
+        event.pk, user.pk, base_url))
 
 
 # TODO move all this in separate apps?
 
+@method_decorator(cache_anonymous_page(
+    'organizations', 'places', 'activities', 'events',
+    'memberships', 'actions'), name='dispatch')
 class OrganizationView(DetailView):
     model = Organization
 
@@ -82,6 +78,7 @@ class OrganizationView(DetailView):
         return context
 
 
+@method_decorator(cache_anonymous_page('organizations'), name='dispatch')
 class OrganizationListView(ListView):
     model = Organization
 
@@ -133,6 +130,9 @@ def OrganizationManager(request, pk):
 
 # --- Places ---
 
+@method_decorator(cache_anonymous_page(
+    'places', 'organizations', 'activities', 'events',
+    'actions'), name='dispatch')
 class PlaceView(DetailView):
     model = Place
 
@@ -141,6 +141,7 @@ class PlaceView(DetailView):
         return context
 
 
+@method_decorator(cache_anonymous_page('places'), name='dispatch')
 class PlaceListView(ListView):
     model = Place
 
@@ -265,6 +266,9 @@ class ConditionEditView(ConditionFormView, AjaxUpdateView):
 # --- Activity Types ---
 
 
+@method_decorator(cache_anonymous_page(
+    'activities', 'organizations', 'places', 'events',
+    'actions'), name='dispatch')
 class ActivityView(DetailView):
     model = Activity
 
@@ -273,6 +277,7 @@ class ActivityView(DetailView):
         return context
 
 
+@method_decorator(cache_anonymous_page('activities'), name='dispatch')
 class ActivityListView(ListView):
     model = Activity
 
@@ -337,55 +342,71 @@ class ActivityEditView( ActivityFormView, AjaxUpdateView):
 # --- Events ---
 
 def cancel_reservation(request, token):
-    s = URLSafeSerializer('some_secret_key', salt='cancel_reservation')
-    ret = s.loads(token)
-    event_id = ret['event_id']
-    user_id = ret['user_id']
+    try:
+        event_id, user_id = tokens.load_cancel_token(token)
+    except BadData:
+        return HttpResponseBadRequest("Lien d'annulation invalide ou expiré")
     event = Event.objects.get(pk=event_id)
     user = CustomUser.objects.get(pk=user_id)
     context = {'event': event, 'user': user}
-    attendees = event.attendees.all()
-    if user in attendees:
-        event.attendees.remove(user)
-        event.available_seats += 1
-        event.save()
+    if booking.cancel_seat(event, user):
         return render(request, 'mail/cancel_ok.html', context)
     else:
         return render(request, 'mail/cancel_failed.html', context)
 
 
+@method_decorator(cache_anonymous_page(
+    'events', 'places', 'organizations', 'activities',
+    'memberships', 'actions'), name='dispatch')
 class EventView(DetailView):
     model = Event
 
-    def get(self, request, **kwargs):
-        event = Event.objects.get(pk=kwargs['pk'])
-        confirmed = event.presents.all()
-        for person in confirmed:
-            event.attendees.remove(person)
-
-        return super().get(request)
-
-
+    def get_queryset(self):
+        # the whole page renders from this object graph
+        return Event.objects.select_related(
+            'organization', 'location__address', 'type').prefetch_related(
+            'condition', 'organizers', 'attendees', 'presents')
+
+    def get_object(self, queryset=None):
+        event = super().get_object(queryset)
+        # the memberships users/user.html lists, for everyone on the page in
+        # a single query
+        prefetch_related_objects(
+            list(event.organizers.all()) + list(event.attendees.all()) +
+            list(event.presents.all()),
+            Prefetch('organizationperson_set',
+                     queryset=OrganizationPerson.objects.select_related(
+                         'organization')))
+        return event
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         event = context['event']
         context['event_id'] = event.id
-        orga = event.organization
-        admins = orga.admins()
-        orga_volunteers = orga.volunteers()
+        roles = event.organization.roles()
+        admins = list(roles[OrganizationPerson.ADMIN])
 
-        volunteers = []
-        for v in orga_volunteers:
-            if v in event.attendees.all():
-                volunteers.append(v)
+        attendees = {user.pk for user in event.attendees.all()}
+        volunteers = [user for user in roles[OrganizationPerson.VOLUNTEER]
+                      if user.pk in attendees]
 
         context['admin_or_volunteer'] = admins + volunteers
         context['volunteers'] = volunteers
         context['admins'] = admins
+        # the presence toggles of the attendee list, signed in one go for the
+        # organizers who see them; anonymous pages, which may be cached,
+        # never carry any
+        context['presence_tokens'] = {}
+        organizers = {user.pk for user in event.organizers.all()}
+        if self.request.user.pk in organizers:
+            people = attendees | {user.pk for user in event.presents.all()}
+            people |= {user.pk for user in admins + volunteers}
+            context['presence_tokens'] = tokens.presence_tokens(event.pk,
+                                                                people)
         return context
 
 
+@method_decorator(cache_anonymous_page('events'), name='dispatch')
 class EventListView(ListView):
     queryset = {}
 
@@ -415,40 +436,7 @@ class EventEditView(PermissionRequiredMixin, AjaxUpdateView):
 
 class BookingFormView():
     def send_booking_mail(self, user, event):
-        user_id = user.id
-        event_id = event.id
-
-        serial = URLSafeSerializer('some_secret_key',
-                                   salt='cancel_reservation')
-        data = {'event_id': event_id, 'user_id': user_id}
-
-        cancel_token = serial.dumps(data)
-        cancel_url = reverse('cancel_reservation', args=[cancel_token])
-        cancel_url = self.request.build_absolute_uri(cancel_url)
-
-        event_url = reverse('event_detail', args=[event_id, event.slug])
-        event_url = self.request.build_absolute_uri(event_url)
-
-        params = {'cancel_url': cancel_url,
-                  'event_url': event_url,
-                  'event': event}
-
-        msg_plain = render_to_string('mail/relance.html',
-                                    params)
-        msg_html = render_to_string('mail/relance.html',
-                                    params)
-
-        date = event.starts_at.date().strftime("%d %B")
-        location = event.location.name
-        subject = "Votre réservation pour le " + date + " à " + location
-
-        mail.send(
-            [user.email],
-            'no-reply@atelier-soude.fr',
-            subject=subject,
-            message=msg_plain,
-            html_message=msg_html
-        )
+        send_booking_mail(self.request, user, event)
 
 class BookingEditView(BookingFormView, UpdateView):
 
@@ -459,11 +447,8 @@ class BookingEditView(BookingFormView, UpdateView):
         context = super().get_context_data(**kwargs)
         event_id = context['event'].id
 
-        serial = URLSafeSerializer('some_secret_key',
-                                   salt='book')
-
         data = {'event_id': event_id}
-        context['booking_id'] = serial.dumps(data)
+        context['booking_id'] = tokens.dumps(tokens.BOOKING, data)
         return context
 
 
@@ -478,11 +463,6 @@ class EventCreateView(CreateView):
               "organization", "location", "condition",
               "starts_at", "ends_at", "publish_at"]
 
-    def date_substract(self, starts_at, countdown):
-        #TODO: change this if haing a publish_date in the past is a problem
-        return starts_at - datetime.timedelta(days=countdown)
-
-
     def post(self, request, *args, **kwargs):
         try:
             import simplejson as json
@@ -506,32 +486,51 @@ class EventCreateView(CreateView):
 
         # today = timezone.now()
 
-        for date in date_timestamps:
-            starts_at = datetime.datetime.fromtimestamp(
-                int(date + int(request.POST['starts_at'])))
-            ends_at = datetime.datetime.fromtimestamp(
-                int(date + int(request.POST['ends_at'])))
-            publish_date = self.date_substract(starts_at, publish_countdown)
-
-            e = Event.objects.create(
+        if request.POST.get('rrule'):
+            # recurring events: only the occurrences of the coming weeks are
+            # created now, tasks.extend_event_series creates the next ones
+            series = EventSeries(
+                owner=CustomUser.objects.get(email=request.user.email),
                 organization=organization,
-                slug=new_slug,
-                owner=request.user,
-                starts_at=starts_at,
-                ends_at=ends_at,
-                publish_at=publish_date,
-                available_seats=available_seats,
-                location=location,
                 type=event_type,
+                location=location,
+                available_seats=available_seats,
+                rule=request.POST['rrule'],
+                starts_after=datetime.timedelta(
+                    seconds=int(request.POST['starts_at'])),
+                ends_after=datetime.timedelta(
+                    seconds=int(request.POST['ends_at'])),
+                publish_countdown=publish_countdown,
             )
+            try:
+                series.recurrence()
+            except ValueError:
+                return HttpResponseBadRequest("Règle de récurrence invalide")
+            series.save()
+            occurrences.materialize(series)
+            return HttpResponseRedirect(reverse("event_create"))
+
+        # the same days and hours as a series would give
+        event_dates = []
+        for date in date_timestamps:
+            day = datetime.datetime.fromtimestamp(int(date), timezone.utc)
+            event_dates += [dates.occurrence(
+                day,
+                datetime.timedelta(seconds=int(request.POST['starts_at'])),
+                datetime.timedelta(seconds=int(request.POST['ends_at'])),
+                publish_countdown)]
+
+        occurrences.create_occurrences(
+            CustomUser.objects.get(email=request.user.email),
+            event_dates,
+            new_slug,
+            title=event_type.name,
+            organization=organization,
+            available_seats=available_seats,
+            location=location,
+            type=event_type,
+        )
 
-            e.organizers.add(CustomUser.objects.get(email=request.user.email))
-            e.title = e.type.name
-            e.save()
-            action.send(self.request.user, verb=' a créé ', action_object=e, target=e.location)  
-            follow(self.request.user, e, actor_only=False)  
-
-        
         return HttpResponseRedirect(reverse("event_create"))
 
     def get_form(self, form_class=None):
@@ -574,11 +573,36 @@ class MassBookingCreateView(CreateView):
         json_data = request.POST['dates']
         events_pk = json.loads(json_data)
         events_pk = list(map(int, events_pk))
-        events = Event.objects.filter(pk__in=events_pk)
-        #TODO: bulk insert somehow?
-        for event in events:
-            event.attendees.add(request.user)
-        return HttpResponse("OK!")
+        user = request.user
+        results = booking.book_seats(events_pk, user)
+        booked = [pk for pk, result in results.items()
+                  if result == booking.BOOKED]
+
+        if booked:
+            now = timezone.now()
+            events = list(Event.objects.filter(pk__in=booked)
+                          .select_related('location'))
+            Action.objects.bulk_create([
+                Action(actor=user, verb="s'est inscrit à", target=event,
+                       timestamp=now)
+                for event in events])
+            event_type = ContentType.objects.get_for_model(Event)
+            followed = set(Follow.objects.filter(
+                user=user, content_type=event_type,
+                object_id__in=[str(pk) for pk in booked]).values_list(
+                'object_id', flat=True))
+            Follow.objects.bulk_create([
+                Follow(user=user, content_type=event_type,
+                       object_id=str(event.pk), actor_only=False, started=now)
+                for event in events if str(event.pk) not in followed])
+            # bulk_create sends no post_save
+            bump_version('actions')
+
+            base_url = request.build_absolute_uri('/')
+            transaction.on_commit(lambda: tasks.send_booking_mails.delay(
+                booked, user.pk, base_url))
+
+        return JsonResponse({'status': "OK", 'events': results})
 
     def get_form(self, form_class=None, **kwargs):
         if form_class is None:
@@ -182,6 +182,56 @@ function on_yearly (){
 
 }
 
+// rule of the last recurrence applied, sent along the dates so that the
+// server can store the series instead of every single date
+var series_rule = null;
+
+function current_rule(checked_type){
+    dates = parse_dates();
+    if (checked_type === "weekly"){
+        if (up_until == '')
+            return null;
+        checked_weekdays = document.querySelectorAll('input[name=weekday]:checked');
+        return new RRule({
+            freq: RRule.WEEKLY,
+            interval: 1,
+            byweekday: [...checked_weekdays].map(w => parseInt(w.value)),
+            dtstart: dates.now,
+            until: dates.until,
+        });
+    }
+    else if (checked_type === "monthly")
+        return rrulestr("FREQ=MONTHLY;BYDAY=" + document.getElementById("nth").value +
+                        document.getElementById("day").value +
+                        ";COUNT=" + document.getElementById("event-count-monthly").value +
+                        ";DTSTART=" + dates.now.toRRString());
+    else
+        return new RRule({
+            freq: RRule.YEARLY,
+            dtstart: dates.now,
+            count: parseInt(document.getElementById("event-count-yearly").value),
+            bymonth: parseInt(document.getElementById("month").value),
+            bymonthday: parseInt(document.getElementById("day-of-month").value),
+        });
+}
+
+// RFC 5545 description of the picked dates: the recurrence, plus the dates
+// added by hand (RDATE) and the excluded or removed ones (EXDATE)
+function series_rfc_string(rule, picked_dates){
+    var options = Object.assign({}, rule.origOptions);
+    delete options.dtstart;
+    var lines = ["DTSTART:" + rule.options.dtstart.toRRString(),
+                 "RRULE:" + new RRule(options).toString()];
+    var occurrences = rule.all();
+    var rdates = picked_dates.filter(date => occurrences.findDate(date) == -1);
+    var exdates = occurrences.filter(date => picked_dates.findDate(date) == -1);
+    if (rdates.length)
+        lines.push("RDATE:" + rdates.map(date => date.toRRString()).join(","));
+    if (exdates.length)
+        lines.push("EXDATE:" + exdates.map(date => date.toRRString()).join(","));
+    return lines.join("\n");
+}
+
 function stage_one(){
     checked_type = document.querySelector('input[name="repeat"]:checked').value;
     dates = {}
@@ -193,6 +243,7 @@ function stage_one(){
         else
             return on_yearly();
     }(checked_type);
+    series_rule = current_rule(checked_type);
     stage_two(dates);
 }
 
@@ -281,6 +332,7 @@ function reset_list(){
     document.getElementById("date-list").innerHTML = "";
     all_dates = [];
     date_ident = 0;
+    series_rule = null;
 }
 
 
@@ -431,6 +483,9 @@ function on_submit(){
             dates_timestamps.push(unix_time);
         });
         data.value = JSON.stringify(dates_timestamps);
+        if (series_rule)
+            document.getElementById("submit-rrule").value =
+                series_rfc_string(series_rule, all_dates.map(date => date[1]));
         //parse int for timestamp addition
         hidden_start.value = to_seconds(actual_start.value);
         hidden_end.value = to_seconds(actual_end.value);